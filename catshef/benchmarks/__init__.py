@@ -0,0 +1,48 @@
+"""
+Benchmarks (not part of the test suite).
+
+Run them from the project directory (the one with manage.py), e.g.:
+
+    python -m benchmarks.cart_storage
+
+Each benchmark runs against a freshly created test database, so it never
+touches the development database.
+"""
+import os
+import time
+
+def setup():
+    """
+    Setup Django and create the test database.
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'catshef.settings')
+    import django
+    django.setup()
+
+    from django.conf import settings
+    from django.db import connection
+    from django.test.utils import override_settings, setup_test_environment
+    setup_test_environment()
+    # like the tests (see catshef.test_runner)
+    override_settings(CACHES=settings.TEST_CACHES).enable()
+    connection.creation.create_test_db(verbosity=0)
+
+def timed(func, repeat=1):
+    """
+    Call `func` `repeat` times and return the average run time in
+    milliseconds.
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+def print_table(header, rows):
+    """
+    Print rows of values as a simple aligned table.
+    """
+    rows = [header] + [[str(value) for value in row] for row in rows]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    for row in rows:
+        print('  '.join(value.rjust(width) for value, width in 
+                                                        zip(row, widths)))
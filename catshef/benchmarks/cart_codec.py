@@ -0,0 +1,89 @@
+"""
+Compare the size and the (de)serialization time of the cart's session
+payload: the layout stored in the session before cart.codec (just the
+items, keyed by their option ids joined by KEY_SEPARATOR, holding Decimals)
+against the compact encoding of cart.codec (of the current dictionary
+representation, with options combination ids and price versions).
+
+Each cart has LINES items with OPTIONS options each. The old layout can
+only be pickled (it holds Decimals), the encoded one is measured with both,
+the pickle and the JSON session serializers; its times include
+encoding/decoding.
+"""
+import json
+import pickle
+from decimal import Decimal
+
+from benchmarks import setup, timed, print_table
+
+LINES = (1, 10, 50, 200)
+OPTIONS = 3
+REPEAT = 200
+
+def build_old_items(lines):
+    """
+    The items as stored in the session before cart.codec.
+    """
+    from cart import codec
+
+    items = {}
+    for product_id in range(1, lines + 1):
+        key = codec.KEY_SEPARATOR.join(str(product_id + i)
+                                                    for i in range(OPTIONS))
+        items[str(product_id)] = {key: {
+            'quantity': Decimal(2),
+            'total_options_price': Decimal('3.45'),
+            'total_final_price': Decimal('22.90'),
+        }}
+    return items
+
+def build_cart(lines):
+    """
+    The current dictionary representation of the same cart.
+    """
+    from cart import codec
+
+    items = {}
+    for product_id in range(1, lines + 1):
+        # options combination id
+        key = product_id
+        items[str(product_id)] = {key: {
+            'quantity': Decimal(2),
+            'total_options_price': Decimal('3.45'),
+            'total_final_price': Decimal('22.90'),
+            'price_version': 1,
+        }}
+    return {codec.ITEMS_KEY: items, codec.ITEM_COUNT_KEY: 2 * lines,
+        codec.PRICE_VERSION_KEY: 1, codec.REVISION_KEY: 1}
+
+def measure(lines):
+    from cart import codec
+
+    old_items = build_old_items(lines)
+    cart = build_cart(lines)
+    pickle_dumps = lambda value: pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    json_dumps = lambda value: json.dumps(value,
+                                    separators=(',', ':')).encode('latin-1')
+
+    return [
+        lines,
+        len(pickle_dumps(old_items)),
+        len(pickle_dumps(codec.encode(cart))),
+        len(json_dumps(codec.encode(cart))),
+        '{:.3f}'.format(timed(lambda: pickle.loads(pickle_dumps(old_items)),
+            REPEAT)),
+        '{:.3f}'.format(timed(lambda: codec.decode(pickle.loads(
+            pickle_dumps(codec.encode(cart)))), REPEAT)),
+        '{:.3f}'.format(timed(lambda: codec.decode(json.loads(json_dumps(
+            codec.encode(cart)).decode('latin-1'))), REPEAT)),
+    ]
+
+def main():
+    setup()
+    rows = [measure(lines) for lines in LINES]
+    print('cart payload size (bytes) and dump+load time (ms)')
+    print_table(['lines', 'old pickle B', 'codec pickle B', 'codec json B',
+        'old pickle ms', 'codec pickle ms', 'codec json ms'], rows)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Compare the cart storage backends (see cart.storage) when adding products
+to the cart with the add_to_cart view.
+
+For every backend a cart is filled with LINES different items, one
+add_to_cart request at a time, and then every item is added again (so the
+second round only updates existing items). Reported per request:
+
+    * ms: latency of the view plus saving the session (what
+      SessionMiddleware would do)
+    * session bytes: bytes of session data written
+    * cache bytes: bytes of cart data written to the cache
+    * db writes: INSERT/UPDATE/DELETE statements run (session table
+      included)
+"""
+import pickle
+import time
+
+from benchmarks import setup, print_table
+
+LINES = 40
+BACKENDS = (
+    'cart.storage.SessionCartStorage',
+    'cart.storage.DatabaseCartStorage',
+    'cart.storage.CacheCartStorage',
+)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'cart-storage-benchmark',
+    }
+}
+
+def create_products():
+    from products.models import Product, ProductOption
+
+    products = [Product.objects.create(name='Product {}'.format(i),
+        slug='product-{}'.format(i), description='Description ' * 10,
+        stock=1000, price=10, offer_price=8) for i in range(LINES)]
+    options = [ProductOption.objects.create(name='Option {}'.format(i),
+        price=1) for i in range(3)]
+    return products, options
+
+def run_backend(backend, products, options):
+    from cart import codec
+    from cart.cart import Cart
+    from cart.views import add_to_cart
+    from django.contrib.sessions.backends.db import SessionStore
+    from django.db import connection
+    from django.test import RequestFactory, override_settings
+    from django.test.utils import CaptureQueriesContext
+
+    factory = RequestFactory()
+    session_key = None
+    totals = {'ms': 0, 'session bytes': 0, 'cache bytes': 0, 'db writes': 0}
+    requests = 0
+
+    with override_settings(CART_STORAGE_BACKEND=backend, CACHES=CACHES):
+        for _ in range(2):
+            for product in products:
+                request = factory.post('/cart/add/', {
+                    'product_pk': product.pk,
+                    'options_pks': [option.pk for option in options],
+                    'quantity': 1})
+                request.session = SessionStore(session_key)
+
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    add_to_cart(request)
+                    if request.session.modified:
+                        request.session.save()
+                        totals['session bytes'] += len(request.session.encode(
+                            request.session._get_session()))
+                    totals['ms'] += (time.perf_counter() - start) * 1000
+
+                totals['db writes'] += sum(1 for query in queries
+                    if query['sql'].split()[0] in ('INSERT', 'UPDATE',
+                                                                'DELETE'))
+                if backend.endswith('CacheCartStorage'):
+                    totals['cache bytes'] += len(pickle.dumps(
+                        codec.encode(Cart(request)._cart),
+                        pickle.HIGHEST_PROTOCOL))
+                session_key = request.session.session_key
+                requests += 1
+
+    return [backend.rsplit('.', 1)[1]] + ['{:.2f}'.format(totals[key] /
+        requests) for key in ('ms', 'session bytes', 'cache bytes',
+                                                                'db writes')]
+
+def main():
+    setup()
+    products, options = create_products()
+    rows = [run_backend(backend, products, options) for backend in BACKENDS]
+    print('add_to_cart, {} items added twice (averages per request)'.format(
+        LINES))
+    print_table(['backend', 'ms', 'session bytes', 'cache bytes',
+        'db writes'], rows)
+
+if __name__ == '__main__':
+    main()
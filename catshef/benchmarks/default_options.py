@@ -0,0 +1,92 @@
+"""
+Compare ways of getting the default options of a product (see
+products.utils.default_options), as done on every add to the cart without
+options.
+
+PRODUCTS products are created, each in GROUPS option groups (out of
+ALL_GROUPS) of OPTIONS options, one of them the default. Reported (ms per
+product, and queries per product):
+
+    * per group: the groups, then the default memberships of every group,
+      then every option (the old Product.get_default_options())
+    * join: a single query joining the memberships, the groups' products
+      and the options (the cache misses)
+    * cached: the cache hits
+"""
+import random
+
+from benchmarks import setup, timed, print_table
+
+PRODUCTS = 200
+ALL_GROUPS = 50
+GROUPS = 4
+OPTIONS = 5
+
+def per_group(product):
+    from products.models import Membership
+
+    options = []
+    for group in product.groups.all():
+        for membership in Membership.objects.filter(group=group,
+                                                                default=True):
+            options.append(membership.option)
+    return options
+
+def create_products():
+    from products.models import (Product, ProductOption, ProductOptionGroup,
+        Membership)
+
+    rand = random.Random(0)
+    groups = []
+    for i in range(ALL_GROUPS):
+        group = ProductOptionGroup.objects.create(name='Group {}'.format(i),
+            type=ProductOptionGroup.RADIO)
+        for j in range(OPTIONS):
+            Membership.objects.create(group=group, default=j == 0,
+                option=ProductOption.objects.create(name='Option {}'.format(
+                    j), price=j))
+        groups.append(group)
+    products = []
+    for i in range(PRODUCTS):
+        product = Product.objects.create(name='Product {}'.format(i),
+            slug='product-{}'.format(i), description='-', stock=10, price=10)
+        product.groups.set(rand.sample(groups, GROUPS))
+        products.append(product)
+    return products
+
+def main():
+    setup()
+    from django.core.cache import cache
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from products.utils import default_options
+
+    products = create_products()
+
+    def measure(func):
+        # (the query log is limited)
+        connection.queries_log.clear()
+        with CaptureQueriesContext(connection) as queries:
+            ms = timed(lambda: [func(product) for product in products])
+        return ['{:.3f}'.format(ms / PRODUCTS),
+            '{:.1f}'.format(len(queries) / PRODUCTS)]
+
+    def join(product):
+        default_options.invalidate()
+        return product.get_default_options()
+
+    for product in products:
+        assert (sorted(option.pk for option in per_group(product)) ==
+            sorted(option.pk for option in product.get_default_options()))
+    rows = [['per group'] + measure(per_group), ['join'] + measure(join)]
+    # (the entries of the old versions would soon get the version culled
+    # from the local memory cache)
+    cache.clear()
+    default_options.get_default_options([product.pk for product in products])
+    rows.append(['cached'] + measure(lambda product:
+        product.get_default_options()))
+    print('{} products, {} groups each'.format(PRODUCTS, GROUPS))
+    print_table(['lookup', 'ms', 'queries'], rows)
+
+if __name__ == '__main__':
+    main()
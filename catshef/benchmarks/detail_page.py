@@ -0,0 +1,71 @@
+"""
+Compare rendering the product detail page (with the lazy queries of the
+template, as the view used to do, and with the detail loader) with serving
+it from the page cache (see products.utils.page_cache).
+
+A product with IMAGES images, CATEGORIES categories and nutrition is
+created (no ingridients: their thumbnails would need real image files).
+Reported: ms per request (through the test client) and queries per
+request.
+"""
+from benchmarks import setup, timed, print_table
+
+IMAGES = 5
+CATEGORIES = 5
+REPEAT = 50
+
+def create_product():
+    from products.models import (Product, Category, ProductImage,
+        ProductNutrition)
+
+    product = Product.objects.create(name='Chicken', slug='chicken',
+        description='Chicken. ' * 50, stock=10, price=10, offer_price=8,
+        nutrition=ProductNutrition.objects.create(protein=20, carbs=1,
+                                                                    fat=2))
+    images = [ProductImage.objects.create(product=product,
+        image='products/chicken-{}.jpg'.format(i)) for i in range(IMAGES)]
+    product.main_image = images[0]
+    product.save()
+    product.categories.set(Category.objects.create(
+        name='Category {}'.format(i), slug='category-{}'.format(i),
+        description='-') for i in range(CATEGORIES))
+    return product
+
+def main():
+    setup()
+    from django.core.cache import cache
+    from django.db import connection
+    from django.shortcuts import render
+    from django.test import RequestFactory
+    from django.test.utils import CaptureQueriesContext
+    from products.models import Product
+    from products.views import product_detail
+
+    create_product()
+    factory = RequestFactory()
+
+    def lazy(request, slug):
+        # the view before the detail loader and the page cache
+        product = Product.objects.get(slug=slug)
+        return render(request, 'products/detail.html', {'product': product})
+
+    def uncached(request, slug):
+        cache.clear()
+        return product_detail(request, slug)
+
+    rows = []
+    for name, view in (('lazy queries', lazy), ('detail loader', uncached),
+            ('cached', product_detail)):
+        def request():
+            request = factory.get('/product/chicken/')
+            request.session = {}
+            view(request, 'chicken')
+        request()
+        with CaptureQueriesContext(connection) as queries:
+            request()
+        rows.append([name, '{:.2f}'.format(timed(request, REPEAT)),
+            len(queries)])
+    print_table(['view', 'ms', 'queries'], rows)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Compare sorting and filtering the products by their effective price (see
+ProductQuerySet.with_prices()) in Python, with the Product properties, and
+in the database, with and without the index on the effective price.
+
+PRODUCTS products are created, with random prices and an offer for a fifth
+of them, and the first page (PER_PAGE products) of every listing in
+LISTINGS is fetched. Reported (ms):
+
+    * python: all the products loaded and sorted/filtered with
+      Product.current_price, Product.has_offer and
+      Product.discount_percentage
+    * SQL, no index: with_prices(), without the index
+    * SQL, index: with_prices(), with the index
+"""
+import random
+from decimal import Decimal
+
+from benchmarks import setup, timed, print_table
+
+PRODUCTS = 50000
+PER_PAGE = 8
+REPEAT = 5
+
+def python_listings():
+    from products.models import Product
+
+    def products():
+        return list(Product.active.only('name', 'price', 'offer_price'))
+
+    def cheapest():
+        return sorted(products(), key=lambda product: (product.current_price,
+            product.pk))[:PER_PAGE]
+
+    def price_range():
+        return sorted([product for product in products()
+            if 20 <= product.current_price < 30],
+            key=lambda product: (product.current_price, product.pk))[:PER_PAGE]
+
+    def best_offers():
+        return sorted([product for product in products()
+            if product.has_offer], key=lambda product: (
+                -product.discount_percentage, -product.pk))[:PER_PAGE]
+    return cheapest, price_range, best_offers
+
+def sql_listings():
+    from products.models import Product
+
+    products = Product.active.only('name', 'price',
+        'offer_price').with_prices()
+
+    def cheapest():
+        return list(products.order_by('effective_price', 'pk')[:PER_PAGE])
+
+    def price_range():
+        return list(products.filter(effective_price__gte=20,
+            effective_price__lt=30).order_by('effective_price', 'pk')[
+                :PER_PAGE])
+
+    def best_offers():
+        return list(products.filter(on_offer=True).order_by('-discount',
+            '-pk')[:PER_PAGE])
+    return cheapest, price_range, best_offers
+
+def create_products():
+    from products.models import Product
+
+    rand = random.Random(0)
+    products = []
+    for i in range(PRODUCTS):
+        price = Decimal(rand.randint(100, 8000)) / 100
+        offer_price = (price * Decimal(rand.randint(50, 95)) / 100
+            if rand.random() < 0.2 else None)
+        products.append(Product(name='Product {}'.format(i),
+            slug='product-{}'.format(i), description='-', stock=10,
+            price=price, offer_price=offer_price and offer_price.quantize(
+                Decimal('0.01'))))
+    Product.objects.bulk_create(products)
+
+def main():
+    setup()
+    from django.db import connection
+
+    create_products()
+    names = ('cheapest', 'price range', 'best offers')
+    python = [timed(listing, REPEAT) for listing in python_listings()]
+    with_index = [timed(listing, REPEAT) for listing in sql_listings()]
+    for listing, expected in zip(sql_listings(), python_listings()):
+        assert ([product.pk for product in listing()] ==
+            [product.pk for product in expected()])
+    with connection.cursor() as cursor:
+        cursor.execute('DROP INDEX products_product_effective_price')
+    without_index = [timed(listing, REPEAT) for listing in sql_listings()]
+
+    print('{} products'.format(PRODUCTS))
+    print_table(['listing', 'python', 'SQL, no index', 'SQL, index'],
+        [[name] + ['{:.2f}'.format(ms) for ms in times] for name, times in
+            zip(names, zip(python, without_index, with_index))])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+Compare computing the facet counts of a filtered listing with a GROUP BY
+query per facet with the in-memory facet index (see products.utils.facets).
+
+PRODUCTS products are created, with random prices, offers and nutrition,
+in 1 to 3 of the categories of a tree (ROOTS root categories, each with
+CHILDREN children, each with CHILDREN children) and with 2 to 6 of
+INGRIDIENTS ingridients. For every selection in SELECTIONS, the matching
+products are counted and the count of every facet value computed. Reported
+(ms):
+
+    * build: building the index of all the products
+    * the selections: the counts with GROUP BY queries, and with the index
+    * update: changing the price of a product and bringing the index up to
+      date
+"""
+import random
+from decimal import Decimal
+
+from benchmarks import setup, timed, print_table
+
+PRODUCTS = 50000
+ROOTS = 5
+CHILDREN = 5
+INGRIDIENTS = 300
+REPEAT = 5
+SELECTIONS = (
+    ('none', {}),
+    ('price', {'price': {'5-10', '10-20'}}),
+    ('3 facets', {'price': {'5-10', '10-20'}, 'category': None,
+        'protein': {'10-20'}}),
+    ('5 facets', {'price': {'5-10', '10-20'}, 'category': None,
+        'protein': {'10-20'}, 'offer': {'1'}, 'ingridient': None}),
+)
+
+def create_products():
+    from products.models import (Product, Category, Ingridient,
+        ProductNutrition)
+
+    rand = random.Random(0)
+    categories = []
+    parents = [None]
+    for depth in range(3):
+        children = []
+        for parent in parents:
+            for i in range(ROOTS if parent is None else CHILDREN):
+                children.append(Category.objects.create(
+                    name='Category {}'.format(len(categories)),
+                    slug='category-{}'.format(len(categories)),
+                    description='-', parent=parent))
+                categories.append(children[-1])
+        parents = children
+    ingridients = [Ingridient.objects.create(name='Ingridient {}'.format(i),
+        slug='ingridient-{}'.format(i), image='i.png')
+        for i in range(INGRIDIENTS)]
+
+    ProductNutrition.objects.bulk_create([ProductNutrition(
+        protein=rand.randint(0, 40), carbs=rand.randint(0, 80),
+        fat=rand.randint(0, 30), calories=rand.randint(0, 600))
+        for _ in range(PRODUCTS)])
+    nutrition_ids = list(ProductNutrition.objects.values_list('pk',
+                                                                flat=True))
+    products = []
+    for i in range(PRODUCTS):
+        price = Decimal(rand.randint(100, 8000)) / 100
+        products.append(Product(name='Product {}'.format(i),
+            slug='product-{}'.format(i), description='-', stock=10,
+            price=price, offer_price=price * Decimal('0.8')
+                if rand.random() < 0.2 else None,
+            nutrition_id=nutrition_ids[i] if rand.random() < 0.8 else None))
+    Product.objects.bulk_create(products)
+
+    product_ids = list(Product.objects.values_list('pk', flat=True))
+    Through = Product.categories.through
+    Through.objects.bulk_create([Through(product_id=pk,
+        category_id=category.pk) for pk in product_ids
+        for category in rand.sample(parents, rand.randint(1, 3))])
+    Through = Product.ingridients.through
+    Through.objects.bulk_create([Through(product_id=pk,
+        ingridient_id=ingridient.pk) for pk in product_ids
+        for ingridient in rand.sample(ingridients, rand.randint(2, 6))])
+    return categories[0], ingridients[:50]
+
+def orm_counts(selection):
+    """
+    Count the matching products and the products of every facet value with
+    a query per facet (filtered by the selection of the other facets).
+    """
+    from django.db.models import Case, CharField, Count, F, Value, When
+    from products.models import Product
+    from products.utils import facets
+
+    def band(field, bands):
+        # (Value(), or SQLite compares the expressions with the bounds as
+        # text)
+        return Case(*[When(**{field + '__gte': Value(bound), field + '__lt':
+            Value(bands[i + 1] if i + 1 < len(bands) else 10 ** 9),
+            'then': Value(facets.get_band(bound, bands))})
+            for i, bound in enumerate(bands)], output_field=CharField())
+
+    groups = {
+        'price': band('effective_price', facets.PRICE_BANDS),
+        'offer': Case(When(offer_price__lt=F('price'), then=Value('1')),
+            default=Value('0'), output_field=CharField()),
+        'category': F('categories__ancestor_links__ancestor_id'),
+        'ingridient': F('ingridients'),
+    }
+    groups.update((facet, band('nutrition__' + facet, bands))
+        for facet, bands in facets.NUTRITION_BANDS.items())
+
+    def filtered(skip=None):
+        products = Product.active.annotate(effective_price=Case(
+            When(offer_price__lt=F('price'), then=F('offer_price')),
+            default=F('price')))
+        for facet, values in selection.items():
+            if facet != skip:
+                products = products.annotate(**{'_' + facet: groups[facet]})
+                products = products.filter(**{'_' + facet + '__in': values})
+        return products
+
+    count = filtered().values('pk').distinct().count()
+    counts = {facet: dict(filtered(facet).annotate(value=group).values(
+        'value').annotate(count=Count('pk', distinct=True)).values_list(
+            'value', 'count'))
+        for facet, group in groups.items()}
+    return count, counts
+
+def main():
+    setup()
+    from products.models import Product
+    from products.utils import facets
+
+    category, ingridients = create_products()
+    selections = []
+    for name, selection in SELECTIONS:
+        selection = dict(selection)
+        if 'category' in selection:
+            selection['category'] = {str(category.pk)}
+        if 'ingridient' in selection:
+            selection['ingridient'] = {str(ingridient.pk)
+                                                for ingridient in ingridients}
+        selections.append((name, selection))
+
+    build = timed(facets.FacetIndex.build)
+    facets.get_index()
+    rows = []
+    for name, selection in selections:
+        bitset, counts = facets.filter_products(selection)
+        count, expected = orm_counts(selection)
+        assert count == facets.count(bitset)
+        assert all({value: n for value, n in counts[facet].items() if n} ==
+            {str(value): n for value, n in expected[facet].items()
+                                if value is not None} for facet in counts)
+        rows.append([name, count, '{:.1f}'.format(timed(
+            lambda: orm_counts(selection), REPEAT)), '{:.2f}'.format(timed(
+                lambda: facets.filter_products(selection), REPEAT))])
+
+    product = Product.objects.first()
+
+    def update():
+        product.price += 1
+        product.save()
+        facets.get_index()
+
+    print('{} products, index build: {:.0f} ms, update: {:.2f} ms'.format(
+        PRODUCTS, build, timed(update, REPEAT)))
+    print_table(['selection', 'matches', 'GROUP BY', 'index'], rows)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Compare OFFSET pagination (django.core.paginator.Paginator, as the listing
+views used to do) with keyset pagination (common.pagination) on the
+category and related products listings.
+
+PRODUCTS products are created in one category. For every listing the first
+page and page DEEP_PAGE are fetched; reported per page (ms) is the time to
+get the products of the page, plus the COUNT(*) query the Paginator needs
+to validate the page number.
+"""
+from benchmarks import setup, timed, print_table
+
+PRODUCTS = 5000
+PER_PAGE = 8
+DEEP_PAGE = 500
+REPEAT = 20
+
+def create_products():
+    from products.models import Product, Category
+
+    category = Category.objects.create(name='Category', slug='category',
+        description='-')
+    Product.objects.bulk_create([Product(name='Product {}'.format(i),
+        slug='product-{}'.format(i), description='Description ' * 10,
+        stock=10, price=10) for i in range(PRODUCTS)])
+    Through = Product.categories.through
+    Through.objects.bulk_create([Through(product_id=pk,
+        category_id=category.pk)
+        for pk in Product.objects.values_list('pk', flat=True)])
+    return category, Product.objects.first()
+
+def get_cursor(paginator, page_number):
+    """
+    The cursor of the given (1-based) page.
+    """
+    if page_number == 1:
+        return None
+    last = paginator.queryset[(page_number - 1) * PER_PAGE - 1]
+    return paginator._encode([getattr(last, name)
+                                            for name, desc in paginator._keys])
+
+def main():
+    setup()
+    from common.pagination import KeysetPaginator
+    from django.core.paginator import Paginator
+    from products.models import Product
+    from products.views import CATEGORY_ORDERING, RELATED_ORDERING
+
+    category, product = create_products()
+    listings = (
+        ('category', Product.objects.filter(categories=category).for_listing(),
+            CATEGORY_ORDERING),
+        ('related', product.similar_products().for_listing(),
+            RELATED_ORDERING),
+    )
+
+    rows = []
+    for name, queryset, ordering in listings:
+        for page_number in (1, DEEP_PAGE):
+            def offset():
+                paginator = Paginator(queryset.order_by(*ordering), PER_PAGE)
+                list(paginator.page(page_number))
+
+            paginator = KeysetPaginator(queryset, ordering, PER_PAGE)
+            cursor = get_cursor(paginator, page_number)
+            expected = list(Paginator(queryset.order_by(*ordering),
+                PER_PAGE).page(page_number))
+            assert list(paginator.page(cursor)) == expected
+
+            def keyset():
+                list(paginator.page(cursor))
+
+            rows.append([name, page_number,
+                '{:.2f}'.format(timed(offset, REPEAT)),
+                '{:.2f}'.format(timed(keyset, REPEAT))])
+    print('{} products, {} per page'.format(PRODUCTS, PER_PAGE))
+    print_table(['listing', 'page', 'offset ms', 'keyset ms'], rows)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Compare the MinHash/LSH similar products (see products.utils.minhash) with
+the exact Jaccard similarity, on synthetic catalogs of SIZES products.
+
+Products are variations of "recipes" (RECIPE_SIZE products per recipe): a
+recipe has 2 of CATEGORIES categories and 6 of INGRIDIENTS ingridients, and
+every product drops each of them with probability DROP and adds up to 2
+random ingridients. The signatures and buckets are computed with the
+functions used for the database, but indexed in memory.
+
+For QUERIES random products, the exact neighbours are found by comparing
+with every other product. Reported:
+
+    * build s: computing the signatures and buckets of all the products
+    * exact ms / lsh ms: average time to find the neighbours of a product
+    * candidates: average number of products sharing a bucket
+    * recall@10: fraction of the LSH top 10 that are in the exact top 10
+      (ties included)
+    * recall>=0.5: fraction of the products with similarity >= 0.5 found
+      among the candidates
+"""
+import random
+import time
+from collections import defaultdict
+
+from benchmarks import setup, print_table
+
+SIZES = (10000, 100000)
+CATEGORIES = 200
+INGRIDIENTS = 2000
+RECIPE_SIZE = 10
+DROP = 0.15
+QUERIES = 100
+TOP = 10
+THRESHOLD = 0.5
+
+def create_products(size, rand):
+    from products.utils import minhash
+
+    recipes = [minhash.get_features(rand.sample(range(CATEGORIES), 2),
+        rand.sample(range(INGRIDIENTS), 6))
+        for _ in range(size // RECIPE_SIZE)]
+    products = []
+    for _ in range(size):
+        features = {feature for feature in rand.choice(recipes)
+                                                if rand.random() > DROP}
+        features.update(minhash.get_features((), rand.sample(
+            range(INGRIDIENTS), rand.randint(0, 2))))
+        products.append(features)
+    return products
+
+def jaccard(features1, features2):
+    return len(features1 & features2) / len(features1 | features2)
+
+def run(size):
+    from products.utils import minhash
+
+    rand = random.Random(size)
+    products = create_products(size, rand)
+
+    start = time.perf_counter()
+    signatures = [minhash.get_signature(features) for features in products]
+    buckets = defaultdict(list)
+    for pk, signature in enumerate(signatures):
+        for bucket in minhash.get_buckets(signature):
+            buckets[bucket].append(pk)
+    build = time.perf_counter() - start
+
+    exact_time = lsh_time = 0
+    candidates_count = found_top = found_similar = total_similar = 0
+    for query in rand.sample(range(size), QUERIES):
+        start = time.perf_counter()
+        scores = sorted(((jaccard(products[query], features), pk)
+            for pk, features in enumerate(products) if pk != query),
+            reverse=True)
+        exact_time += time.perf_counter() - start
+        cutoff = scores[TOP - 1][0]
+        exact_top = {pk for score, pk in scores if score >= cutoff}
+        similar = {pk for score, pk in scores if score >= THRESHOLD}
+
+        start = time.perf_counter()
+        signature = signatures[query]
+        candidates = {pk for bucket in minhash.get_buckets(signature)
+                        for pk in buckets[bucket]}
+        candidates.discard(query)
+        lsh_top = sorted(((minhash.estimate_similarity(signature,
+            signatures[pk]), pk) for pk in candidates), reverse=True)[:TOP]
+        lsh_time += time.perf_counter() - start
+
+        candidates_count += len(candidates)
+        found_top += len({pk for score, pk in lsh_top} & exact_top)
+        found_similar += len(similar & candidates)
+        total_similar += len(similar)
+
+    return [size, '{:.1f}'.format(build),
+        '{:.2f}'.format(exact_time * 1000 / QUERIES),
+        '{:.2f}'.format(lsh_time * 1000 / QUERIES),
+        candidates_count // QUERIES,
+        '{:.3f}'.format(found_top / (TOP * QUERIES)),
+        '{:.3f}'.format(found_similar / total_similar)]
+
+def main():
+    setup()
+    print_table(['products', 'build s', 'exact ms', 'lsh ms', 'candidates',
+        'recall@10', 'recall>=0.5'], [run(size) for size in SIZES])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Compare creating option groups, options and memberships one by one (with
+Membership.save() validating every membership) with importing them in bulk
+(see products.utils.option_import).
+
+GROUPS radio groups of OPTIONS options each (the first one the default) are
+created, each for a product out of PRODUCTS. Reported (ms):
+
+    * save: creating every object with save() (and adding the products)
+    * import: import_options() with the same batch
+"""
+from benchmarks import setup, timed, print_table
+
+PRODUCTS = 100
+GROUPS = 100
+OPTIONS = 20
+REPEAT = 3
+
+def get_batch():
+    return {
+        'options': [{'key': 'o{}-{}'.format(i, j), 'name': 'Option {}'.format(
+            j), 'price': '{}.50'.format(j)}
+            for i in range(GROUPS) for j in range(OPTIONS)],
+        'groups': [{'key': 'g{}'.format(i), 'name': 'Group {}'.format(i),
+            'type': 'radio', 'products': ['product-{}'.format(i % PRODUCTS)]}
+            for i in range(GROUPS)],
+        'memberships': [{'group': 'g{}'.format(i),
+            'option': 'o{}-{}'.format(i, j), 'default': j == 0}
+            for i in range(GROUPS) for j in range(OPTIONS)],
+    }
+
+def save(batch):
+    from django.db import transaction
+    from products.models import (Product, ProductOption, ProductOptionGroup,
+        Membership)
+
+    with transaction.atomic():
+        products = dict(Product.objects.values_list('slug', 'pk'))
+        options = {item['key']: ProductOption.objects.create(
+            name=item['name'], price=item['price'])
+            for item in batch['options']}
+        groups = {}
+        for item in batch['groups']:
+            group = groups[item['key']] = ProductOptionGroup.objects.create(
+                name=item['name'], type=ProductOptionGroup.RADIO)
+            group.products.add(*[products[slug] for slug in item['products']])
+        for item in batch['memberships']:
+            Membership.objects.create(group=groups[item['group']],
+                option=options[item['option']], default=item['default'])
+
+def main():
+    setup()
+    from products.models import Product
+    from products.utils import option_import
+
+    Product.objects.bulk_create([Product(name='Product {}'.format(i),
+        slug='product-{}'.format(i), description='-', stock=10, price=10)
+        for i in range(PRODUCTS)])
+    batch = get_batch()
+    rows = [['save', '{:.0f}'.format(timed(lambda: save(batch), REPEAT))],
+        ['import', '{:.0f}'.format(timed(
+            lambda: option_import.import_options(batch), REPEAT))]]
+    print('{} groups of {} options'.format(GROUPS, OPTIONS))
+    print_table(['method', 'ms'], rows)
+
+if __name__ == '__main__':
+    main()
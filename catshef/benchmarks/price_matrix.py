@@ -0,0 +1,109 @@
+"""
+Compare pricing products with some of their options from model instances
+with pricing them with the price matrices (see products.utils.price_matrix),
+as for price quotes.
+
+PRODUCTS products are created, each in GROUPS option groups (out of
+ALL_GROUPS) of OPTIONS options. QUOTES random (product, options, quantity)
+tuples, with an option of every group of the product, are priced. Reported
+(ms per quote, and queries per quote):
+
+    * instances: fetching the product, then every option, and summing their
+      prices
+    * matrices: getting the matrices of all the products of the quotes
+      (cache misses), then pricing with them
+    * cached: the same, with the matrices cached
+"""
+import random
+
+from benchmarks import setup, timed, print_table
+
+PRODUCTS = 200
+ALL_GROUPS = 50
+GROUPS = 4
+OPTIONS = 5
+QUOTES = 1000
+
+def create_products():
+    from products.models import (Product, ProductOption, ProductOptionGroup,
+        Membership)
+
+    rand = random.Random(0)
+    groups = []
+    for i in range(ALL_GROUPS):
+        group = ProductOptionGroup.objects.create(name='Group {}'.format(i),
+            type=ProductOptionGroup.RADIO)
+        group.option_ids = []
+        for j in range(OPTIONS):
+            option = ProductOption.objects.create(name='Option {}'.format(j),
+                price=rand.randint(0, 300) / 100)
+            Membership.objects.create(group=group, option=option,
+                default=j == 0)
+            group.option_ids.append(option.pk)
+        groups.append(group)
+    quotes = []
+    for i in range(PRODUCTS):
+        product = Product.objects.create(name='Product {}'.format(i),
+            slug='product-{}'.format(i), description='-', stock=10,
+            price=rand.randint(100, 3000) / 100)
+        product_groups = rand.sample(groups, GROUPS)
+        product.groups.set(product_groups)
+        quotes.extend((product.pk, [rand.choice(group.option_ids)
+            for group in product_groups], rand.randint(1, 5))
+            for _ in range(QUOTES // PRODUCTS))
+    rand.shuffle(quotes)
+    return quotes
+
+def instances(quotes):
+    from products.models import Product, ProductOption
+    from products.utils.conversion import round_decimal
+
+    totals = []
+    for product_id, option_ids, quantity in quotes:
+        product = Product.objects.get(pk=product_id)
+        options_price = sum(ProductOption.objects.get(pk=pk).price
+            for pk in option_ids)
+        totals.append(round_decimal((product.current_price + options_price)
+            * quantity))
+    return totals
+
+def matrices(quotes):
+    from products.utils import price_matrix
+
+    by_product = price_matrix.get_price_matrices({product_id
+        for product_id, option_ids, quantity in quotes})
+    return [by_product[product_id].quote(option_ids,
+        quantity).total_final_price
+        for product_id, option_ids, quantity in quotes]
+
+def main():
+    setup()
+    from django.core.cache import cache
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from products.utils import price_matrix
+
+    quotes = create_products()
+
+    def measure(func, before=None):
+        connection.queries_log.clear()
+        with CaptureQueriesContext(connection) as queries:
+            ms = timed(lambda: (before and before(), func(quotes)))
+        return ['{:.4f}'.format(ms / QUOTES),
+            '{:.3f}'.format(len(queries) / QUOTES)]
+
+    def cold():
+        cache.clear()
+        price_matrix._cache.clear_local()
+
+    assert instances(quotes) == matrices(quotes)
+    rows = [['instances'] + measure(instances),
+        ['matrices'] + measure(matrices, cold)]
+    matrices(quotes)
+    rows.append(['cached'] + measure(matrices))
+    print('{} quotes of {} products, {} options each'.format(QUOTES,
+        PRODUCTS, GROUPS))
+    print_table(['pricing', 'ms', 'queries'], rows)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Compare the product search backends (see products.search) with a naive
+icontains filter on the name and description.
+
+PRODUCTS products are created, with random names and descriptions (words
+picked from a vocabulary of WORDS words, the common ones more often) and in
+1 to 3 of CATEGORIES categories. For every backend the index is built
+(with rebuild()) and then every query in QUERIES is run. Reported (ms):
+the build time and, for every query, the time to get the first page of
+results (PER_PAGE pks), plus the number of products it matches. The
+icontains filter isn't ranked, so it stops at the first PER_PAGE matches,
+which are found quickly for the common words.
+"""
+import random
+import time
+
+from benchmarks import setup, timed, print_table
+
+PRODUCTS = 100000
+WORDS = 20000
+CATEGORIES = 50
+PER_PAGE = 8
+REPEAT = 10
+# (common word, less common word, rare word, two words, prefix)
+QUERIES = ('word00003', 'word00250', 'word04321', 'word00003 word00017',
+    'word0432')
+BACKENDS = (
+    'products.search.SQLiteSearchBackend',
+    'products.search.TermSearchBackend',
+)
+
+def create_products():
+    from products.models import Product, Category
+
+    rand = random.Random(0)
+    # (no word is the beginning of another one)
+    vocabulary = ['word{:05d}'.format(i) for i in range(WORDS)]
+    # Zipf-like: the i-th word is picked with probability ~ 1 / (i + 50),
+    # so the most common words are in ~10% of the products
+    weights = [1 / (i + 50) for i in range(WORDS)]
+
+    def text(words):
+        return ' '.join(rand.choices(vocabulary, weights, k=words))
+
+    categories = [Category.objects.create(name=text(2), 
+        slug='category-{}'.format(i), description='-') 
+        for i in range(CATEGORIES)]
+    Product.objects.bulk_create([Product(name=text(3), 
+        slug='product-{}'.format(i), description=text(30), stock=10,
+        price=10) for i in range(PRODUCTS)])
+    Through = Product.categories.through
+    Through.objects.bulk_create([Through(product_id=pk, 
+        category_id=category.pk)
+        for pk in Product.objects.values_list('pk', flat=True)
+        for category in rand.sample(categories, rand.randint(1, 3))])
+
+def icontains_search(query, limit):
+    from django.db.models import Q
+    from products.models import Product
+    from products.search import get_words
+
+    products = Product.active.all()
+    for word in get_words(query):
+        products = products.filter(Q(name__icontains=word) |
+            Q(description__icontains=word))
+    return list(products.values_list('pk', flat=True)[:limit])
+
+def main():
+    setup()
+    from django.test import override_settings
+    from products.search import get_search_backend
+
+    create_products()
+    with override_settings(PRODUCT_SEARCH_BACKEND=BACKENDS[0]):
+        backend = get_search_backend()
+        backend.rebuild()
+        rows = [['matches', '-'] + [len(backend.search(query, 0, PRODUCTS))
+                                                        for query in QUERIES]]
+        backend.clear()
+    rows += [['icontains', '-'] + ['{:.2f}'.format(timed(
+        lambda: icontains_search(query, PER_PAGE), REPEAT))
+        for query in QUERIES]]
+    for backend_path in BACKENDS:
+        with override_settings(PRODUCT_SEARCH_BACKEND=backend_path):
+            backend = get_search_backend()
+            start = time.perf_counter()
+            backend.rebuild()
+            build = (time.perf_counter() - start) * 1000
+            rows.append([backend_path.rsplit('.', 1)[1], 
+                '{:.0f}'.format(build)] + ['{:.2f}'.format(timed(
+                    lambda: backend.search(query, 0, PER_PAGE), REPEAT))
+                for query in QUERIES])
+            backend.clear()
+    print('{} products'.format(PRODUCTS))
+    print_table(['backend', 'build'] + ['"{}"'.format(query) 
+                                                for query in QUERIES], rows)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Compare computing the similar products from the categories (as
+Product.similar_products() used to do) with reading them from the
+precomputed ProductSimilarity rows.
+
+PRODUCTS products are created, each in CATEGORIES_PER_PRODUCT of
+CATEGORIES categories. Reported (ms):
+
+    * first page: the first page of the related products listing (see the
+      product_related view), averaged over SAMPLE products
+    * rebuild: recomputing the similar products of every product (the
+      rebuild_similarities command)
+    * add category: adding a category to a product, including the
+      incremental update of the similar products
+"""
+import random
+
+from benchmarks import setup, timed, print_table
+
+PRODUCTS = 5000
+CATEGORIES = 40
+CATEGORIES_PER_PRODUCT = 3
+SAMPLE = 50
+PER_PAGE = 8
+
+def create_products():
+    from products.models import Product, Category
+    from products.utils import similarity
+
+    random.seed(0)
+    categories = [Category.objects.create(name='Category {}'.format(i),
+        slug='category-{}'.format(i), description='-')
+        for i in range(CATEGORIES)]
+    Product.objects.bulk_create([Product(name='Product {}'.format(i),
+        slug='product-{}'.format(i), description='Description ' * 10,
+        stock=10, price=10) for i in range(PRODUCTS)])
+    Through = Product.categories.through
+    Through.objects.bulk_create([Through(product_id=pk, category_id=category.pk)
+        for pk in Product.objects.values_list('pk', flat=True)
+        for category in random.sample(categories, CATEGORIES_PER_PRODUCT)])
+    rebuild_ms = timed(similarity.rebuild)
+    return categories, list(Product.objects.all()), rebuild_ms
+
+def main():
+    setup()
+    from products.models import Product
+
+    categories, products, rebuild_ms = create_products()
+    sample = random.sample(products, SAMPLE)
+
+    def computed():
+        for product in sample:
+            list(product.similar_products(
+                manager=Product.active).for_listing()[:PER_PAGE])
+
+    def materialized():
+        for product in sample:
+            list(product.similar_products().for_listing()[:PER_PAGE])
+
+    def add_category():
+        for product in sample:
+            product.categories.add(random.choice(categories))
+
+    print('{} products, {} categories ({} per product)'.format(PRODUCTS,
+        CATEGORIES, CATEGORIES_PER_PRODUCT))
+    print_table(['', 'ms'], [
+        ['first page (computed)', '{:.2f}'.format(timed(computed) / SAMPLE)],
+        ['first page (materialized)', 
+            '{:.2f}'.format(timed(materialized) / SAMPLE)],
+        ['rebuild', '{:.0f}'.format(rebuild_ms)],
+        ['add category', '{:.2f}'.format(timed(add_category) / SAMPLE)],
+    ])
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,22 @@
 import collections
+import contextlib
+import time
+from copy import deepcopy
 from decimal import Decimal
 
 from catshef.exceptions import ArgumentError
 from cart.exceptions import (NegativeQuantityException,
     ProductUnavailableException, ProductStockZeroException)
+from cart.codec import (ITEMS_KEY, ITEM_COUNT_KEY, PRICE_VERSION_KEY,
+    REVISION_KEY, is_legacy_key, get_option_ids)
+from cart.storage import get_storage
+from products.utils import combinations, price_matrix
 from products.utils.conversion import round_decimal, to_decimal
+from products.utils.pricing import get_price_version
 
 from django.conf import settings
-from products.models import Product, ProductOption, Membership
+from products.models import (Product, ProductOption, Membership,
+    OptionCombination)
 
 class Cart(object):
     SESSION_ID = getattr(settings, 'CART_SESSION_ID', 'catshef.cart')
@@ -19,21 +28,42 @@ class Cart(object):
     DEFAULT_SHIPPING_PRICE = to_decimal(getattr(settings,
         'DEFAULT_SHIPPING_PRICE', 10))
 
-    KEY_SEPARATOR = ':'
+    # keys of the cart's dictionary representation
+    ITEMS_KEY = ITEMS_KEY
+    ITEM_COUNT_KEY = ITEM_COUNT_KEY
+    PRICE_VERSION_KEY = PRICE_VERSION_KEY
+    REVISION_KEY = REVISION_KEY
 
     def __init__(self, request):
         """
-        Initialize cart from a request instance. Internally the cart is stored
-        in the session. All of the Cart internals work with Decimals.
-        All of the Cart methods return a Decimal (except for 
-        magic methods).
+        Initialize cart from a request instance. The cart is stored by the
+        storage backend set in the CART_STORAGE_BACKEND setting (see 
+        cart.storage), by default in the session. All of the Cart internals
+        work with Decimals. All of the Cart methods return a Decimal (except
+        for magic methods).
+
+        NOTE: an empty cart is only stored when it's first changed, so just
+        creating (or reading) a cart never causes a session to be created or
+        saved.
         """
         self.session = request.session
-        cart = self.session.get(Cart.SESSION_ID)
+        self.storage = get_storage(request)
+        cart = self.storage.load()
         if not cart:
-            # init empty cart in session
-            cart = self.session[Cart.SESSION_ID] = {}
+            # init empty cart (not stored until it's changed)
+            cart = self._get_empty_cart()
         self._cart = cart
+        # (product id, key) of the items changed since the last save()
+        self._changed_lines = set()
+        self._summary = None
+        # the items, as returned by __iter__() (see __iter__())
+        self._items = None
+        # option combinations already resolved (by id and by option ids), so
+        # that they're only looked up once per cart
+        self._combinations = {}
+        self._combination_ids = {}
+        # if True, save() is deferred until the end of the batch (see batch())
+        self._in_batch = False
 
     def add(self, product, options=None, quantity=1, update_quantity=False):
         """
@@ -87,28 +117,33 @@ class Cart(object):
         final_price_needs_update = True
         product_id = str(product.pk)
 
-        # let's build the key
-        key = self._get_product_key(options)
+        # the key is the id of the options' combination
+        combination = self._get_combination(options)
+        key = combination.id
         
-        if product_id not in self._cart:
+        if product_id not in self._raw_cart:
             # it's the first time that product is being added to the cart
-            self._cart[product_id] = {}
+            self._raw_cart[product_id] = {}
 
-        cart_product = self._cart[product_id]
+        cart_product = self._raw_cart[product_id]
+        self._changed_lines.add((product_id, key))
         if key not in cart_product:
             # it's the first time the product with such options (or without 
             # them) is being added to the cart
             cart_product[key] = self._init_cart_product(product,
-                options, quantity)
+                combination, quantity)
             final_price_needs_update = False
-        
+
+        previous_quantity = cart_product[key]['quantity']
         if update_quantity:
             cart_product[key]['quantity'] = quantity
         else:
             cart_product[key]['quantity'] += quantity
+        self._cart[Cart.ITEM_COUNT_KEY] += int(cart_product[key]['quantity'] 
+                                                        - previous_quantity)
 
         if final_price_needs_update:
-            self._update_product_total_final_price(product, options)
+            self._set_item_prices(cart_product[key], product, combination)
 
         self.save()
 
@@ -128,89 +163,148 @@ class Cart(object):
         Removes the product from cart.
         """
         key = self._get_product_key(options)
-        cart_product = self._cart.get(str(product.pk))
+        product_id = str(product.pk)
+        cart_product = self._raw_cart.get(product_id)
         if cart_product:
             if cart_product.get(key):
+                self._cart[Cart.ITEM_COUNT_KEY] -= int(
+                                                cart_product[key]['quantity'])
                 del cart_product[key]
+                self._changed_lines.add((product_id, key))
+                if not cart_product:
+                    # no more items of this product in the cart
+                    del self._raw_cart[product_id]
                 self.save()
 
     def clear(self):
-        self._cart = {}
+        if not self.has_items():
+            # nothing to clear, so don't touch the session
+            return
+        self._changed_lines.update((product_id, key) 
+            for product_id, product_cart in self._raw_cart.items()
+            for key in product_cart)
+        revision = self.revision
+        self._cart = self._get_empty_cart()
+        # keep counting, so that the revision is never reused
+        self._cart[Cart.REVISION_KEY] = revision
         self.save()
 
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Context manager that groups several changes to the cart, so that the
+        cart is only saved once, at the end of the batch. If an exception is
+        raised inside the batch, all of the changes made in it are discarded
+        (and the exception is re-raised).
+
+        Usage:
+            with cart.batch():
+                cart.add(product=p1, quantity=2)
+                cart.add(product=p2, quantity=1)
+        """
+        previous_cart = self._cart
+        previous_changed_lines = set(self._changed_lines)
+        # work on a copy, so that the cart can be rolled back to
+        # previous_cart if an exception is raised
+        self._cart = deepcopy(previous_cart)
+        self._in_batch = True
+        try:
+            yield self
+        except Exception:
+            self._cart = previous_cart
+            self._changed_lines = previous_changed_lines
+            self._summary = None
+            self._items = None
+            raise
+        finally:
+            self._in_batch = False
+
+        if self._changed_lines:
+            self.save()
+
     def save(self):
         """
-        Save the cart in session.
+        Save the cart using the storage backend.
         """
-        self.session[Cart.SESSION_ID] = self._cart
-        self.session.modified = True
+        if not self._in_batch:
+            self._upgrade_legacy_keys()
+            revision = self.revision
+            # a new cart starts at the current time (in milliseconds), so that
+            # it doesn't reuse the revisions of a previous (lost) cart
+            self._cart[Cart.REVISION_KEY] = (revision + 1 if revision 
+                                            else int(time.time() * 1000))
+            self.storage.save(self._cart, self._changed_lines)
+            self._changed_lines = set()
+        # the cart has changed, so the items and totals need to be recomputed
+        self._summary = None
+        self._items = None
+
+    @property
+    def revision(self):
+        """
+        The cart's revision: it changes every time the cart is saved, so it
+        can be used to tell whether the cart changed (e.g. in ETags). A cart
+        which was never saved has revision 0.
+        """
+        return self._cart.get(Cart.REVISION_KEY) or 0
 
     # price related methods
+    @property
+    def summary(self):
+        """
+        Get the cart's CartSummary (all of the totals, computed in a single
+        pass over the cart). The summary is computed on first access and is
+        reused until the cart is changed (i.e. until save() is called).
+        """
+        if self._summary is None:
+            self._summary = CartSummary(self)
+        return self._summary
+
     def get_final_price(self):
         """
         Get the cart's final price, with all of the discounts and coupons.
         """
-        return sum(item['total_final_price'] for item in self)
+        return self.summary.final_price
 
     def get_offer_discount(self):
         """
         Get the cart's total discount from prouct offer prices.
         """
-        discount_price_total = Decimal(0)
-        for item in self:
-            product = item['product']
-            if product.has_offer:
-                discount_price_total += ((product.price - 
-                    product.offer_price) * item['quantity'])
-        return discount_price_total
+        return self.summary.offer_discount
 
     def get_total_discount(self):
         """
         Get hte cart's total discount, this includes offer prices and coupons.
         """
-        # TODO: alter when coupons are added
-        return self.get_offer_discount()
+        return self.summary.total_discount
 
     def get_original_price(self):
         """
         Get the cart's total original price (without offers or coupons).
         """
-        original_price = Decimal(0)
-        for item in self:
-            original_price += ((item['product'].price) + 
-                item['total_options_price']) * item['quantity']
-        return round_decimal(original_price)
+        return self.summary.original_price
 
     def get_total_discount_percentage(self):
         """
         Get the total discount percentage of the cart.
         It's basically 100 - (final_price * 100 / original_price) 
         """
-        if self.get_original_price() == 0:
-            # we don't want to divide by zero, this happens when the carts
-            # total price is 0 (like when it's empty)
-            return 0
-        res = Decimal(100) - (Decimal(self.get_final_price()) * Decimal(100) / 
-            Decimal(self.get_original_price()))
-        return round_decimal(res)
+        return self.summary.total_discount_percentage
 
     def get_shipping_price(self):
         """
         Get the shipping price, considering the total price of the cart.
         """
-        if len(self) < 1:
+        if not self.has_items():
+            # no need to go through the items
             return Decimal(0)
-
-        final_price = self.get_final_price()
-
-        return (0 if final_price >= Cart.FREE_SHIPPING_MIN_PRICE 
-                 else Cart.DEFAULT_SHIPPING_PRICE)
+        return self.summary.shipping_price
 
     def get_final_price_with_shipping(self):
         """
         Get the total price of the cart, including possible shipping costs. 
         """
-        return self.get_final_price() + self.get_shipping_price()
+        return self.summary.final_price_with_shipping
 
     def has_items(self):
         """
@@ -220,64 +314,202 @@ class Cart(object):
         don't want the potential overhead of going though the items, summing
         the quantities, etc.
         """
-        return len(self._cart) > 0
+        return len(self) > 0
 
-    def _update_product_total_final_price(self, product, options=None):
+    def quote(self, lines, include_cart=False):
         """
-        Updates the passed in product's (with possible options) item in cart
-        context. NOTE: THIS METHOD MODIFIES THE CART DICTIONARY. It does NOT
-        save the cart.
-        """
-        item = self._get_item(product, options)
-        item['total_final_price'] = self._compute_total_final_price(product,
-                                                                        item)
+        Price items as if they were added to the cart, without changing (or
+        saving) the cart. The prices are computed with the price matrices of
+        the products (see products.utils.price_matrix), so once they're
+        cached, no products or options are fetched.
+
+        Args:
+            lines: iterable of (product, options, quantity) tuples, with the
+                same meaning as the arguments of add(). The options must be
+                options of the product's groups, but aren't checked to be a
+                valid choice (see cart.utils.resolve_options()).
+            include_cart (bool): if True, the totals include the items in the
+                cart (at the current prices)
+
+        Returns:
+            a (items, summary) tuple: the quoted items (dicts with the
+            'product_pk', 'options_pks', 'quantity', 'unit_price',
+            'total_options_price', 'total_original_price' and
+            'total_final_price' of each line, in the same order) and the
+            CartSummary of the quoted items (and of the cart's items, if
+            include_cart is True)
+
+        Raises:
+            NegativeQuantityException: if a quantity is negative
+            ArgumentError: if a product doesn't exist, or an option isn't an
+                option of its groups
+        """
+        lines = [(product.pk, [option.pk for option in options or ()],
+            int(quantity)) for product, options, quantity in lines]
+        for product_pk, options_pks, quantity in lines:
+            if quantity < 0:
+                raise NegativeQuantityException('\'quantity\' cannot be '
+                    'negative. The passed in value was {}'.format(quantity))
+
+        cart_lines = []
+        if include_cart:
+            combinations_by_id = self._get_combinations({key
+                for product_cart in self._raw_cart.values()
+                for key in product_cart})
+            cart_lines = [(int(product_pk), combinations_by_id[key],
+                int(item['quantity']))
+                for product_pk, product_cart in self._raw_cart.items()
+                for key, item in product_cart.items()
+                if key in combinations_by_id]
+
+        matrices = price_matrix.get_price_matrices({product_pk
+            for product_pk, options, quantity in lines + cart_lines})
+        items = []
+        for product_pk, options_pks, quantity in lines:
+            matrix = matrices.get(product_pk)
+            if matrix is None or not matrix.has_options(options_pks):
+                raise ArgumentError('Product (pk={}) doesn\'t exist or '
+                    'can\'t have the options {}'.format(product_pk,
+                        options_pks))
+            items.append(self._get_quoted_item(product_pk, options_pks,
+                quantity, matrix.quote(options_pks, quantity)))
+
+        cart_items = []
+        for product_pk, combination, quantity in cart_lines:
+            matrix = matrices.get(product_pk)
+            if matrix is None:
+                # the product was deleted after it was added to the cart
+                continue
+            options_pks = list(combination.option_ids)
+            if matrix.has_options(options_pks):
+                quote = matrix.quote(options_pks, quantity)
+            else:
+                # the options were removed from the product's groups after
+                # it was added to the cart, so they're priced as the cart
+                # prices them (see _set_item_prices())
+                quote = matrix.quote((), quantity)
+                quote = quote._replace(options_price=combination.total_price,
+                    unit_price=quote.unit_price + combination.total_price,
+                    total_final_price=round_decimal(quote.total_final_price
+                        + combination.total_price * quantity),
+                    total_original_price=round_decimal(
+                        quote.total_original_price
+                        + combination.total_price * quantity))
+            cart_items.append(self._get_quoted_item(product_pk, options_pks,
+                quantity, quote))
+
+        return items, CartSummary(self, items + cart_items)
+
+    def _get_quoted_item(self, product_pk, options_pks, quantity, quote):
+        return {
+            'product_pk': product_pk,
+            'options_pks': options_pks,
+            'quantity': quantity,
+            'unit_price': quote.unit_price,
+            'total_options_price': quote.options_price,
+            'total_original_price': quote.total_original_price,
+            'total_final_price': quote.total_final_price,
+        }
+
+    def _get_empty_cart(self):
+        return {Cart.ITEMS_KEY: {}, Cart.ITEM_COUNT_KEY: 0,
+            Cart.PRICE_VERSION_KEY: get_price_version()}
 
     def _compute_total_final_price(self, product, item):
-        return round_decimal((product.current_price 
+        return round_decimal((Decimal(product.current_price) 
                                     + item['total_options_price'])
                                     * item['quantity'])
 
-    def _get_product_with_options_key(self, options):
-        option_ids = sorted([option.pk for option in options])
-        option_ids = [str(option) for option in option_ids]
-        return Cart.KEY_SEPARATOR.join(option_ids)
+    def _set_item_prices(self, item, product, combination, quantity=None):
+        """
+        (Re)compute the prices of an item, with the current prices of its
+        product and options combination (see products.utils.combinations),
+        and stamp it with their price versions.
+        NOTE: THIS METHOD MODIFIES THE ITEM. It does NOT save the cart.
+        """
+        if quantity is None:
+            quantity = item['quantity']
+        item['total_options_price'] = combination.total_price
+        item['total_final_price'] = round_decimal((Decimal(
+            product.current_price) + item['total_options_price'])
+            * Decimal(quantity))
+        item['price_version'] = self._get_price_stamp(product, combination)
+
+    def _get_price_stamp(self, product, combination):
+        """
+        Price versions only ever increase, so their sum changes if (and only
+        if) the price of the product or of any of the options changes.
+        """
+        return product.price_version + combination.price_version
+
+    def _reprice(self, products, combinations_by_id):
+        """
+        Re-price the items whose product or options prices changed since they
+        were priced (and save the cart, if any was). `products` and
+        `combinations_by_id` are the already fetched products and option
+        combinations in the cart (see __iter__()).
+
+        Nothing is checked if no price changed at all since the cart was last
+        priced (see products.utils.pricing).
+        """
+        if not self._raw_cart:
+            return
+        price_version = get_price_version()
+        if self._cart.get(Cart.PRICE_VERSION_KEY) == price_version:
+            return
 
-    def _init_cart_product(self, product, options, quantity):
+        for product_pk, product_cart in self._raw_cart.items():
+            product = products.get(int(product_pk))
+            if product is None:
+                continue
+            for key, item in product_cart.items():
+                combination = combinations_by_id.get(key)
+                if combination is None:
+                    continue
+                if item.get('price_version') != self._get_price_stamp(product,
+                                                                combination):
+                    self._set_item_prices(item, product, combination)
+                    self._changed_lines.add((product_pk, key))
+
+        self._cart[Cart.PRICE_VERSION_KEY] = price_version
+        if self._changed_lines:
+            self.save()
+        # otherwise the version is kept in memory only (and stored with the
+        # next change), so that prices changing elsewhere in the catalog
+        # don't make every cart read write it (and change its revision)
+
+    def _init_cart_product(self, product, combination, quantity):
         """
         Initialize cart product with the minimal information requried to display
         it in the cart.
         """
         context = {}
         context['quantity'] = Decimal(0)  # this is not a typo, it will be updated later
-        total_opt_price = sum(option.price for option in options) if options else Decimal(0)
-        context['total_options_price'] = to_decimal(total_opt_price)
-        total_final_price = round_decimal((Decimal(product.current_price) 
-                                    + context['total_options_price'])
-                                    * Decimal(quantity))
-
-        context['total_final_price'] = total_final_price
+        self._set_item_prices(context, product, combination, quantity)
         return context
 
 
-    def _complete_cart_product(self, product, key, context):
+    def _complete_cart_product(self, product, combination, context,
+                                                                options_by_pk):
         """
         Compelete the cart's context with more info, as well as product and
         options objects (if present). This should be called in __iter__().
 
+        `options_by_pk` is a dict mapping option pks to already fetched
+        ProductOption instances (see __iter__()).
+
         This function does not alter the passed in context.
         """
         new_context = {}
         
         new_context['product'] = product
 
-        if key:
-            # init options if needed
-            option_ids = key.split(Cart.KEY_SEPARATOR)
-            option_ids = [int(id) for id in option_ids]
-            # NOTE: not using ProductOption.objects.filter(pk__in=option_ids),
-            # because **we want duplicates** to appear in the options list
-            # (case if a product is added with the same option repeated)
-            options = [ProductOption.objects.get(pk=pk) for pk in option_ids]
+        if combination.option_ids:
+            # NOTE: building the list from the combination (instead of using
+            # the fetched options directly), because **we want duplicates** to
+            # appear in the options list (case if a product is added with the
+            # same option repeated)
+            options = [options_by_pk[pk] for pk in combination.option_ids]
             new_context['options'] = options
         
         total_original_price = round_decimal((product.price 
@@ -292,17 +524,103 @@ class Cart(object):
 
         return {**context, **new_context}
 
+    def _get_option_ids(self, options):
+        if options and not isinstance(options, collections.Iterable):
+            raise ArgumentError('\'options\' argument must be an iterable')
+        return tuple(sorted(option.pk for option in options or ()))
+
+    def _get_combination(self, options):
+        """
+        Get the combination of the given options (see
+        products.utils.combinations), creating it if needed.
+        """
+        option_ids = self._get_option_ids(options)
+        if option_ids in self._combination_ids:
+            return self._combinations[self._combination_ids[option_ids]]
+        combination = combinations.get_combination(options)
+        self._remember_combinations([combination])
+        return combination
+
+    def _get_combinations(self, keys):
+        """
+        Get the combinations with the given ids (see
+        products.utils.combinations), the unknown ones left out.
+
+        Returns:
+            dict mapping the ids to the combinations
+        """
+        combinations_by_id = {key: self._combinations[key] for key in keys
+                                                if key in self._combinations}
+        missing = set(keys) - set(combinations_by_id)
+        legacy_keys = {key for key in missing if is_legacy_key(key)}
+        combinations_by_id.update(combinations.get_combinations(
+                                                    missing - legacy_keys))
+        combinations_by_id.update(self._get_legacy_combinations(legacy_keys))
+        self._remember_combinations(combinations_by_id.values())
+        return combinations_by_id
+
+    def _get_legacy_combinations(self, keys):
+        """
+        Get the combinations of the legacy keys of items stored before their
+        combinations existed (see cart.codec), without creating them: they're
+        computed from the options, with the legacy keys as their ids, until
+        the cart is saved (see _upgrade_legacy_keys()).
+        """
+        if not keys:
+            return {}
+        option_ids = {key: get_option_ids(key) for key in keys}
+        options_by_pk = ProductOption.objects.in_bulk({pk
+            for pks in option_ids.values() for pk in pks})
+        res = {}
+        for key, pks in option_ids.items():
+            instance = OptionCombination(key=key)
+            instance.set_price([options_by_pk[pk] for pk in pks
+                                                    if pk in options_by_pk])
+            res[key] = combinations.Combination(id=key,
+                option_ids=tuple(pks), total_price=instance.total_price,
+                price_version=instance.price_version)
+        return res
+
+    def _upgrade_legacy_keys(self):
+        """
+        Replace the legacy keys of the items (see cart.codec) with the ids of
+        their combinations, creating them, before the cart is stored. An item
+        whose combination is already in the cart is merged into it (and will
+        be re-priced).
+        """
+        for product_pk, product_cart in self._raw_cart.items():
+            for key in [key for key in product_cart if is_legacy_key(key)]:
+                item = product_cart.pop(key)
+                combination_id = combinations.get_combination_id(
+                    get_option_ids(key))
+                other = product_cart.get(combination_id)
+                if other is None:
+                    product_cart[combination_id] = item
+                else:
+                    other['quantity'] += item['quantity']
+                    other['total_final_price'] += item['total_final_price']
+                    other['price_version'] = None
+                self._changed_lines.update({(product_pk, key),
+                    (product_pk, combination_id)})
+                combination = self._combinations.pop(key, None)
+                if combination is not None:
+                    self._remember_combinations([combination._replace(
+                        id=combination_id)])
+
+    def _remember_combinations(self, resolved):
+        for combination in resolved:
+            self._combinations[combination.id] = combination
+            self._combination_ids[combination.option_ids] = combination.id
+
     def _get_product_key(self, options):
         """
-        Build the product key.
+        Get the product key: the id of the options' combination. Returns None
+        if the combination doesn't exist (so no item can have it).
         """
-        if options:
-            if not isinstance(options, collections.Iterable):
-                raise ArgumentError('\'options\' argument must be an iterable')
-            key = self._get_product_with_options_key(options)
-        else:
-            key = ''
-        return key
+        option_ids = self._get_option_ids(options)
+        if option_ids in self._combination_ids:
+            return self._combination_ids[option_ids]
+        return combinations.get_combination_id(option_ids, create=False)
 
     def _get_product(self, product):
         """
@@ -330,18 +648,123 @@ class Cart(object):
         WARNING: this should not be acessed directly. This is useful
         for testing.
         """
-        return self._cart
+        return self._cart[Cart.ITEMS_KEY]
 
     def __len__(self):
-        return int(sum(item['quantity'] for item in self))
+        return self._cart[Cart.ITEM_COUNT_KEY]
 
 
     def __iter__(self):
-        # TODO: complete context
+        """
+        Iterate over the cart's items (completed with their products and
+        options). The items are fetched on first iteration and are reused
+        until the cart is changed (i.e. until save() is called).
+        """
+        if self._items is None:
+            self._items = list(self._iter_items())
+        return iter(self._items)
+
+    def _iter_items(self):
+        # fetch all of the products and options in the cart at once, instead
+        # of doing a query per item, so that the number of queries does not
+        # depend on the size of the cart
+        products = Product.objects.in_bulk(list(self._raw_cart.keys()))
+        keys = {key for product_cart in self._raw_cart.values() 
+                                            for key in product_cart}
+        combinations_by_id = self._get_combinations(keys)
+        options_by_pk = ProductOption.objects.in_bulk({pk 
+            for combination in combinations_by_id.values()
+            for pk in combination.option_ids})
+        self._reprice(products, combinations_by_id)
+        if any(is_legacy_key(key) for key in combinations_by_id):
+            # re-pricing may have saved the cart, replacing the legacy keys
+            # (see save())
+            combinations_by_id = self._get_combinations({key
+                for product_cart in self._raw_cart.values()
+                for key in product_cart})
+
         for product_pk in self._raw_cart:
             product_cart = self._raw_cart[product_pk]
-            product = Product.objects.get(pk=product_pk)
+            product = products.get(int(product_pk))
+            if product is None:
+                # the product was deleted after it was added to the cart
+                continue
             for key in product_cart:
+                combination = combinations_by_id.get(key)
+                if combination is None:
+                    # unknown options combination
+                    continue
                 item = product_cart[key]
-                item = self._complete_cart_product(product, key, item)
+                item = self._complete_cart_product(product, combination, item,
+                                                                options_by_pk)
                 yield item
+
+
+class CartSummary(object):
+    """
+    Snapshot of the cart's totals, computed in a single pass over the cart.
+
+    Use Cart.summary to get it, instead of instantiating it directly, since
+    the cart takes care of reusing it until it's changed.
+    """
+
+    def __init__(self, cart, items=None):
+        """
+        Compute the totals of the cart's items, or of the given items (dicts
+        with the 'quantity', 'total_final_price' and 'total_original_price'
+        of items, e.g. quoted ones, see Cart.quote()), with the cart's
+        shipping prices.
+        """
+        original_price = Decimal(0)
+        final_price = Decimal(0)
+        item_count = 0
+
+        for item in (cart if items is None else items):
+            final_price += item['total_final_price']
+            original_price += item['total_original_price']
+            item_count += item['quantity']
+
+        # the options are never on offer, so the offer discount is the
+        # difference between the original and the final prices
+        offer_discount = original_price - final_price
+
+        self.item_count = len(cart) if items is None else int(item_count)
+        self.final_price = final_price
+        self.offer_discount = offer_discount
+        # TODO: alter when coupons are added
+        self.total_discount = offer_discount
+        self.original_price = round_decimal(original_price)
+
+        if self.original_price == 0:
+            # we don't want to divide by zero, this happens when the carts
+            # total price is 0 (like when it's empty)
+            self.total_discount_percentage = 0
+        else:
+            self.total_discount_percentage = round_decimal(Decimal(100) - 
+                (final_price * Decimal(100) / self.original_price))
+
+        if self.item_count < 1:
+            self.shipping_price = Decimal(0)
+        else:
+            self.shipping_price = (0 
+                if final_price >= cart.FREE_SHIPPING_MIN_PRICE 
+                else cart.DEFAULT_SHIPPING_PRICE)
+
+        self.final_price_with_shipping = final_price + self.shipping_price
+
+    def to_dict(self):
+        """
+        Get the summary as a JSON serializable dictionary.
+        """
+        return {
+            'item_count': self.item_count,
+            'original_price': float(self.original_price),
+            'final_price': float(self.final_price),
+            'offer_discount': float(self.offer_discount),
+            'total_discount': float(self.total_discount),
+            'total_discount_percentage': float(
+                                            self.total_discount_percentage),
+            'shipping_price': float(self.shipping_price),
+            'final_price_with_shipping': float(
+                                            self.final_price_with_shipping),
+        }
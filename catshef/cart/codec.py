@@ -0,0 +1,151 @@
+"""
+Compact encoding of the cart, used when the whole cart is stored as a single
+value (in the session or in the cache, see cart.storage).
+
+In memory (in cart.cart.Cart) the cart is a dictionary, where the items are
+stored under ITEMS_KEY (product id -> options combination id -> item, see
+products.utils.combinations) and the rest of the keys hold cart-wide values
+(like the item count under ITEM_COUNT_KEY).
+That's convenient to work with, but it's big (and it holds Decimals, which
+the JSON session serializer can't handle), so it's encoded as:
+
+    [VERSION, {cart-wide values}, [line, ...]]
+
+where each line is a list of ints:
+
+    [product id, options combination id, quantity,
+     total options price in cents, total final price in cents, price version]
+
+Since it only holds ints, it can be serialized with both, the pickle and the
+JSON session serializers. The payload is about 3-4 times smaller, but
+encoding and decoding it in Python takes about as long as pickling Decimals
+saves, so storing and loading the cart isn't any faster (see
+benchmarks/cart_codec.py).
+
+decode() also accepts carts stored in the previous formats, so they are
+upgraded transparently (they're stored in the new format on the next save).
+Before version 4, items were keyed by their option ids (sorted and joined by
+KEY_SEPARATOR), instead of by the id of their options combination. Carts
+are decoded on every read, which mustn't write to the database, so the
+items whose combinations don't exist yet keep that legacy key (a string,
+see get_option_ids()) until the cart is saved (see cart.cart.Cart.save()).
+"""
+from decimal import Decimal
+
+from products.utils.combinations import get_combination_id
+
+# keys of the cart's dictionary representation
+ITEMS_KEY = 'items'
+ITEM_COUNT_KEY = 'item_count'
+# global price version the cart was priced at (see products.utils.pricing)
+PRICE_VERSION_KEY = 'price_version'
+# incremented every time the cart is saved (see cart.cart.Cart.revision)
+REVISION_KEY = 'revision'
+# separator of the option ids in an item's options key (before version 4)
+KEY_SEPARATOR = ':'
+
+VERSION = 4
+
+CENT = Decimal('0.01')
+
+def encode(cart):
+    """
+    Encode the cart's dictionary representation.
+    """
+    lines = []
+    for product_id, product_cart in cart[ITEMS_KEY].items():
+        for key, item in product_cart.items():
+            lines.append([
+                int(product_id),
+                key,
+                int(item['quantity']),
+                _to_cents(item['total_options_price']),
+                _to_cents(item['total_final_price']),
+                item.get('price_version'),
+                ])
+    meta = {key: value for key, value in cart.items() if key != ITEMS_KEY}
+    return [VERSION, meta, lines]
+
+def decode(payload):
+    """
+    Decode an encoded cart (in the current or in any of the previous
+    formats) into the cart's dictionary representation.
+    """
+    if isinstance(payload, dict):
+        if ITEMS_KEY in payload:
+            # version 1: the dictionary representation itself
+            cart = dict(payload)
+            cart[ITEMS_KEY] = _upgrade_keys(payload[ITEMS_KEY])
+            return cart
+        # version 0: just the items (no item count)
+        return _decode_v0(_upgrade_keys(payload))
+
+    version, meta, lines = payload
+    cart = dict(meta)
+    items = cart[ITEMS_KEY] = {}
+    for line in lines:
+        product_id, key, quantity, options_cents, final_cents = line[:5]
+        if version < 4:
+            # a list of option ids
+            key = _upgrade_key(key)
+        items.setdefault(str(product_id), {})[key] = {
+            'quantity': Decimal(quantity),
+            'total_options_price': _from_cents(options_cents),
+            'total_final_price': _from_cents(final_cents),
+            # version 2 lines have no price version, so they'll be re-priced
+            'price_version': line[5] if version > 2 else None,
+        }
+    return cart
+
+def _decode_v0(items):
+    """
+    The item count is computed from the stored quantities, so no products
+    need to be fetched.
+    """
+    item_count = sum(item['quantity'] for product_cart in items.values()
+                                    for item in product_cart.values())
+    return {ITEMS_KEY: items, ITEM_COUNT_KEY: int(item_count)}
+
+def is_legacy_key(key):
+    """
+    Whether an item's key is a legacy key (option ids joined by
+    KEY_SEPARATOR), instead of a combination id.
+    """
+    return isinstance(key, str)
+
+def get_option_ids(key):
+    """
+    Get the option ids of a legacy key.
+    """
+    return [int(id) for id in key.split(KEY_SEPARATOR) if id]
+
+def _upgrade_keys(items):
+    """
+    Replace the options keys (option ids joined by KEY_SEPARATOR) of the
+    items stored before version 4 with the ids of their options
+    combinations (see _upgrade_key()). Keys that are already combination ids
+    (ints) are kept.
+    """
+    upgraded = {}
+    for product_id, product_cart in items.items():
+        upgraded[product_id] = {
+            (_upgrade_key(get_option_ids(key)) if is_legacy_key(key)
+                else key): item
+            for key, item in product_cart.items()}
+    return upgraded
+
+def _upgrade_key(option_ids):
+    """
+    Get the id of the existing combination of the option ids, or their
+    legacy key, if it doesn't exist (it isn't created while reading).
+    """
+    combination_id = get_combination_id(option_ids, create=False)
+    if combination_id is None:
+        return KEY_SEPARATOR.join(str(id) for id in sorted(option_ids))
+    return combination_id
+
+def _to_cents(value):
+    return int(Decimal(value) / CENT)
+
+def _from_cents(cents):
+    return Decimal(cents) * CENT
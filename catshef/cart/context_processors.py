@@ -1,5 +1,10 @@
 from cart.cart import Cart
 
+from django.utils.functional import SimpleLazyObject
+
 def cart(request):
-    cart = Cart(request)
-    return { 'cart':cart }
\ No newline at end of file
+    """
+    Puts the cart in the context. The cart is only created when it's actually
+    used in a template, so that rendering a page does not access the session.
+    """
+    return { 'cart':SimpleLazyObject(lambda: Cart(request)) }
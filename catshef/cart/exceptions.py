@@ -20,4 +20,11 @@ class QueryParamsError(ValueError):
     """
     There is a problem with the query parameters (applies to views in Cart).
     """
-    pass
\ No newline at end of file
+    pass
+
+class InvalidOptionsException(ValueError):
+    """
+    The options passed in can't be chosen together for the product (for
+    example, two options of a radio group).
+    """
+    pass
@@ -0,0 +1,25 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from cart.storage import DatabaseCartStorage
+
+class Command(BaseCommand):
+    help = ('Delete the carts stored in the database (see '
+        'cart.storage.DatabaseCartStorage) which weren\'t changed for longer '
+        'than a session lasts (SESSION_COOKIE_AGE), like clearsessions does '
+        'for the sessions.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+            help='Delete the carts not changed in this many days instead.')
+
+    def handle(self, *args, **options):
+        if options['days'] is None:
+            age = datetime.timedelta(seconds=settings.SESSION_COOKIE_AGE)
+        else:
+            age = datetime.timedelta(days=options['days'])
+        count = DatabaseCartStorage.clear_expired(timezone.now() - age)
+        self.stdout.write('Deleted {} carts.'.format(count))
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.8 on 2026-10-18 12:44
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredCart',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=32, unique=True)),
+                ('meta', models.TextField(default='{}')),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StoredCartLine',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_id', models.PositiveIntegerField()),
+                ('options_key', models.CharField(blank=True, max_length=255)),
+                ('quantity', models.PositiveIntegerField()),
+                ('total_options_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('total_final_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('cart', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='cart.StoredCart')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='storedcartline',
+            unique_together=set([('cart', 'product_id', 'options_key')]),
+        ),
+    ]
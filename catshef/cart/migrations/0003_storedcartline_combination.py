@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.8 on 2026-10-18 12:54
+from __future__ import unicode_literals
+
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+def set_combination_ids(apps, schema_editor):
+    """
+    Replace the options keys of the stored lines (sorted option ids joined
+    by ':') with the ids of their option combinations.
+    """
+    StoredCartLine = apps.get_model('cart', 'StoredCartLine')
+    OptionCombination = apps.get_model('products', 'OptionCombination')
+    ProductOption = apps.get_model('products', 'ProductOption')
+
+    for line in StoredCartLine.objects.exclude(options_key=''):
+        option_ids = sorted(int(pk) for pk in line.options_key.split(':'))
+        key = ':'.join(str(pk) for pk in option_ids)
+        combination = OptionCombination.objects.filter(key=key).first()
+        if combination is None:
+            options_by_pk = ProductOption.objects.in_bulk(set(option_ids))
+            options = [options_by_pk[pk] for pk in option_ids 
+                                                    if pk in options_by_pk]
+            combination = OptionCombination.objects.create(key=key,
+                total_price=sum((option.price for option in options),
+                                                                Decimal(0)),
+                price_version=sum(option.price_version for option in options))
+            combination.options.add(*options_by_pk.values())
+        line.combination_id = combination.pk
+        line.save(update_fields=['combination_id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0021_optioncombination'),
+        ('cart', '0002_storedcartline_price_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedcartline',
+            name='combination_id',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(set_combination_ids, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='storedcartline',
+            unique_together=set([('cart', 'product_id', 'combination_id')]),
+        ),
+        migrations.RemoveField(
+            model_name='storedcartline',
+            name='options_key',
+        ),
+    ]
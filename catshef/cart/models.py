@@ -1,3 +1,38 @@
 from django.db import models
 
-# Create your models here.
+class StoredCart(models.Model):
+    """
+    Cart stored in the database (used by cart.storage.DatabaseCartStorage).
+    The cart's items are stored as StoredCartLine rows, everything else
+    (item count, etc.) is stored as JSON in 'meta'.
+
+    Fields:
+        token (CharField): identifies the cart, it's kept in the session
+    """
+    token = models.CharField(max_length=32, unique=True)
+    meta = models.TextField(default='{}')
+    # (indexed for deleting the expired carts, see the clearcarts command)
+    updated = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return 'Cart {}'.format(self.token)
+
+class StoredCartLine(models.Model):
+    """
+    A single cart item (product with the given options) of a StoredCart.
+
+    Fields:
+        combination_id (PositiveIntegerField): id of the item's options
+            combination (see products.utils.combinations)
+    """
+    cart = models.ForeignKey('StoredCart', related_name='lines',
+        on_delete=models.CASCADE)
+    product_id = models.PositiveIntegerField()
+    combination_id = models.PositiveIntegerField(default=0)
+    quantity = models.PositiveIntegerField()
+    total_options_price = models.DecimalField(max_digits=10, decimal_places=2)
+    total_final_price = models.DecimalField(max_digits=10, decimal_places=2)
+    price_version = models.PositiveIntegerField(null=True)
+
+    class Meta:
+        unique_together = ('cart', 'product_id', 'combination_id')
@@ -0,0 +1,227 @@
+"""
+Cart storage backends.
+
+The cart is handled (by cart.cart.Cart) as a dictionary, where the items are
+stored under ITEMS_KEY (product id -> options combination id -> item) and the rest of
+the keys hold cart-wide values (like the item count under ITEM_COUNT_KEY).
+A storage backend is responsible for loading and saving that dictionary.
+Backends which store the whole cart as a single value store it encoded
+with cart.codec.
+
+The backend is chosen with the CART_STORAGE_BACKEND setting (dotted path to
+the backend class), which defaults to the session backend.
+"""
+import json
+import uuid
+from decimal import Decimal
+
+from cart import codec
+from cart.codec import ITEMS_KEY, ITEM_COUNT_KEY
+from cart.models import StoredCart, StoredCartLine
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+SESSION_ID = getattr(settings, 'CART_SESSION_ID', 'catshef.cart')
+
+DEFAULT_STORAGE_BACKEND = 'cart.storage.SessionCartStorage'
+
+def get_storage(request):
+    """
+    Get an instance of the cart storage backend (set in the
+    CART_STORAGE_BACKEND setting) for the given request.
+    """
+    backend_path = getattr(settings, 'CART_STORAGE_BACKEND',
+        DEFAULT_STORAGE_BACKEND)
+    return import_string(backend_path)(request)
+
+class BaseCartStorage(object):
+    """
+    Base class for cart storage backends. Subclasses must implement load()
+    and save().
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.session = request.session
+
+    def load(self):
+        """
+        Load the cart's dictionary representation.
+
+        Returns:
+            the cart dictionary, if the cart was stored before
+            None, otherwise
+        """
+        raise NotImplementedError
+
+    def save(self, cart, changed_lines):
+        """
+        Store the cart's dictionary representation.
+
+        Args:
+            cart (dict): the cart's dictionary representation
+            changed_lines (set): (product id, options key) tuples of the
+                items changed since the cart was loaded or last saved. An item
+                which is no longer in `cart` was removed.
+        """
+        raise NotImplementedError
+
+class SessionCartStorage(BaseCartStorage):
+    """
+    Stores the whole cart in the session. Every save() rewrites the whole
+    cart (and the rest of the session).
+    """
+
+    def load(self):
+        payload = self.session.get(SESSION_ID)
+        if not payload:
+            return None
+        return codec.decode(payload)
+
+    def save(self, cart, changed_lines):
+        self.session[SESSION_ID] = codec.encode(cart)
+        self.session.modified = True
+
+class TokenCartStorage(BaseCartStorage):
+    """
+    Base class for backends that store the cart outside of the session. Only
+    a token identifying the cart is kept in the session, so it is only
+    written once (when the cart is first saved).
+    """
+
+    def get_token(self, create=False):
+        """
+        Get the token of the request's cart. If the cart has no token yet,
+        a new one is stored in the session if `create` is True, otherwise
+        None is returned.
+        """
+        token = self.session.get(SESSION_ID)
+        if not isinstance(token, str):
+            # no cart yet (or the cart was stored by another backend)
+            if not create:
+                return None
+            token = self.session[SESSION_ID] = uuid.uuid4().hex
+        return token
+
+class CacheCartStorage(TokenCartStorage):
+    """
+    Stores the whole cart in the cache set in the CART_CACHE_ALIAS setting
+    (defaults to 'default').
+
+    Cached carts expire after CART_CACHE_TIMEOUT seconds (defaults to
+    SESSION_COOKIE_AGE), so make sure that the cache is not evicting keys
+    before that, or carts will be lost.
+    """
+    KEY_PREFIX = 'catshef.cart.'
+
+    def __init__(self, request):
+        super(CacheCartStorage, self).__init__(request)
+        self.cache = caches[getattr(settings, 'CART_CACHE_ALIAS', 'default')]
+        self.timeout = getattr(settings, 'CART_CACHE_TIMEOUT',
+            settings.SESSION_COOKIE_AGE)
+
+    def load(self):
+        token = self.get_token()
+        if token is None:
+            return None
+        payload = self.cache.get(self._get_cache_key(token))
+        return codec.decode(payload) if payload else None
+
+    def save(self, cart, changed_lines):
+        token = self.get_token(create=True)
+        self.cache.set(self._get_cache_key(token), codec.encode(cart),
+            self.timeout)
+
+    def _get_cache_key(self, token):
+        return CacheCartStorage.KEY_PREFIX + token
+
+class DatabaseCartStorage(TokenCartStorage):
+    """
+    Stores the cart in the database, one row (StoredCartLine) per item. Only
+    the changed items are written on save(), so changing the quantity of an
+    item updates a single row.
+    """
+
+    def __init__(self, request):
+        super(DatabaseCartStorage, self).__init__(request)
+        self._stored_cart_pk = None
+
+    def load(self):
+        token = self.get_token()
+        if token is None:
+            return None
+
+        try:
+            stored_cart = StoredCart.objects.get(token=token)
+        except StoredCart.DoesNotExist:
+            return None
+        self._stored_cart_pk = stored_cart.pk
+
+        cart = json.loads(stored_cart.meta)
+        items = cart[ITEMS_KEY] = {}
+        for line in StoredCartLine.objects.filter(cart=stored_cart):
+            product_cart = items.setdefault(str(line.product_id), {})
+            product_cart[line.combination_id] = {
+                'quantity': Decimal(line.quantity),
+                'total_options_price': line.total_options_price,
+                'total_final_price': line.total_final_price,
+                'price_version': line.price_version,
+            }
+        return cart
+
+    @transaction.atomic
+    def save(self, cart, changed_lines):
+        meta = json.dumps({key: value for key, value in cart.items()
+                                                    if key != ITEMS_KEY})
+        if self._stored_cart_pk is None:
+            stored_cart = StoredCart.objects.create(
+                token=self.get_token(create=True), meta=meta)
+            self._stored_cart_pk = stored_cart.pk
+        else:
+            StoredCart.objects.filter(pk=self._stored_cart_pk).update(
+                meta=meta, updated=timezone.now())
+
+        items = cart[ITEMS_KEY]
+        lines = StoredCartLine.objects.filter(cart_id=self._stored_cart_pk)
+        if not items:
+            # cart was cleared (or the last item was removed)
+            lines.delete()
+            return
+
+        for product_id, key in changed_lines:
+            item = items.get(product_id, {}).get(key)
+            line = lines.filter(product_id=int(product_id),
+                combination_id=key)
+            if item is None:
+                line.delete()
+                continue
+
+            values = {
+                'quantity': int(item['quantity']),
+                'total_options_price': item['total_options_price'],
+                'total_final_price': item['total_final_price'],
+                'price_version': item.get('price_version'),
+            }
+            if not line.update(**values):
+                StoredCartLine.objects.create(cart_id=self._stored_cart_pk,
+                    product_id=int(product_id), combination_id=key, **values)
+
+    @classmethod
+    @transaction.atomic
+    def clear_expired(cls, before):
+        """
+        Delete the carts which weren't saved since `before` (a datetime).
+        Their tokens are only kept in the sessions, so the carts of expired
+        sessions are never deleted otherwise (see the clearcarts management
+        command).
+
+        Returns:
+            the number of deleted carts
+        """
+        StoredCartLine.objects.filter(cart__updated__lt=before).delete()
+        count, deleted = StoredCart.objects.filter(updated__lt=before).delete()
+        return count
@@ -5,6 +5,7 @@ from decimal import Decimal
 from cart.cart import Cart
 from cart.exceptions import (ProductUnavailableException,
     NegativeQuantityException, ProductStockZeroException)
+from catshef.exceptions import ArgumentError
 from products.models import (Product, ProductOption, ProductOptionGroup,
     Membership)
 
@@ -549,6 +550,200 @@ class CartTestCase(TestCase):
         self.assertEqual(self.cart.get_final_price_with_shipping(), 
             Decimal(205))
 
+    def test_summary_is_reused_until_cart_changes(self):
+        """
+        Make sure that all of the totals are computed in a single pass over
+        the cart and that they're recomputed once the cart is changed.
+        """
+        self._price_prod_4()
+        # one iteration: one query for products and one for options
+        with self.assertNumQueries(2):
+            self.assertEqual(self.cart.get_original_price(), Decimal('77.89'))
+            self.assertEqual(self.cart.get_final_price(), Decimal('62.67'))
+            self.assertEqual(self.cart.get_offer_discount(), Decimal('15.22'))
+            self.assertEqual(self.cart.get_total_discount_percentage(),
+                Decimal('19.54'))
+            self.assertEqual(self.cart.get_shipping_price(), 0)
+            self.assertEqual(self.cart.get_final_price_with_shipping(),
+                Decimal('62.67'))
+            self.assertEqual(len(self.cart), 9)
+
+        self.cart.remove(product=self.p5, options=(self.po4,))
+        self.assertEqual(self.cart.get_final_price(), Decimal('33.71'))
+        self.assertEqual(len(self.cart), 5)
+
+        self.cart.clear()
+        self.assertEqual(self.cart.get_final_price(), Decimal(0))
+        self.assertEqual(len(self.cart), 0)
+
+    def test_len_does_not_query(self):
+        """
+        Make sure that the item count is kept along with the items, so
+        that len() and has_items() don't need to fetch any products.
+        """
+        self.cart.add(product=self.p1, options=(self.po1,), quantity=3)
+        self.cart.add(product=self.p1, quantity=6)
+        self.cart.add(product=self.p1, quantity=2, update_quantity=True)
+        self.cart.remove(product=self.p1, options=(self.po1,))
+        self.cart.add(product=self.p5, quantity=4)
+
+        cart = Cart(self.request)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(cart), 6)
+            self.assertTrue(cart.has_items())
+
+        cart.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(len(cart), 0)
+            self.assertFalse(cart.has_items())
+            self.assertEqual(cart.get_shipping_price(), Decimal(0))
+
+    def test_old_session_format_migrated(self):
+        """
+        Make sure that carts stored in the session before the item count was
+        kept are still usable.
+        """
+        self.cart.add(product=self.p1, options=(self.po1,), quantity=3)
+        self.cart.add(product=self.p1, quantity=6)
+        # old format: only the items were stored in the session
+        self.request.session[Cart.SESSION_ID] = deepcopy(self.cart._raw_cart)
+
+        cart = Cart(self.request)
+        self.assertEqual(len(cart), 9)
+        self.assertEqual(cart._raw_cart, self.cart._raw_cart)
+
+        cart.add(product=self.p1, quantity=1)
+        self.assertEqual(len(Cart(self.request)), 10)
+
+    def test_removing_last_item_of_product(self):
+        self.cart.add(product=self.p1, options=(self.po1,), quantity=3)
+        self.cart.remove(product=self.p1, options=(self.po1,))
+        self.assertNotIn(str(self.p1.pk), self.cart._raw_cart)
+        self.assertFalse(self.cart.has_items())
+
+    def test_items_repriced_on_price_change(self):
+        """
+        Make sure that items are re-priced (only) when the price of their
+        product or options changes.
+        """
+        self.cart.add(product=self.p1, options=(self.po1,), quantity=2)
+        self.cart.add(product=self.p7, quantity=1)
+        self.assertEqual(self.cart.get_final_price(), Decimal('39.62'))
+
+        p1 = Product.objects.get(pk=self.p1.pk)
+        p1.offer_price = 4
+        p1.save()
+        cart = Cart(self.request)
+        self.assertEqual(cart.get_final_price(), Decimal('37.62'))
+        item = cart._get_item(self.p1, options=(self.po1,))
+        self.assertEqual(item['total_final_price'], Decimal('32.62'))
+
+        po1 = ProductOption.objects.get(pk=self.po1.pk)
+        po1.price = 1
+        po1.save()
+        cart = Cart(self.request)
+        self.assertEqual(cart.get_final_price(), Decimal('15'))
+        item = cart._get_item(self.p1, options=(self.po1,))
+        self.assertEqual(item['total_options_price'], Decimal(1))
+
+        # the re-priced items were saved
+        self.assertEqual(Cart(self.request)._get_item(self.p1, 
+            options=(self.po1,))['total_final_price'], Decimal(10))
+
+    def test_items_not_repriced_without_price_change(self):
+        self.cart.add(product=self.p1, options=(self.po1,), quantity=2)
+        p1 = Product.objects.get(pk=self.p1.pk)
+        p1.name = 'Renamed'
+        p1.save()
+        self.assertEqual(p1.price_version, 0)
+
+        self.request.session.modified = False
+        cart = Cart(self.request)
+        self.assertEqual(cart.get_final_price(), Decimal('34.62'))
+        self.assertFalse(self.request.session.modified)
+
+    def test_not_saved_on_unrelated_price_change(self):
+        self.cart.add(product=self.p1, options=(self.po1,), quantity=2)
+        revision = self.cart.revision
+        p7 = Product.objects.get(pk=self.p7.pk)
+        p7.price = 1
+        p7.save()
+
+        self.request.session.modified = False
+        cart = Cart(self.request)
+        self.assertEqual(cart.get_final_price(), Decimal('34.62'))
+        self.assertFalse(self.request.session.modified)
+        self.assertEqual(cart.revision, revision)
+
+    def test_quote(self):
+        group = ProductOptionGroup.objects.create(name='g',
+            type=ProductOptionGroup.CHECKBOX)
+        Membership.objects.create(group=group, option=self.po1)
+        group.products.add(self.p1)
+        self._price_prod_4()
+        final_price = self.cart.get_final_price()
+        raw_cart = deepcopy(self.cart._raw_cart)
+        revision = self.cart.revision
+        self.request.session.modified = False
+
+        lines = [(self.p1, [self.po1], 2), (self.p5, None, 1)]
+        items, summary = self.cart.quote(lines)
+        self.assertEqual(items[0], {
+            'product_pk': self.p1.pk,
+            'options_pks': [self.po1.pk],
+            'quantity': 2,
+            'unit_price': Decimal('17.31'),
+            'total_options_price': Decimal('12.31'),
+            'total_original_price': Decimal('44.62'),
+            'total_final_price': Decimal('34.62'),
+        })
+        self.assertEqual(items[1]['total_final_price'], Decimal('3.14'))
+        self.assertEqual(summary.item_count, 3)
+        self.assertEqual(summary.final_price, Decimal('37.76'))
+        self.assertEqual(summary.offer_discount, Decimal(10))
+
+        # the items in the cart (whose options aren't in any group of their
+        # product) are priced as the cart prices them
+        items, summary = self.cart.quote(lines, include_cart=True)
+        self.assertEqual(len(items), 2)
+        self.assertEqual(summary.item_count, len(self.cart) + 3)
+        self.assertEqual(summary.final_price, final_price + Decimal('37.76'))
+
+        # the cart is left untouched
+        self.assertEqual(self.cart._raw_cart, raw_cart)
+        self.assertEqual(self.cart.revision, revision)
+        self.assertFalse(self.request.session.modified)
+
+    def test_quote_invalid(self):
+        with self.assertRaises(ArgumentError):
+            self.cart.quote([(self.p5, [self.po1], 1)])
+        with self.assertRaises(NegativeQuantityException):
+            self.cart.quote([(self.p5, None, -1)])
+
+    def test_quote_price_changed(self):
+        self.cart.add(product=self.p1, quantity=2)
+        p1 = Product.objects.get(pk=self.p1.pk)
+        p1.offer_price = 4
+        p1.save()
+        items, summary = self.cart.quote([(self.p1, None, 1)],
+            include_cart=True)
+        self.assertEqual(items[0]['total_final_price'], Decimal(4))
+        self.assertEqual(summary.final_price, Decimal(12))
+
+    def test_summary_to_dict(self):
+        self._price_prod_1()
+        expected = {
+            'item_count': 3,
+            'original_price': 30,
+            'final_price': 15,
+            'offer_discount': 15,
+            'total_discount': 15,
+            'total_discount_percentage': 50,
+            'shipping_price': 10,
+            'final_price_with_shipping': 25,
+        }
+        self.assertEqual(self.cart.summary.to_dict(), expected)
+
     def test_adding_repeated_option(self):
         """
         Make sure that repeated options are stored in the 'options' key
@@ -561,6 +756,31 @@ class CartTestCase(TestCase):
             self.assertEqual(item['product'], self.p1)
             self.assertCountEqual(item['options'], options)
 
+    def test_iteration_query_count_is_constant(self):
+        """
+        Make sure that iterating over the cart fetches all of the products
+        and all of the options in bulk (one query per model), no matter how
+        many items are in the cart.
+        """
+        self.cart.add(product=self.p1, options=(self.po1, self.po1),
+            quantity=2)
+        with self.assertNumQueries(2):
+            items = [item for item in self.cart]
+        self.assertEqual(len(items), 1)
+
+        self.cart.add(product=self.p1, options=(self.po2, self.po3))
+        self.cart.add(product=self.p2, options=(self.po4,), quantity=3)
+        self.cart.add(product=self.p5)
+        self.cart.add(product=self.p7, options=(self.po1, self.po4, self.po4))
+        with self.assertNumQueries(2):
+            items = [item for item in self.cart]
+        self.assertEqual(len(items), 5)
+
+        for item in items:
+            if item['product'] == self.p7:
+                self.assertCountEqual(item['options'],
+                    [self.po1, self.po4, self.po4])
+
 
 
     def test_default_product_options_additon(self):
@@ -0,0 +1,241 @@
+import json
+import pickle
+from copy import deepcopy
+from decimal import Decimal
+
+from cart import codec
+from cart.cart import Cart
+from cart.tests.test_cart import SessionDict
+from products.models import Product, ProductOption, OptionCombination
+from products.utils import combinations
+from products.utils.pricing import get_price_version
+
+from django.test import TestCase, RequestFactory
+
+class CodecTestCase(TestCase):
+
+    def setUp(self):
+        self.cart = {
+            codec.ITEMS_KEY: {
+                '1': {
+                    0: {
+                        'quantity': Decimal(3),
+                        'total_options_price': Decimal('0.00'),
+                        'total_final_price': Decimal('15.00'),
+                        'price_version': 0,
+                    },
+                    7: {
+                        'quantity': Decimal(1),
+                        'total_options_price': Decimal('28.72'),
+                        'total_final_price': Decimal('33.72'),
+                        'price_version': 3,
+                    },
+                },
+                '12': {
+                    2: {
+                        'quantity': Decimal(2),
+                        'total_options_price': Decimal('3.14'),
+                        'total_final_price': Decimal('6.52'),
+                        'price_version': None,
+                    },
+                },
+            },
+            codec.ITEM_COUNT_KEY: 6,
+            codec.PRICE_VERSION_KEY: 12,
+        }
+
+    def _setup_legacy_cart(self):
+        """
+        Get the cart with the items keyed by option ids (as they were before
+        version 4).
+        """
+        po1 = ProductOption.objects.create(name='option_1', price=12)
+        po2 = ProductOption.objects.create(name='option_2', price=3.14)
+        po3 = ProductOption.objects.create(name='option_3', price=4.72)
+        items = self.cart[codec.ITEMS_KEY]
+        legacy_cart = deepcopy(self.cart)
+        legacy_cart[codec.ITEMS_KEY] = {
+            '1': {
+                '': items['1'][0],
+                '{0}:{0}:{1}'.format(po1.pk, po3.pk): items['1'][7],
+            },
+            '12': {
+                str(po2.pk): items['12'][2],
+            },
+        }
+        self.cart[codec.ITEMS_KEY] = {
+            '1': {
+                0: items['1'][0],
+                combinations.get_combination_id([po1.pk, po1.pk, po3.pk]): 
+                                                                items['1'][7],
+            },
+            '12': {
+                combinations.get_combination_id([po2.pk]): items['12'][2],
+            },
+        }
+        return legacy_cart, (po1, po2, po3)
+
+    def test_roundtrip(self):
+        self.assertEqual(codec.decode(codec.encode(self.cart)), self.cart)
+
+    def test_encoded_format(self):
+        version, meta, lines = codec.encode(self.cart)
+        self.assertEqual(version, codec.VERSION)
+        self.assertEqual(meta, {codec.ITEM_COUNT_KEY: 6,
+            codec.PRICE_VERSION_KEY: 12})
+        self.assertCountEqual(lines, [
+            [1, 0, 3, 0, 1500, 0],
+            [1, 7, 1, 2872, 3372, 3],
+            [12, 2, 2, 314, 652, None],
+            ])
+
+    def test_json_serializable(self):
+        """
+        The encoded cart must survive the JSON session serializer (which
+        turns tuples into lists).
+        """
+        payload = json.loads(json.dumps(codec.encode(self.cart)))
+        self.assertEqual(codec.decode(payload), self.cart)
+
+    def test_smaller_than_dictionary(self):
+        self.assertLess(len(pickle.dumps(codec.encode(self.cart))),
+                        len(pickle.dumps(self.cart)))
+
+    def test_decode_v3(self):
+        """
+        Version 3: lines had the option ids, instead of the combination id.
+        """
+        legacy_cart, (po1, po2, po3) = self._setup_legacy_cart()
+        payload = [3, {codec.ITEM_COUNT_KEY: 6, codec.PRICE_VERSION_KEY: 12}, 
+            [
+                [1, [], 3, 0, 1500, 0],
+                [1, [po1.pk, po1.pk, po3.pk], 1, 2872, 3372, 3],
+                [12, [po2.pk], 2, 314, 652, None],
+            ]]
+        self.assertEqual(codec.decode(payload), self.cart)
+
+    def test_decode_v2(self):
+        """
+        Version 2: lines had no price version.
+        """
+        po = ProductOption.objects.create(name='option', price=3.14)
+        payload = [2, {codec.ITEM_COUNT_KEY: 2}, [[12, [po.pk], 2, 314, 652]]]
+        expected = {
+            codec.ITEMS_KEY: {
+                '12': {
+                    combinations.get_combination_id([po.pk]): {
+                        'quantity': Decimal(2),
+                        'total_options_price': Decimal('3.14'),
+                        'total_final_price': Decimal('6.52'),
+                        'price_version': None,
+                    },
+                },
+            },
+            codec.ITEM_COUNT_KEY: 2,
+        }
+        self.assertEqual(codec.decode(payload), expected)
+
+    def test_decode_v1(self):
+        """
+        Version 1: the dictionary representation was stored as is.
+        """
+        legacy_cart, options = self._setup_legacy_cart()
+        self.assertEqual(codec.decode(legacy_cart), self.cart)
+
+    def test_decode_v0(self):
+        """
+        Version 0: only the items were stored (without the item count).
+        """
+        legacy_cart, options = self._setup_legacy_cart()
+        cart = codec.decode(legacy_cart[codec.ITEMS_KEY])
+        self.assertEqual(cart[codec.ITEMS_KEY], self.cart[codec.ITEMS_KEY])
+        self.assertEqual(cart[codec.ITEM_COUNT_KEY], 6)
+
+    def test_decode_unknown_combination(self):
+        """
+        Decoding doesn't create combinations, the items whose combinations
+        don't exist keep their legacy keys.
+        """
+        po = ProductOption.objects.create(name='option', price=3.14)
+        payload = [3, {codec.ITEM_COUNT_KEY: 2}, [[12, [po.pk, po.pk], 2,
+            628, 952, 0]]]
+        count = OptionCombination.objects.count()
+        cart = codec.decode(payload)
+        self.assertEqual(list(cart[codec.ITEMS_KEY]['12']),
+            ['{0}:{0}'.format(po.pk)])
+        self.assertEqual(OptionCombination.objects.count(), count)
+
+class CartSessionEncodingTestCase(TestCase):
+
+    def setUp(self):
+        self.request = RequestFactory().get('/')
+        self.request.session = SessionDict()
+
+    def test_old_format_upgraded_on_save(self):
+        p1 = Product.objects.create(name='p1', slug='p1', stock=120,
+            price=10, offer_price=5, available=True)
+        po1 = ProductOption.objects.create(name='option_1', price=2)
+        self.request.session[Cart.SESSION_ID] = {
+            str(p1.pk): {
+                str(po1.pk): {
+                    'quantity': Decimal(2),
+                    'total_options_price': Decimal('2.00'),
+                    'total_final_price': Decimal('14.00'),
+                },
+            },
+        }
+
+        cart = Cart(self.request)
+        self.assertEqual(len(cart), 2)
+        self.assertEqual(cart.get_final_price(), Decimal(14))
+
+        cart.add(p1, options=(po1,))
+        payload = self.request.session[Cart.SESSION_ID]
+        self.assertEqual(payload[0], codec.VERSION)
+        self.assertEqual(payload[2], [[p1.pk, combinations.get_combination_id(
+            [po1.pk]), 3, 200, 2100, 0]])
+        self.assertEqual(len(Cart(self.request)), 3)
+
+    def test_old_format_read_without_writes(self):
+        p1 = Product.objects.create(name='p1', slug='p1', stock=120,
+            price=10, offer_price=5, available=True)
+        p2 = Product.objects.create(name='p2', slug='p2', stock=120,
+            price=3, available=True)
+        po1 = ProductOption.objects.create(name='option_1', price=2)
+        self.request.session[Cart.SESSION_ID] = [3, {
+            codec.ITEM_COUNT_KEY: 2,
+            codec.PRICE_VERSION_KEY: get_price_version()},
+            [[p1.pk, [po1.pk], 2, 200, 1400, 0]]]
+        self.request.session.modified = False
+
+        cart = Cart(self.request)
+        self.assertEqual(cart.get_final_price(), Decimal(14))
+        self.assertEqual([item['options'] for item in cart], [[po1]])
+        self.assertFalse(OptionCombination.objects.exists())
+        self.assertFalse(self.request.session.modified)
+
+        # the legacy key is replaced when the cart is saved
+        cart.add(p2)
+        key = combinations.get_combination_id([po1.pk], create=False)
+        self.assertIsNotNone(key)
+        cart = Cart(self.request)
+        self.assertEqual(cart._raw_cart[str(p1.pk)][key]['quantity'], 2)
+        self.assertEqual(cart.get_final_price(), Decimal(17))
+
+    def test_old_format_merged_on_save(self):
+        p1 = Product.objects.create(name='p1', slug='p1', stock=120,
+            price=10, offer_price=5, available=True)
+        po1 = ProductOption.objects.create(name='option_1', price=2)
+        self.request.session[Cart.SESSION_ID] = [3, {
+            codec.ITEM_COUNT_KEY: 2,
+            codec.PRICE_VERSION_KEY: get_price_version()},
+            [[p1.pk, [po1.pk], 2, 200, 1400, 0]]]
+
+        # the combination is created by the add, before the legacy item's
+        # key is replaced
+        Cart(self.request).add(p1, options=(po1,))
+        cart = Cart(self.request)
+        self.assertEqual(list(cart._raw_cart[str(p1.pk)]),
+            [combinations.get_combination_id([po1.pk], create=False)])
+        self.assertEqual(len(cart), 3)
+        self.assertEqual(cart.get_final_price(), Decimal(21))
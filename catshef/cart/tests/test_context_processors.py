@@ -0,0 +1,47 @@
+from cart.cart import Cart
+from cart.context_processors import cart
+from cart.tests.test_cart import SessionDict
+from products.models import Product
+
+from django.test import TestCase, RequestFactory
+
+class SpySessionDict(SessionDict):
+    """
+    Session mock that records whether it was accessed at all.
+    """
+    accessed = False
+
+    def get(self, *args, **kwargs):
+        self.accessed = True
+        return super(SpySessionDict, self).get(*args, **kwargs)
+
+class CartContextProcessorTestCase(TestCase):
+
+    def setUp(self):
+        self.request = RequestFactory().get('/')
+        self.request.session = SpySessionDict()
+
+    def test_session_not_accessed_if_cart_unused(self):
+        context = cart(self.request)
+        self.assertIn('cart', context)
+        self.assertFalse(self.request.session.accessed)
+
+    def test_session_not_written_for_empty_cart(self):
+        context = cart(self.request)
+        self.assertEqual(len(context['cart']), 0)
+        self.assertFalse(context['cart'].has_items())
+        self.assertTrue(self.request.session.accessed)
+        self.assertFalse(self.request.session.modified)
+        self.assertNotIn(Cart.SESSION_ID, self.request.session)
+
+    def test_session_written_on_first_change(self):
+        product = Product.objects.create(name='p1', slug='p1', stock=10,
+            price=10, available=True)
+        context = cart(self.request)
+        context['cart'].clear()
+        self.assertFalse(self.request.session.modified)
+
+        context['cart'].add(product, quantity=2)
+        self.assertTrue(self.request.session.modified)
+        self.assertIn(Cart.SESSION_ID, self.request.session)
+        self.assertEqual(len(Cart(self.request)), 2)
@@ -0,0 +1,182 @@
+import datetime
+from decimal import Decimal
+
+from cart.cart import Cart
+from cart.models import StoredCart, StoredCartLine
+from cart.storage import (get_storage, SessionCartStorage, CacheCartStorage,
+    DatabaseCartStorage, SESSION_ID)
+from cart.tests.test_cart import SessionDict
+from products.models import Product, ProductOption
+
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import TestCase, RequestFactory, override_settings
+from django.utils import timezone
+from django.utils.six import StringIO
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'cart-storage-tests',
+    }
+}
+
+class CountingSessionDict(SessionDict):
+    """
+    Session mock that counts how many times it was written to.
+    """
+    writes = 0
+
+    def __setitem__(self, key, value):
+        self.writes += 1
+        super(CountingSessionDict, self).__setitem__(key, value)
+
+class StorageTestMixin(object):
+    """
+    Tests shared by all of the storage backends. The backend is set with
+    override_settings on the subclasses.
+    """
+
+    def setUp(self):
+        self.request = RequestFactory().get('/')
+        self.request.session = CountingSessionDict()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.p1 = Product.objects.create(name='p1', slug='p1', stock=120,
+            price=10, offer_price=5, available=True)
+        cls.p2 = Product.objects.create(name='p2', slug='p2', stock=10,
+            price=3, available=True)
+        cls.po1 = ProductOption.objects.create(name='option_1', price=2)
+        cls.po2 = ProductOption.objects.create(name='option_2', price=1)
+
+    def reload_cart(self):
+        return Cart(self.request)
+
+    def test_empty_cart_not_stored(self):
+        cart = Cart(self.request)
+        self.assertEqual(len(cart), 0)
+        self.assertIsNone(cart.storage.load())
+        self.assertFalse(self.request.session.modified)
+
+    def test_cart_stored(self):
+        cart = Cart(self.request)
+        cart.add(self.p1, options=(self.po1, self.po2), quantity=2)
+        cart.add(self.p2, quantity=3)
+
+        cart = self.reload_cart()
+        self.assertEqual(len(cart), 5)
+        self.assertEqual(cart.get_final_price(), Decimal(25))
+        item = cart._get_item(self.p1, options=(self.po2, self.po1))
+        self.assertEqual(item['quantity'], 2)
+        self.assertEqual(item['total_options_price'], Decimal(3))
+        self.assertEqual(item['total_final_price'], Decimal(16))
+
+        cart.add(self.p1, options=(self.po1, self.po2), quantity=1)
+        cart = self.reload_cart()
+        self.assertEqual(len(cart), 6)
+        item = cart._get_item(self.p1, options=(self.po2, self.po1))
+        self.assertEqual(item['total_final_price'], Decimal(24))
+
+    def test_cart_removal_stored(self):
+        cart = Cart(self.request)
+        cart.add(self.p1, options=(self.po1,), quantity=2)
+        cart.add(self.p2, quantity=3)
+        cart.remove(self.p1, options=(self.po1,))
+
+        cart = self.reload_cart()
+        self.assertEqual(len(cart), 3)
+        self.assertIsNone(cart._get_item(self.p1, options=(self.po1,)))
+        self.assertIsNotNone(cart._get_item(self.p2))
+
+    def test_cart_clear_stored(self):
+        cart = Cart(self.request)
+        cart.add(self.p1, options=(self.po1,), quantity=2)
+        cart.add(self.p2, quantity=3)
+        cart.clear()
+
+        cart = self.reload_cart()
+        self.assertEqual(len(cart), 0)
+        self.assertEqual(cart._raw_cart, {})
+
+@override_settings(CART_STORAGE_BACKEND='cart.storage.SessionCartStorage')
+class SessionCartStorageTestCase(StorageTestMixin, TestCase):
+
+    def test_get_storage(self):
+        self.assertIsInstance(get_storage(self.request), SessionCartStorage)
+
+@override_settings(CART_STORAGE_BACKEND='cart.storage.CacheCartStorage',
+    CACHES=LOCMEM_CACHES)
+class CacheCartStorageTestCase(StorageTestMixin, TestCase):
+
+    def tearDown(self):
+        caches['default'].clear()
+
+    def test_get_storage(self):
+        self.assertIsInstance(get_storage(self.request), CacheCartStorage)
+
+    def test_session_only_written_once(self):
+        cart = Cart(self.request)
+        cart.add(self.p1, quantity=2)
+        cart = Cart(self.request)
+        cart.add(self.p1, quantity=2)
+        cart.add(self.p2, quantity=1)
+        self.assertEqual(self.request.session.writes, 1)
+        self.assertEqual(len(Cart(self.request)), 5)
+
+@override_settings(CART_STORAGE_BACKEND='cart.storage.DatabaseCartStorage')
+class DatabaseCartStorageTestCase(StorageTestMixin, TestCase):
+
+    def test_get_storage(self):
+        self.assertIsInstance(get_storage(self.request), DatabaseCartStorage)
+
+    def test_one_row_per_item(self):
+        cart = Cart(self.request)
+        cart.add(self.p1, options=(self.po1,), quantity=2)
+        cart.add(self.p1, quantity=1)
+        cart.add(self.p2, quantity=3)
+        self.assertEqual(StoredCart.objects.count(), 1)
+        self.assertEqual(StoredCartLine.objects.count(), 3)
+
+        cart.remove(self.p2)
+        self.assertEqual(StoredCartLine.objects.count(), 2)
+
+    def test_update_touches_single_row(self):
+        cart = Cart(self.request)
+        cart.add(self.p1, options=(self.po1,), quantity=2)
+        cart.add(self.p2, quantity=3)
+
+        cart = Cart(self.request)
+        # update of the cart's meta + update of the item's row (in a
+        # savepoint, since saving is atomic)
+        with self.assertNumQueries(4):
+            cart.add(self.p2, quantity=1)
+        line = StoredCartLine.objects.get(product_id=self.p2.pk)
+        self.assertEqual(line.quantity, 4)
+
+    def test_session_only_written_once(self):
+        cart = Cart(self.request)
+        cart.add(self.p1, quantity=2)
+        cart = Cart(self.request)
+        cart.add(self.p1, quantity=2)
+        cart.add(self.p2, quantity=1)
+        self.assertEqual(self.request.session.writes, 1)
+        self.assertEqual(len(Cart(self.request)), 5)
+
+    def test_clear_expired(self):
+        Cart(self.request).add(self.p1, quantity=2)
+        old_request = RequestFactory().get('/')
+        old_request.session = CountingSessionDict()
+        cart = Cart(old_request)
+        cart.add(self.p1, quantity=1)
+        cart.add(self.p2, quantity=1)
+        StoredCart.objects.filter(token=old_request.session[SESSION_ID]
+            ).update(updated=timezone.now() - datetime.timedelta(days=30))
+
+        out = StringIO()
+        call_command('clearcarts', days=14, stdout=out)
+        self.assertIn('Deleted 1 carts.', out.getvalue())
+        self.assertEqual(StoredCart.objects.count(), 1)
+        self.assertEqual(StoredCartLine.objects.count(), 1)
+        self.assertEqual(len(Cart(self.request)), 2)
+        self.assertEqual(len(Cart(old_request)), 0)
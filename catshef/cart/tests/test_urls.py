@@ -10,6 +10,16 @@ class CartURLsTestCase(TestCase):
         self.assertEqual(add_to_cart.view_name, 'cart:cart_add')
         self.assertEqual(add_to_cart.func.__name__, 'add_to_cart')
     
+    def test_bulk_add_to_cart_url(self):
+        bulk_add_to_cart = resolve('/cart/bulk/')
+        self.assertEqual(bulk_add_to_cart.view_name, 'cart:cart_bulk')
+        self.assertEqual(bulk_add_to_cart.func.__name__, 'bulk_add_to_cart')
+
+    def test_quote_url(self):
+        quote = resolve('/cart/quote/')
+        self.assertEqual(quote.view_name, 'cart:cart_quote')
+        self.assertEqual(quote.func.__name__, 'quote')
+
     def test_remove_form_cart_url(self):
         add_to_cart = resolve('/cart/remove/')
         self.assertEqual(add_to_cart.view_name, 'cart:cart_remove')
@@ -20,3 +30,7 @@ class CartURLsTestCase(TestCase):
         self.assertEqual(cart_clear.view_name, 'cart:cart_clear')
         self.assertEqual(cart_clear.func.__name__, 'clear_cart')
 
+    def test_cart_summary_url(self):
+        cart_summary = resolve('/cart/summary/')
+        self.assertEqual(cart_summary.view_name, 'cart:cart_summary')
+        self.assertEqual(cart_summary.func.__name__, 'cart_summary')
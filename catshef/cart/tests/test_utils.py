@@ -3,6 +3,7 @@ from django.contrib.auth.models import AnonymousUser
 from django.http import Http404
 from django.http.request import QueryDict
 
+from cart.exceptions import InvalidOptionsException
 from cart.tests.test_cart import SessionDict
 from catshef.exceptions import ArgumentError
 
@@ -10,7 +11,7 @@ from cart.cart import Cart
 from products.models import (Product, ProductOption, ProductOptionGroup,
     Membership)
 from cart.utils import (get_cart_item_json_response, parse_add_to_cart_POST,
-    parse_remove_from_cart_POST)
+    parse_remove_from_cart_POST, resolve_options)
 
 class RequestMock(object):
     """
@@ -53,6 +54,7 @@ class UtilsTestCase(TestCase):
             type=ProductOptionGroup.CHECKBOX)
         Membership.objects.create(option=cls.po1, group=g1,
             default=True)
+        Membership.objects.create(option=cls.po2, group=g1)
         g1.products.add(cls.p1)
 
 
@@ -244,4 +246,78 @@ class UtilsTestCase(TestCase):
             self.request.POST['quantity'] = 3
             self.request.POST['update_quantity'] = 'D.R.E.'
 
-            res = parse_add_to_cart_POST(self.request)        
+            res = parse_add_to_cart_POST(self.request)
+
+class ResolveOptionsTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.p1 = Product.objects.create(name='p1', slug='p1', stock=1,
+            price=10)
+        cls.p2 = Product.objects.create(name='p2', slug='p2', stock=1,
+            price=10)
+        cls.po1, cls.po2, cls.po3, cls.po4 = [ProductOption.objects.create(
+            name='option_{}'.format(i), price=i) for i in range(1, 5)]
+
+        # p1: radio (po1, po2), dropdown (po2, po3) and checkbox (po3, po4)
+        # p2: radio (po1, po2)
+        radio = ProductOptionGroup.objects.create(name='radio',
+            type=ProductOptionGroup.RADIO)
+        dropdown = ProductOptionGroup.objects.create(name='dropdown',
+            type=ProductOptionGroup.DROPDOWN)
+        checkbox = ProductOptionGroup.objects.create(name='checkbox',
+            type=ProductOptionGroup.CHECKBOX)
+        for group, options in ((radio, (cls.po1, cls.po2)),
+                (dropdown, (cls.po2, cls.po3)),
+                (checkbox, (cls.po3, cls.po4))):
+            for option in options:
+                Membership.objects.create(group=group, option=option)
+        radio.products.add(cls.p1, cls.p2)
+        dropdown.products.add(cls.p1)
+        checkbox.products.add(cls.p1)
+
+    def test_resolve(self):
+        with self.assertNumQueries(1):
+            options = resolve_options([
+                (self.p1, [self.po4.pk, self.po1.pk, self.po3.pk]),
+                (self.p1, []),
+                (self.p2, [self.po2.pk])])
+        self.assertEqual(options, [[self.po4, self.po1, self.po3], [],
+            [self.po2]])
+        with self.assertNumQueries(0):
+            self.assertEqual(resolve_options([(self.p1, [])]), [[]])
+
+    def test_option_in_many_groups(self):
+        # po2 in the radio group and in the dropdown group
+        self.assertEqual(resolve_options([(self.p1, [self.po2.pk,
+            self.po2.pk])]), [[self.po2, self.po2]])
+        # po1 takes the radio group, so po2 must be in the dropdown group
+        self.assertEqual(resolve_options([(self.p1, [self.po2.pk,
+            self.po1.pk])]), [[self.po2, self.po1]])
+        # po3 in the dropdown group and in the checkbox group
+        self.assertEqual(resolve_options([(self.p1, [self.po3.pk,
+            self.po3.pk, self.po1.pk])]), [[self.po3, self.po3, self.po1]])
+
+    def test_not_an_option_of_the_product(self):
+        with self.assertRaises(Http404):
+            resolve_options([(self.p2, [self.po1.pk, self.po3.pk])])
+        with self.assertRaises(Http404):
+            resolve_options([(self.p1, [9999])])
+
+    def test_repeated_checkbox_option(self):
+        # the options of a checkbox group can be chosen many times
+        self.assertEqual(resolve_options([(self.p1, [self.po4.pk] * 3)]),
+            [[self.po4] * 3])
+        # po3 in the dropdown group and in the checkbox group
+        self.assertEqual(resolve_options([(self.p1, [self.po3.pk] * 3 +
+            [self.po2.pk, self.po1.pk])]), [[self.po3] * 3 + [self.po2,
+                self.po1]])
+
+    def test_invalid_choice(self):
+        for options_pks in ([self.po1.pk, self.po1.pk],
+                [self.po1.pk, self.po2.pk, self.po3.pk, self.po2.pk],
+                [self.po2.pk] * 3):
+            with self.assertRaises(InvalidOptionsException):
+                resolve_options([(self.p1, options_pks)])
+        with self.assertRaises(InvalidOptionsException):
+            resolve_options([(self.p2, [self.po1.pk, self.po2.pk])])
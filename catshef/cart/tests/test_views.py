@@ -1,12 +1,15 @@
 import json
+from copy import deepcopy
 from decimal import Decimal
 
 from cart.tests.test_cart import SessionDict
 
 from cart.cart import Cart
-from cart.views import add_to_cart, remove_from_cart, clear_cart
+from cart.views import (add_to_cart, bulk_add_to_cart, remove_from_cart,
+    clear_cart, cart_summary, quote)
 from products.models import (Product, Category, ProductOption,
     ProductOptionGroup, Membership)
+from products.utils import combinations
 
 from django.test import TestCase, RequestFactory
 from django.core.urlresolvers import reverse, resolve
@@ -29,6 +32,15 @@ class BaseTestCase(TestCase):
         self.last_session_dict = request.session
         return ret
 
+    def post_ajax_json(self, func, path, data):
+        request = self.factory.post(path, data=json.dumps(data),
+            content_type='application/json', **BaseTestCase.AJAX_KWARG)
+        request.session = self.last_session_dict
+        ret = func(request)
+        self.last_request = request
+        self.last_session_dict = request.session
+        return ret
+
     def get_cart(self):
         return Cart(self.last_request)
 
@@ -48,8 +60,11 @@ class BaseTestCase(TestCase):
         cls._setup_product_opitons_product_option_group_membership()
 
         cls.CART_ADD_URL = reverse('cart:cart_add')
+        cls.CART_BULK_URL = reverse('cart:cart_bulk')
+        cls.CART_QUOTE_URL = reverse('cart:cart_quote')
         cls.CART_REMOVE_URL = reverse('cart:cart_remove')
         cls.CART_CLEAR_URL = reverse('cart:cart_clear')
+        cls.CART_SUMMARY_URL = reverse('cart:cart_summary')
 
     @classmethod
     def _setup_products(cls):
@@ -126,6 +141,8 @@ class BaseTestCase(TestCase):
             type=ProductOptionGroup.CHECKBOX)
         cls.g4 = ProductOptionGroup.objects.create(name='SomeGroup4',
             type=ProductOptionGroup.CHECKBOX)
+        cls.g5 = ProductOptionGroup.objects.create(name='SomeGroup5',
+            type=ProductOptionGroup.CHECKBOX)
 
     @classmethod
     def _setup_product_opitons_product_option_group_membership(cls):
@@ -134,8 +151,9 @@ class BaseTestCase(TestCase):
 
         Cheatsheet:
         self.p1-> | defaults: po1, po4 | groups: g1, g2, g3
-        self.p2-> | defualts: None     | groups: g2  
+        self.p2-> | defualts: None     | groups: g2, g5
         self.p4-> | defaults: po1, po1  | groups: g1, g4
+        self.p3_unav, self.p5, self.p7-> | defaults: None | groups: g5
         """
         Membership.objects.create(group=cls.g1, option=cls.po1, default=True)
         Membership.objects.create(group=cls.g1, option=cls.po2, default=False)
@@ -154,6 +172,12 @@ class BaseTestCase(TestCase):
         Membership.objects.create(group=cls.g4, option=cls.po1, default=True)
         cls.g4.products.add(cls.p4)
 
+        # options (without defaults) of products which are added with
+        # arbitrary options
+        for option in (cls.po1, cls.po2, cls.po3):
+            Membership.objects.create(group=cls.g5, option=option)
+        cls.g5.products.add(cls.p2, cls.p3_unav, cls.p5, cls.p7)
+
 
 
 class AddToCartViewTestCase(BaseTestCase):
@@ -410,6 +434,31 @@ class AddToCartViewTestCase(BaseTestCase):
             'content of "message" in response JSON.')
         self.assertEqual(prev_price, cart.get_final_price())
 
+    def test_add_product_with_invalid_options(self):
+        # po3 isn't an option of p4
+        with self.assertRaises(Http404):
+            self.post_ajax(add_to_cart, self.CART_ADD_URL, {'product_pk':
+                self.p4.pk, 'options_pks': [self.po1.pk, self.po3.pk]})
+
+        # p4 has po2 in a radio group only, so it can't be chosen twice
+        response = self.post_ajax(add_to_cart, self.CART_ADD_URL, {
+            'product_pk': self.p4.pk, 'options_pks': [self.po2.pk,
+                self.po2.pk]})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('message', json.loads(str(response.content, 'utf-8')))
+        self.assertEqual(len(self.get_cart()), 0)
+
+    def test_add_product_with_repeated_checkbox_option(self):
+        # p5 has po1 in a checkbox group, so it can be chosen many times
+        response = self.post_ajax(add_to_cart, self.CART_ADD_URL, {
+            'product_pk': self.p5.pk, 'options_pks': [self.po1.pk,
+                self.po1.pk]})
+        self.assertEqual(response.status_code, 201)
+        item = self.get_cart()._get_item(self.p5, options=[self.po1,
+                                                                    self.po1])
+        self.assertEqual(item['quantity'], 1)
+        self.assertEqual(item['total_options_price'], Decimal('24.62'))
+
     def test_add_product_with_default_options(self):
         """
         Test that when a product is added without any options passed (not even
@@ -590,6 +639,245 @@ class AddToCartViewTestCase(BaseTestCase):
             request = self.factory.get(self.CART_ADD_URL)
             response = add_to_cart(request)
 
+class BulkAddToCartViewTestCase(BaseTestCase):
+
+    def test_bulk_add(self):
+        self.post_ajax(add_to_cart, self.CART_ADD_URL, {'product_pk': 
+            self.p2.pk, 'options_pks': '', 'quantity': 3})
+
+        operations = [
+            {'product_pk': self.p1.pk, 'options_pks': [self.po1.pk,
+                self.po2.pk], 'quantity': 2},
+            {'product_pk': self.p1.pk, 'options_pks': '', 'quantity': 1},
+            {'product_pk': self.p2.pk, 'options_pks': [], 'quantity': 1,
+                'update_quantity': True},
+            # default options: po1 and po4
+            {'product_pk': self.p1.pk},
+        ]
+        # the option combinations already exist
+        combinations.get_combination((self.po1, self.po2))
+        combinations.get_combination((self.po1, self.po4))
+        # products, options, p1's default options (a single query, see
+        # products.utils.default_options), a lookup per option combination (they're cached in memory once the
+        # transaction is committed, which never happens inside a TestCase)
+        # and the cart's totals (products and options), no matter how many
+        # operations there are
+        with self.assertNumQueries(7):
+            response = self.post_ajax_json(bulk_add_to_cart,
+                self.CART_BULK_URL, {'operations': operations})
+        self.assertEqual(response.status_code, 200)
+
+        cart = self.get_cart()
+        self.assertEqual(len(cart), 5)
+        self.assertEqual(cart.get_final_price(), Decimal('67.43'))
+
+        res = json.loads(str(response.content, 'utf-8'))
+        expected_items = [
+            {
+                'product_pk': self.p1.pk,
+                'options_pks': [self.po1.pk, self.po2.pk],
+                'quantity': 2,
+                'total_options_price': 15.45,
+                'total_final_price': 40.9,
+            },
+            {
+                'product_pk': self.p1.pk,
+                'options_pks': '',
+                'quantity': 1,
+                'total_options_price': 0,
+                'total_final_price': 5,
+            },
+            {
+                'product_pk': self.p2.pk,
+                'options_pks': '',
+                'quantity': 1,
+                'total_options_price': 0,
+                'total_final_price': 0.12,
+            },
+            {
+                'product_pk': self.p1.pk,
+                'options_pks': [self.po1.pk, self.po4.pk],
+                'quantity': 1,
+                'total_options_price': 16.41,
+                'total_final_price': 21.41,
+            },
+        ]
+        self.assertEqual(res['items'], expected_items)
+        self.assertEqual(res['cart'], cart.summary.to_dict())
+
+    def test_bulk_add_is_atomic(self):
+        self.post_ajax(add_to_cart, self.CART_ADD_URL, {'product_pk': 
+            self.p1.pk, 'options_pks': '', 'quantity': 3})
+
+        operations = [
+            {'product_pk': self.p1.pk, 'options_pks': '', 'quantity': 2},
+            {'product_pk': self.p3_unav.pk, 'options_pks': '',
+                'quantity': 1},
+        ]
+        response = self.post_ajax_json(bulk_add_to_cart, self.CART_BULK_URL,
+            {'operations': operations})
+        self.assertEqual(response.status_code, 400)
+        res = json.loads(str(response.content, 'utf-8'))
+        self.assertIn('unavailable', res['message'])
+
+        cart = self.get_cart()
+        self.assertEqual(len(cart), 3)
+        self.assertEqual(cart.get_final_price(), Decimal(15))
+
+    def test_bulk_add_non_existent(self):
+        with self.assertRaises(Http404):
+            self.post_ajax_json(bulk_add_to_cart, self.CART_BULK_URL,
+                {'operations': [{'product_pk': 9999, 'options_pks': ''}]})
+
+        with self.assertRaises(Http404):
+            self.post_ajax_json(bulk_add_to_cart, self.CART_BULK_URL,
+                {'operations': [{'product_pk': self.p1.pk,
+                    'options_pks': [self.po1.pk, 9999]}]})
+        self.assertEqual(len(self.get_cart()), 0)
+
+    def test_bulk_add_invalid_options(self):
+        operations = [
+            {'product_pk': self.p1.pk, 'options_pks': [self.po1.pk]},
+            # po2 is in the radio group of p4 only
+            {'product_pk': self.p4.pk, 'options_pks': [self.po2.pk] * 2},
+        ]
+        response = self.post_ajax_json(bulk_add_to_cart, self.CART_BULK_URL,
+            {'operations': operations})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(self.get_cart()), 0)
+
+        operations[1]['options_pks'] = [self.po4.pk]
+        with self.assertRaises(Http404):
+            self.post_ajax_json(bulk_add_to_cart, self.CART_BULK_URL,
+                {'operations': operations})
+        self.assertEqual(len(self.get_cart()), 0)
+
+    def test_bulk_add_invalid_body(self):
+        with self.assertRaises(Http404):
+            self.post_ajax_json(bulk_add_to_cart, self.CART_BULK_URL,
+                {'products': []})
+
+        with self.assertRaises(Http404):
+            self.post_ajax_json(bulk_add_to_cart, self.CART_BULK_URL,
+                {'operations': [{'options_pks': ''}]})
+
+    def test_bulk_add_invalid_values(self):
+        # values of the wrong JSON type are rejected like any other
+        # malformed value
+        for operation in ({'quantity': None}, {'product_pk': [self.p1.pk]},
+                {'product_pk': {}}, {'update_quantity': {}},
+                {'update_quantity': None}, {'options_pks': [None]},
+                {'options_pks': [[self.po1.pk]]}):
+            with self.subTest(operation=operation):
+                with self.assertRaises(Http404):
+                    self.post_ajax_json(bulk_add_to_cart, self.CART_BULK_URL,
+                        {'operations': [dict({'product_pk': self.p1.pk},
+                                                            **operation)]})
+        self.assertEqual(len(self.get_cart()), 0)
+
+    def test_bulk_add_GET_refused(self):
+        """
+        Make sure that GET requests are refused.
+        """
+        with self.assertRaises(Http404):
+            request = self.factory.get(self.CART_BULK_URL)
+            response = bulk_add_to_cart(request)
+
+class QuoteViewTestCase(BaseTestCase):
+
+    def quote(self, lines, include_cart=False):
+        return self.post_ajax_json(quote, self.CART_QUOTE_URL,
+            {'lines': lines, 'include_cart': include_cart})
+
+    def test_quote(self):
+        self.post_ajax(add_to_cart, self.CART_ADD_URL, {'product_pk':
+            self.p1.pk, 'options_pks': '', 'quantity': 3})
+        session = deepcopy(self.last_session_dict)
+        self.last_session_dict.modified = False
+
+        lines = [
+            {'product_pk': self.p1.pk, 'options_pks': [self.po2.pk,
+                self.po4.pk], 'quantity': 2},
+            # default options: po1 and po4
+            {'product_pk': self.p1.pk},
+            {'product_pk': self.p5.pk, 'options_pks': ''},
+        ]
+        response = self.quote(lines)
+        self.assertEqual(response.status_code, 200)
+        res = json.loads(str(response.content, 'utf-8'))
+        self.assertEqual(res['items'][0], {
+            'product_pk': self.p1.pk,
+            'options_pks': [self.po2.pk, self.po4.pk],
+            'quantity': 2,
+            'unit_price': 12.24,
+            'total_options_price': 7.24,
+            'total_original_price': 34.48,
+            'total_final_price': 24.48,
+        })
+        self.assertEqual(res['items'][1]['options_pks'], [self.po1.pk,
+            self.po4.pk])
+        self.assertEqual(res['items'][1]['total_final_price'], 21.41)
+        self.assertEqual(res['items'][2]['options_pks'], '')
+        self.assertEqual(res['items'][2]['total_final_price'], 3.14)
+        self.assertEqual(res['totals']['item_count'], 4)
+        self.assertEqual(res['totals']['final_price'], 49.03)
+
+        response = self.quote(lines, include_cart=True)
+        res = json.loads(str(response.content, 'utf-8'))
+        self.assertEqual(res['totals']['item_count'], 7)
+        self.assertEqual(res['totals']['final_price'], 64.03)
+
+        # the session was never written
+        self.assertFalse(self.last_session_dict.modified)
+        self.assertEqual(self.last_session_dict, session)
+        self.assertEqual(len(self.get_cart()), 3)
+
+    def test_queries(self):
+        lines = [{'product_pk': product.pk, 'options_pks': [self.po1.pk],
+            'quantity': 1} for product in (self.p2, self.p5, self.p7)]
+        self.quote(lines)
+        # the products and the options (once the price matrices are cached),
+        # no matter how many lines there are
+        with self.assertNumQueries(2):
+            response = self.quote(lines)
+        self.assertEqual(response.status_code, 200)
+
+    def test_invalid(self):
+        # a single option of the radio group of p4
+        response = self.quote([{'product_pk': self.p4.pk,
+            'options_pks': [self.po2.pk] * 2}])
+        self.assertEqual(response.status_code, 400)
+
+        response = self.quote([{'product_pk': self.p1.pk, 'quantity': -1}])
+        self.assertEqual(response.status_code, 400)
+
+        with self.assertRaises(Http404):
+            self.quote([{'product_pk': self.p5.pk,
+                'options_pks': [self.po4.pk]}])
+        with self.assertRaises(Http404):
+            self.quote([{'product_pk': 9999}])
+
+    def test_malformed(self):
+        for body in ([], {'lines': {}}, {'lines': [None]},
+                {'lines': [], 'include_cart': {}}):
+            with self.subTest(body=body):
+                response = self.post_ajax_json(quote, self.CART_QUOTE_URL,
+                    body)
+                self.assertEqual(response.status_code, 400)
+        for line in ({'quantity': None}, {'product_pk': [self.p1.pk]},
+                {'product_pk': None}, {'options_pks': [None]},
+                {'options_pks': {}}, {'quantity': 'two'}):
+            with self.subTest(line=line):
+                response = self.quote([dict({'product_pk': self.p1.pk},
+                                                                    **line)])
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('message', json.loads(str(response.content,
+                                                                    'utf-8')))
+
+    def test_quote_GET_refused(self):
+        with self.assertRaises(Http404):
+            quote(self.factory.get(self.CART_QUOTE_URL))
+
 class RemoveFromCartViewTestCase(BaseTestCase):
     """
     Tests removing products from cart.
@@ -877,6 +1165,22 @@ class RemoveFromCartViewTestCase(BaseTestCase):
         self.assertEqual(cart.get_final_price(), Decimal('128.18'))
 
     
+    def test_remove_stale_item(self):
+        # items whose options can't be chosen anymore can still be removed
+        self.post_ajax(add_to_cart, self.CART_ADD_URL, {'product_pk':
+            self.p1.pk, 'options_pks': [self.po2.pk, self.po4.pk]})
+        self.g3.products.remove(self.p1)
+        Membership.objects.filter(group=self.g1, option=self.po2).delete()
+        response = self.post_ajax(remove_from_cart, self.CART_REMOVE_URL,
+            {'product_pk': self.p1.pk, 'options_pks': [self.po2.pk,
+                self.po4.pk]})
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(len(self.get_cart()), 0)
+
+        with self.assertRaises(Http404):
+            self.post_ajax(remove_from_cart, self.CART_REMOVE_URL,
+                {'product_pk': self.p1.pk, 'options_pks': [self.po4.pk + 1]})
+
     def test_remove_from_cart_GET_refused(self):
         """
         Make sure that GET requests are refused.
@@ -972,3 +1276,99 @@ class ClearCartViewTestCase(BaseTestCase):
             request = self.factory.get(self.CART_CLEAR_URL)
             response = clear_cart(request)
 
+class CartSummaryViewTestCase(BaseTestCase):
+
+    def get_summary(self, etag=None):
+        kwargs = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        request = self.factory.get(self.CART_SUMMARY_URL, **kwargs)
+        request.session = self.last_session_dict
+        return cart_summary(request)
+
+    def test_summary(self):
+        response = self.get_summary()
+        self.assertEqual(response.status_code, 200)
+        res = json.loads(str(response.content, 'utf-8'))
+        self.assertEqual(res['items'], [])
+        self.assertEqual(res['cart']['item_count'], 0)
+
+        self.post_ajax(add_to_cart, self.CART_ADD_URL, {'product_pk': 
+            self.p1.pk, 'options_pks': [self.po1.pk, self.po2.pk], 
+            'quantity': 2})
+        response = self.get_summary()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('no-cache', response['Cache-Control'])
+        res = json.loads(str(response.content, 'utf-8'))
+        self.assertEqual(res['items'], [{
+            'product_pk': self.p1.pk,
+            'product_name': self.p1.name,
+            'product_url': self.p1.get_absolute_url(),
+            'options_pks': [self.po1.pk, self.po2.pk],
+            'options_names': [self.po1.name, self.po2.name],
+            'quantity': 2,
+            'total_options_price': 15.45,
+            'total_original_price': 50.9,
+            'total_final_price': 40.9,
+        }])
+        self.assertEqual(res['cart'], self.get_cart().summary.to_dict())
+        self.assertEqual(res['cart']['item_count'], 2)
+
+    def test_not_modified(self):
+        self.post_ajax(add_to_cart, self.CART_ADD_URL, {'product_pk': 
+            self.p1.pk, 'options_pks': '', 'quantity': 2})
+        etag = self.get_summary()['ETag']
+
+        # no queries at all, the cart is in the (mock) session
+        with self.assertNumQueries(0):
+            response = self.get_summary(etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        # the cart changes
+        self.post_ajax(add_to_cart, self.CART_ADD_URL, {'product_pk': 
+            self.p1.pk, 'options_pks': '', 'quantity': 1})
+        response = self.get_summary(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        etag = response['ETag']
+
+        # a price changes
+        p1 = Product.objects.get(pk=self.p1.pk)
+        p1.offer_price = 4
+        p1.save()
+        response = self.get_summary(etag)
+        self.assertEqual(response.status_code, 200)
+        res = json.loads(str(response.content, 'utf-8'))
+        self.assertEqual(res['cart']['final_price'], 12)
+
+    def test_not_modified_after_repricing(self):
+        self.post_ajax(add_to_cart, self.CART_ADD_URL, {'product_pk': 
+            self.p1.pk, 'options_pks': '', 'quantity': 2})
+        etag = self.get_summary()['ETag']
+        p1 = Product.objects.get(pk=self.p1.pk)
+        p1.offer_price = 4
+        p1.save()
+        # the cart is re-priced (and saved) while building the response, so
+        # the ETag is the one of the saved cart
+        response = self.get_summary(etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.get_summary(etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_not_reused_after_clear(self):
+        self.post_ajax(add_to_cart, self.CART_ADD_URL, {'product_pk': 
+            self.p1.pk, 'options_pks': '', 'quantity': 2})
+        etag = self.get_summary()['ETag']
+        self.post_ajax(clear_cart, self.CART_CLEAR_URL)
+        self.post_ajax(add_to_cart, self.CART_ADD_URL, {'product_pk': 
+            self.p2.pk, 'options_pks': '', 'quantity': 2})
+        self.assertEqual(self.get_summary(etag).status_code, 200)
+
+    def test_summary_POST_refused(self):
+        """
+        Make sure that POST requests are refused.
+        """
+        with self.assertRaises(Http404):
+            self.post_ajax(cart_summary, self.CART_SUMMARY_URL)
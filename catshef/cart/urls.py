@@ -4,6 +4,9 @@ from cart import views
 
 urlpatterns = [
     url(r'^add/$', views.add_to_cart, name='cart_add'),
+    url(r'^bulk/$', views.bulk_add_to_cart, name='cart_bulk'),
+    url(r'^quote/$', views.quote, name='cart_quote'),
     url(r'^remove/$', views.remove_from_cart, name='cart_remove'),
     url(r'^clear/$', views.clear_cart, name='cart_clear'),
+    url(r'^summary/$', views.cart_summary, name='cart_summary'),
 ]
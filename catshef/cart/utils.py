@@ -1,20 +1,27 @@
 import collections
+import json
 from decimal import Decimal
 
 from cart.exceptions import (QueryParamsError, NegativeQuantityException,
-ProductUnavailableException, ProductStockZeroException)
+ProductUnavailableException, ProductStockZeroException,
+InvalidOptionsException)
 
 from catshef.exceptions import ArgumentError
 
-from products.models import Product, ProductOption
+from products.models import (Product, ProductOption, ProductOptionGroup,
+    Membership)
+from products.utils import default_options
+from products.utils.pricing import get_price_version
 
+from django.db.models import F
 from django.http import Http404
 from django.shortcuts import get_object_or_404
 
 def _parse_int(value, name='value'):
     try:
        value = int(value)
-    except ValueError:
+    except (TypeError, ValueError):
+        # (TypeError: e.g. null, a list or an object, in a JSON body)
         raise ArgumentError('{} must be an int '
                         '(or something that can be coerced to it)'.format(name))
     return value
@@ -51,7 +58,7 @@ def _parse_bool(value, name='value'):
             else:
                 raise ArgumentError('Invalid int value "{}"" for bool "{}"'.
                     format(value, name))
-        except ValueError:
+        except (TypeError, ValueError):
             raise ArgumentError('Value "{}" for bool "{}"" is invalid'.
                 format(value, name))
     return res
@@ -84,9 +91,51 @@ def get_cart_item_json_response(cart, product, options=[]):
 
     return res
 
-def _parse_POST_basic(request):
+def get_cart_etag(cart, price_version=None):
+    """
+    Get the (unquoted) ETag of the cart's summary. It changes whenever the
+    cart changes (see Cart.revision) or any price changes (see
+    products.utils.pricing), and computing it doesn't fetch any products.
+
+    Args:
+        price_version: the global price version read before the cart was
+            (or will be) priced (the current one by default)
+    """
+    if price_version is None:
+        price_version = get_price_version()
+    return '{}-{}'.format(cart.revision, price_version)
+
+def get_cart_summary_json_response(cart):
+    """
+    Builds JSON response describing the whole cart: its items (under
+    "items") and its totals (under "cart").
+    """
+    items = []
+    for item in cart:
+        product = item['product']
+        options = item.get('options', [])
+        items.append({
+            'product_pk': product.pk,
+            'product_name': product.name,
+            'product_url': product.get_absolute_url(),
+            'options_pks': ([option.pk for option in options] 
+                                                if len(options) > 0 else ''),
+            'options_names': [option.name for option in options],
+            'quantity': float(item['quantity']),
+            'total_options_price': float(item['total_options_price']),
+            'total_original_price': float(item['total_original_price']),
+            'total_final_price': float(item['total_final_price']),
+        })
+    return {'items': items, 'cart': cart.summary.to_dict()}
+
+def _parse_POST_basic(request, check_options=True):
     """
     Parse post args and retrieve the related product and options (if applies).
+
+    If `check_options` is False, the options are just looked up by pk,
+    without checking that they can be chosen for the product (see
+    resolve_options()), e.g. to remove an item whose options were chosen
+    before the product's option groups changed.
     """
     res = {}
 
@@ -114,8 +163,14 @@ def _parse_POST_basic(request):
         # if it's None, then the product will be added with defaults
         if not isinstance(options_pks, collections.Iterable):
             raise ArgumentError('option_pks must be an iterable')
-        res['options'] = [get_object_or_404(ProductOption, pk=pk) 
-                                                    for pk in options_pks]
+        options_pks = [_parse_int(pk, 'options_pks') for pk in options_pks]
+        if check_options:
+            res['options'] = resolve_options([(product, options_pks)])[0]
+        else:
+            options = ProductOption.objects.in_bulk(set(options_pks))
+            if any(pk not in options for pk in options_pks):
+                raise Http404('No ProductOption matches the given query.')
+            res['options'] = [options[pk] for pk in options_pks]
     else:
         # options were not passed, not even an empty list, so add with defaults
         res['options'] = product.get_default_options()
@@ -132,8 +187,195 @@ def parse_add_to_cart_POST(request):
 
     return res
 
-def parse_remove_from_cart_POST(request):    
-    return _parse_POST_basic(request)
+def parse_remove_from_cart_POST(request):
+    # the item may have been added before the product's options changed, so
+    # it must be removable even if its options can't be chosen anymore
+    return _parse_POST_basic(request, check_options=False)
+
+def parse_bulk_POST(request):
+    """
+    Parse the JSON body of a bulk cart request and retrieve all of the related
+    products and options. Products and options are fetched with one query
+    per model, no matter how many operations are in the request.
+
+    Expected body:
+        {"operations": [{"product_pk": 1, "options_pks": [1, 2],
+                         "quantity": 2, "update_quantity": false}, ...]}
+
+    The meaning of each of the operation's values is the same as in the
+    add_to_cart view (cart.views.add_to_cart), including omitting
+    "options_pks" to use the product's default options.
+
+    Returns a list of dicts with the same keys as the dict returned by
+    parse_add_to_cart_POST(), one per operation (in the same order).
+    """
+    return _parse_operations(_load_JSON_body(request), 'operations')
+
+def parse_quote_POST(request):
+    """
+    Parse the JSON body of a quote request (see cart.views.quote) and
+    retrieve all of the related products and options, the same way as
+    parse_bulk_POST() does.
+
+    Expected body:
+        {"lines": [{"product_pk": 1, "options_pks": [1, 2],
+                    "quantity": 2}, ...],
+         "include_cart": false}
+
+    Returns a (lines, include_cart) tuple, where the lines are dicts with
+    the same keys as the dicts returned by parse_bulk_POST().
+    """
+    body = _load_JSON_body(request)
+    return (_parse_operations(body, 'lines'),
+        _parse_bool(body.get('include_cart', False), 'include_cart'))
+
+def _load_JSON_body(request):
+    try:
+        body = json.loads(request.body.decode('utf-8'))
+    except ValueError:
+        body = None
+    if not isinstance(body, dict):
+        raise ArgumentError('request body must be a JSON object')
+    return body
+
+def _parse_operations(body, key):
+    """
+    Parse the list of operations under `key` in a JSON request body and
+    retrieve all of the related products and options (see parse_bulk_POST()).
+    """
+    operations = body.get(key)
+    if not isinstance(operations, list):
+        raise ArgumentError('request body must be a JSON object with an '
+                                                    '"{}" list'.format(key))
+
+    res = []
+    for operation in operations:
+        if not isinstance(operation, dict):
+            raise ArgumentError('each operation must be a JSON object')
+        if operation.get('product_pk') is None:
+            raise ArgumentError('product_pk not provided')
+
+        options_pks = operation.get('options_pks')
+        if options_pks is not None:
+            if options_pks == '':
+                # product is being added without options EXPLICITLY
+                options_pks = []
+            if not isinstance(options_pks, list):
+                raise ArgumentError('options_pks must be a list')
+            options_pks = [_parse_int(pk, 'options_pks') for pk in options_pks]
+
+        res.append({
+            'product': _parse_int(operation['product_pk'], 'product_pk'),
+            'options': options_pks,
+            'quantity': _parse_int(operation.get('quantity', 1), 'quantity'),
+            'update_quantity': _parse_bool(operation.get('update_quantity',
+                False), 'update_quantity'),
+            })
+
+    products = Product.objects.in_bulk(list({op['product'] for op in res}))
+    for op in res:
+        if op['product'] not in products:
+            raise Http404('No Product matches the given query.')
+        op['product'] = products[op['product']]
+
+    defaults = default_options.get_default_options({op['product'].pk
+                                    for op in res if op['options'] is None})
+    chosen = [op for op in res if op['options'] is not None]
+    options = resolve_options([(op['product'], op['options'])
+                                                        for op in chosen])
+    for op, op_options in zip(chosen, options):
+        op['options'] = op_options
+    for op in res:
+        if op['options'] is None:
+            # options were not passed, so add with defaults
+            op['options'] = defaults[op['product'].pk]
+
+    return res
+
+def resolve_options(choices):
+    """
+    Get the options chosen for products, checking that each of them is an
+    option of one of the product's option groups and that they can be chosen
+    together (see _can_choose()). The options of all the choices are fetched
+    with a single query.
+
+    Args:
+        choices: list of (product, list of option pks) pairs
+
+    Returns:
+        list of the lists of options of the choices (in the same order, with
+        the duplicates and the order of the pks preserved)
+
+    Raises:
+        Http404: if an option isn't an option of the product
+        InvalidOptionsException: if the options can't be chosen together
+    """
+    product_ids = {product.pk for product, options_pks in choices}
+    option_ids = {pk for product, options_pks in choices 
+                                                    for pk in options_pks}
+    options = {}
+    # product pk -> option pk -> set of (group pk, group type)
+    groups = collections.defaultdict(lambda: collections.defaultdict(set))
+    if option_ids:
+        memberships = Membership.objects.annotate(
+            product_id=F('group__products')).filter(
+                product_id__in=product_ids, option_id__in=option_ids
+                ).select_related('option', 'group')
+        for membership in memberships:
+            options[membership.option_id] = membership.option
+            groups[membership.product_id][membership.option_id].add(
+                (membership.group_id, membership.group.type))
+
+    res = []
+    for product, options_pks in choices:
+        product_groups = groups[product.pk]
+        if any(pk not in product_groups for pk in options_pks):
+            raise Http404('No ProductOption matches the given query.')
+        if not _can_choose(options_pks, product_groups):
+            raise InvalidOptionsException('These options can\'t be chosen '
+                'together for "{}"'.format(product))
+        res.append([options[pk] for pk in options_pks])
+    return res
+
+def _can_choose(options_pks, groups):
+    """
+    Whether the options can be chosen together: each option (duplicates
+    included) has to be chosen in one of its groups. A RADIO or DROPDOWN
+    group can have only one option chosen, once, while the options of a
+    CHECKBOX group can be chosen any number of times (e.g. a double
+    topping). An option can be in more than one group, so the options that
+    are only in RADIO or DROPDOWN groups are matched with these groups (a
+    bipartite matching, found with augmenting paths).
+
+    Args:
+        options_pks: list of the pks of the chosen options
+        groups: dict mapping the option pks to the sets of (group pk, group
+            type) of their groups
+    """
+    single_choice = (ProductOptionGroup.RADIO, ProductOptionGroup.DROPDOWN)
+    # the groups each option can take (every repetition of an option takes
+    # one), leaving out the options of a CHECKBOX group, which can always be
+    # chosen in it
+    choices = []
+    for pk in options_pks:
+        if all(group_type in single_choice
+                                    for group_id, group_type in groups[pk]):
+            choices.append([group_id for group_id, group_type in groups[pk]])
+    if len(choices) > len({group_id for option_choices in choices
+                                            for group_id in option_choices}):
+        # more options than groups
+        return False
+    matched = {}
+
+    def match(i, seen):
+        for group_id in choices[i]:
+            if group_id not in seen:
+                seen.add(group_id)
+                if group_id not in matched or match(matched[group_id], seen):
+                    matched[group_id] = i
+                    return True
+        return False
+    return all(match(i, set()) for i in range(len(choices)))
 
 def get_add_to_cart_status_code(quantity, update_quantity):
     """
@@ -141,6 +383,37 @@ def get_add_to_cart_status_code(quantity, update_quantity):
     """
     return 304 if quantity == 0 and not update_quantity else 201
 
+def quote_from_post_data(cart, lines, include_cart=False):
+    """
+    Wrapper around cart.cart.Cart.quote() that prices the lines (as returned
+    by parse_quote_POST()) and returns the appropriate response dict, as
+    well as status code. The cart is never changed (nor saved).
+
+    Returns a tuple consisting of status code and response dictionary (in that
+    order). On success, the response dictionary contains the quoted item of
+    each line (under "items", in the same order as the lines) and their
+    totals (under "totals", including the cart's items if `include_cart`).
+    """
+    try:
+        items, summary = cart.quote([(line['product'], line['options'],
+            line['quantity']) for line in lines], include_cart=include_cart)
+    except (NegativeQuantityException, ArgumentError) as ex:
+        return (400, {'message': str(ex)})
+
+    res_dict = {
+        'items': [{
+            'product_pk': item['product_pk'],
+            'options_pks': item['options_pks'] or '',
+            'quantity': item['quantity'],
+            'unit_price': float(item['unit_price']),
+            'total_options_price': float(item['total_options_price']),
+            'total_original_price': float(item['total_original_price']),
+            'total_final_price': float(item['total_final_price']),
+        } for item in items],
+        'totals': summary.to_dict(),
+    }
+    return (200, res_dict)
+
 def add_to_cart_from_post_data(cart, post_data):    
     """
     Wrapper arroung cart.cart.Cart.add() and 
@@ -179,6 +452,47 @@ def add_to_cart_from_post_data(cart, post_data):
 
     return (status_code, res_dict)
 
+def bulk_add_to_cart_from_post_data(cart, operations):
+    """
+    Applies all of the operations (as returned by parse_bulk_POST()) to the
+    cart. The operations are applied atomically: if one of them fails, none
+    of them is applied. The cart is saved only once.
+
+    Returns a tuple consisting of status code and response dictionary (in that
+    order). On success, the response dictionary contains the resulting
+    item of each operation (under "items", in the same order as the
+    operations) and the cart's new totals (under "cart").
+    """
+    message = None
+    try:
+        with cart.batch():
+            for post_data in operations:
+                cart.add(product=post_data['product'],
+                    options=post_data['options'],
+                    quantity=post_data['quantity'],
+                    update_quantity=post_data['update_quantity'])
+        status_code = 200
+    except (NegativeQuantityException,
+        ProductUnavailableException, ProductStockZeroException) as ex:
+        status_code = 400
+        message = str(ex)
+    except Exception as ex:
+        # some other error
+        status_code = 400
+        message = 'Error: ' + str(ex)
+
+    if status_code < 400:
+        res_dict = {
+            'items': [get_cart_item_json_response(cart=cart,
+                product=post_data['product'], options=post_data['options'])
+                for post_data in operations],
+            'cart': cart.summary.to_dict(),
+        }
+    else:
+        res_dict = {'message': message}
+
+    return (status_code, res_dict)
+
 def remove_from_cart_from_post_data(cart, post_data):
     """
     Wrapper arroung cart.cart.Cart.remove() that 
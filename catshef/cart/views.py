@@ -1,6 +1,6 @@
 """
 All of the cart manipulation views work only on AJAX request and are
-REST-ish.
+REST-ish. The cart's state can be read with the cart_summary view.
 
 On success, they return some information about the manipulated object.
 In both, success and failure, a message can be passed (this one should probably
@@ -10,12 +10,18 @@ import json
 
 from cart.cart import Cart
 from cart.utils import (parse_add_to_cart_POST, parse_remove_from_cart_POST,
-    add_to_cart_from_post_data, remove_from_cart_from_post_data)
+    parse_bulk_POST, parse_quote_POST, add_to_cart_from_post_data,
+    bulk_add_to_cart_from_post_data, remove_from_cart_from_post_data,
+    quote_from_post_data, get_cart_etag, get_cart_summary_json_response)
 
+from cart.exceptions import InvalidOptionsException
 from catshef.exceptions import ArgumentError
+from products.utils.pricing import get_price_version
 
 from django.shortcuts import render
 from django.http import HttpResponse, Http404, JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
 
 
 def add_to_cart(request):
@@ -30,7 +36,9 @@ def add_to_cart(request):
             set this to an EMPTY STRING (''). If you want to provide options, 
             set this to a list of ints, where ints are PKs of options to be 
             added. If this parameter is omitted, prodcut will be added to cart 
-            with its DEFAULT OPTIONS.
+            with its DEFAULT OPTIONS. The options must be options of the
+            product's groups (404 otherwise) and must be a valid choice: at
+            most one option of each radio or dropdown group (400 otherwise).
         * quantity (str or int): quantity of the product to be added to the cart. If
             omitted, defaults to 1.
         * update_quantity (str or int): whether cart quantity should be updated
@@ -49,7 +57,9 @@ def add_to_cart(request):
     if request.method == 'POST':
         cart = Cart(request)
         try:
-            post = parse_add_to_cart_POST(request)  # can raise Http404 or ArgumentError
+            post = parse_add_to_cart_POST(request)  # can raise Http404, ArgumentError or InvalidOptionsException
+        except InvalidOptionsException as err:
+            return JsonResponse({'message': str(err)}, status=400)
         except ArgumentError as err:
             raise Http404(str(err))
 
@@ -59,6 +69,83 @@ def add_to_cart(request):
     else:
         raise Http404()  # 404 instead of 403 is here on purpose (https://tools.ietf.org/html/rfc7231.html#page-59)
 
+def bulk_add_to_cart(request):
+    """
+    Responsible for adding/updating many items in cart in a single request.
+    All data must be provided via POST(for security reasons), as a JSON
+    request body.
+
+    Request body description:
+        {"operations": [operation, ...]}, where each operation is a JSON
+        object with the same keys as the POST data of add_to_cart
+        (product_pk, options_pks, quantity, update_quantity), except that
+        options_pks must be a list (or an empty string).
+
+        All of the operations are applied, or none of them is (if one of them
+        fails).
+
+    Returns:
+        JSON with an "items" key, which lists the added data description of
+        each operation (in the same order as the operations) and a "cart" key,
+        which holds the cart's totals.
+        JSON with a "message" key, which describes the error.
+
+    NOTE: any returned data can contain a "message" key
+    """
+    if request.method == 'POST':
+        cart = Cart(request)
+        try:
+            operations = parse_bulk_POST(request)  # can raise Http404, ArgumentError or InvalidOptionsException
+        except InvalidOptionsException as err:
+            return JsonResponse({'message': str(err)}, status=400)
+        except ArgumentError as err:
+            raise Http404(str(err))
+
+        status_code, res_dict = bulk_add_to_cart_from_post_data(cart,
+                                                                operations)
+        return JsonResponse(res_dict, status=status_code)
+
+    else:
+        raise Http404()  # 404 instead of 403 is here on purpose (https://tools.ietf.org/html/rfc7231.html#page-59)
+
+def quote(request):
+    """
+    Prices products with options, as if they were added to the cart, without
+    changing the cart (the session is never written), so it can be called
+    on every change of an options configurator.
+    All data must be provided via POST, as a JSON request body.
+
+    Request body description:
+        {"lines": [line, ...], "include_cart": false}, where each line is a
+        JSON object with the same keys as the POST data of add_to_cart
+        (product_pk, options_pks, quantity), except that options_pks must be
+        a list (or an empty string), and include_cart (optional, defaults to
+        false) tells whether the totals include the items in the cart.
+
+    Returns:
+        JSON with an "items" key, which lists the prices of each line
+        (in the same order as the lines) and a "totals" key, which holds
+        the totals of the lines (and of the cart's items, if include_cart is
+        true).
+        JSON with a "message" key, which describes the error (with status
+        400 if the body is malformed or the options are invalid, 404 if a
+        product or an option doesn't exist).
+    """
+    if request.method == 'POST':
+        cart = Cart(request)
+        try:
+            lines, include_cart = parse_quote_POST(request)  # can raise Http404, ArgumentError or InvalidOptionsException
+        except (InvalidOptionsException, ArgumentError) as err:
+            # (a malformed body is a bad request, not a missing resource)
+            return JsonResponse({'message': str(err)}, status=400)
+
+        status_code, res_dict = quote_from_post_data(cart, lines,
+                                                                include_cart)
+        return JsonResponse(res_dict, status=status_code)
+
+    else:
+        raise Http404()  # 404 instead of 403 is here on purpose (https://tools.ietf.org/html/rfc7231.html#page-59)
+
 def remove_from_cart(request):
     """
     Responsible for remobing items form cart.
@@ -83,7 +170,9 @@ def remove_from_cart(request):
     if request.method == 'POST':
         cart = Cart(request)
         try:
-            post = parse_remove_from_cart_POST(request)  # can raise Http404 or ArgumentError
+            post = parse_remove_from_cart_POST(request)  # can raise Http404, ArgumentError or InvalidOptionsException
+        except InvalidOptionsException as err:
+            return JsonResponse({'message': str(err)}, status=400)
         except ArgumentError as err:
             raise Http404(str(err))
 
@@ -107,4 +196,29 @@ def clear_cart(request):
         cart.clear()
         return HttpResponse(status=status_code)
     else:
-        raise Http404()  # 404 instead of 403 is here on purpose (https://tools.ietf.org/html/rfc7231.html#page-59) 
+        raise Http404()  # 404 instead of 403 is here on purpose (https://tools.ietf.org/html/rfc7231.html#page-59)
+
+def cart_summary(request):
+    """
+    Returns the cart's items and totals as JSON (see
+    cart.utils.get_cart_summary_json_response()).
+
+    Request must be via GET. The response carries an ETag, so clients can
+    poll the cart with If-None-Match: if the cart (and prices) didn't change,
+    a 304 Not Modified response is returned, without fetching any products.
+    """
+    if request.method == 'GET':
+        cart = Cart(request)
+        price_version = get_price_version()
+        response = get_conditional_response(request,
+            etag=get_cart_etag(cart, price_version))
+        if response is None:
+            response = JsonResponse(get_cart_summary_json_response(cart))
+        # iterating the cart re-prices (and saves) it if any price changed,
+        # which changes its revision, so the ETag is computed afterwards
+        response['ETag'] = quote_etag(get_cart_etag(cart, price_version))
+        # the cart is per user, and must be revalidated on every request
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+    else:
+        raise Http404()  # 404 instead of 403 is here on purpose (https://tools.ietf.org/html/rfc7231.html#page-59)
@@ -81,6 +81,10 @@ TEMPLATES = [
                 'account.context_processors.snackbar_data',
                 'cart.context_processors.cart',
             ],
+            'libraries': {
+                # page caching with holes for the per-user parts
+                'holes': 'common.holes',
+            },
         },
     },
 ]
@@ -99,6 +103,28 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/1.9/topics/cache/
+
+# The cache MUST be shared by all of the processes serving the site: the
+# global versions kept in it (the price version, see products.utils.pricing,
+# the facet version and the option groups version) are how a process learns
+# that what it keeps in memory (option combinations, the facet index, the
+# default options and price matrices of the products) is outdated. With a
+# per-process cache, like Django's default LocMemCache, the other processes
+# keep serving stale prices (the products.W001 check warns about it).
+# The file based cache is shared by the processes of a single host; use
+# memcached when serving from several hosts.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache/'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
 
@@ -144,6 +170,12 @@ INSTALLED_APPS += [
     'cart',
 ]
 CART_SESSION_ID = 'catshef.cart'
+# where carts are stored: 'cart.storage.SessionCartStorage',
+# 'cart.storage.DatabaseCartStorage' or 'cart.storage.CacheCartStorage'.
+# The carts stored in the database outlive the sessions that hold their
+# tokens, so with DatabaseCartStorage run "manage.py clearcarts" regularly
+# (e.g. along with "manage.py clearsessions").
+CART_STORAGE_BACKEND = 'cart.storage.SessionCartStorage'
 
 # django-allauth settings
 AUTHENTICATION_BACKENDS += (
@@ -208,4 +240,13 @@ TEST_RUNNER = 'django_nose.NoseTestSuiteRunner'
 FIXTURE_DIRS = (
     os.path.join(BASE_DIR, 'catshef/tests/fixtures/'),
 )
+
+# tests (and benchmarks) run in a single process, and mustn't see what's
+# cached by the site (or by previous runs), so they use a local memory cache
+TEST_RUNNER = 'catshef.test_runner.TestRunner'
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
 # -- END TESTING SETTINGS -- #
@@ -0,0 +1,26 @@
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+class TestRunner(DiscoverRunner):
+    """
+    Runs the tests with the TEST_CACHES cache settings (instead of the shared
+    cache of the site, see the CACHES setting), and with a temporary
+    MEDIA_ROOT, so the files uploaded by the tests are deleted afterwards
+    (instead of piling up in the site's media directory).
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super(TestRunner, self).setup_test_environment(**kwargs)
+        self._media_root = tempfile.mkdtemp(prefix='catshef-media-')
+        self._settings = override_settings(CACHES=settings.TEST_CACHES,
+            MEDIA_ROOT=self._media_root)
+        self._settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._settings.disable()
+        shutil.rmtree(self._media_root, ignore_errors=True)
+        super(TestRunner, self).teardown_test_environment(**kwargs)
@@ -0,0 +1,117 @@
+"""
+Whole-page caching with holes for the per-user parts.
+
+A page is cached with its per-user parts (login state, snackbars, anything
+with a CSRF token) left out as "holes", which are filled in on every
+request, so a cache hit takes no queries (other than the ones of the holes)
+and no rendering of the page itself. Holes should be cheap: e.g. the cart
+badge is filled in by the client (see jquery.mycart.js), since reading the
+cart would load the cart storage on every page.
+
+Holes are marked in templates with the 'hole' tag (from the 'holes' tag
+library), giving the template rendering the per-user part:
+
+    {% load holes %}
+    {% hole "products/holes/user_menu.html" %}
+
+When a template is rendered as usual, the tag just includes the template.
+When it's rendered by cached_render(), it leaves a hole instead, which is
+filled by rendering the template with nothing but what the context
+processors put in the context (the page's context isn't cached), so hole
+templates must not use anything else.
+"""
+from django import template
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.template import Context, Engine
+from django.template.loader import render_to_string
+from django.utils.crypto import get_random_string
+
+register = template.Library()
+
+# context variable set while rendering a page to cache: (marker, list of
+# the templates of the holes, in order)
+HOLES_CONTEXT_KEY = '_holes'
+
+class HoleNode(template.Node):
+
+    def __init__(self, template_name):
+        self.template_name = template_name
+
+    def render(self, context):
+        template_name = self.template_name.resolve(context)
+        holes = context.get(HOLES_CONTEXT_KEY)
+        if holes is None:
+            return context.template.engine.get_template(template_name).render(
+                context)
+        marker, templates = holes
+        templates.append(template_name)
+        return marker
+
+@register.tag
+def hole(parser, token):
+    """
+    Include a template rendering a per-user part of the page, which is left
+    out of the page when it's cached (see cached_render()).
+
+    Usage:
+        {% hole "template_name.html" %}
+    """
+    bits = token.split_contents()
+    if len(bits) != 2:
+        raise template.TemplateSyntaxError('{} takes one argument: the name '
+            'of the template'.format(bits[0]))
+    return HoleNode(parser.compile_filter(bits[1]))
+
+def cached_render(request, key, get_page, timeout=None):
+    """
+    Get a page from the cache (rendering and caching it if it isn't cached)
+    and fill its holes for the request.
+
+    Args:
+        request (HttpRequest): the request
+        key (str): the cache key of the page
+        get_page (callable): returns the (template name, context) of the
+            page. It's only called if the page isn't cached.
+        timeout (int): cache timeout of the page (the default timeout, if
+            None)
+
+    Returns:
+        HttpResponse
+    """
+    # context processors may consume things (e.g. the snackbars), so the
+    # context of the holes is made before the page is rendered
+    context = _get_holes_context(request)
+    page = cache.get(key)
+    if page is None:
+        template_name, page_context = get_page()
+        page = _render_with_holes(request, template_name, page_context)
+        cache.set(key, page, timeout)
+
+    chunks, templates = page
+    engine = Engine.get_default()
+    content = [chunks[0]]
+    for template_name, chunk in zip(templates, chunks[1:]):
+        content.append(engine.get_template(template_name).render(context))
+        content.append(chunk)
+    return HttpResponse(''.join(content))
+
+def _get_holes_context(request):
+    context = Context()
+    for processor in Engine.get_default().template_context_processors:
+        context.update(processor(request))
+    return context
+
+def _render_with_holes(request, template_name, context):
+    """
+    Render a page, leaving its holes out.
+
+    Returns:
+        a (chunks, templates) tuple: the chunks of the page between the
+        holes, and the templates of the holes
+    """
+    marker = '<!-- {} -->'.format(get_random_string(32))
+    templates = []
+    content = render_to_string(template_name, dict(context,
+        **{HOLES_CONTEXT_KEY: (marker, templates)}), request=request)
+    return content.split(marker), templates
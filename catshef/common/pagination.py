@@ -0,0 +1,139 @@
+"""
+Keyset (a.k.a. seek) pagination.
+
+Instead of counting the rows and skipping the previous pages with OFFSET
+(like django.core.paginator.Paginator does), every page is fetched with a
+condition on the sort key of the last row of the previous page, so the
+database can seek directly to it. Fetching a page takes the same time, no
+matter how deep it is, and no COUNT(*) is needed.
+
+Pages are identified by an opaque cursor (the encoded sort key of the last
+row of the previous page), so there are no page numbers.
+"""
+import base64
+import collections
+import datetime
+import json
+import operator
+from decimal import Decimal
+from functools import reduce
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+
+class InvalidCursor(InvalidPage):
+    """
+    The cursor could not be decoded (it was not returned by the paginator).
+    """
+    pass
+
+class KeysetPaginator(object):
+    """
+    Paginates a queryset by its sort key.
+
+    Args:
+        queryset (QuerySet): the queryset to paginate
+        ordering (tuple of str): the sort key, as passed to
+            QuerySet.order_by(). The fields may be annotations, but must not
+            be NULL and the last one must be unique (like 'pk'), so that the
+            order is total. They must not be deferred (see QuerySet.only()),
+            or building the cursor will query them.
+        per_page (int): number of objects per page
+    """
+
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset.order_by(*ordering)
+        self.ordering = ordering
+        self.per_page = per_page
+        # (field name, descending) pairs
+        self._keys = [(name.lstrip('-'), name.startswith('-'))
+                                                        for name in ordering]
+
+    def page(self, cursor=None):
+        """
+        Get the page that starts after the given cursor (the first page if
+        no cursor is given).
+
+        Raises:
+            InvalidCursor, if the cursor is invalid
+        """
+        queryset = self.queryset
+        if cursor:
+            queryset = queryset.filter(self._get_filter(
+                                                    self._decode(cursor)))
+        # fetch one more object, to know whether there's a next page
+        objects = list(queryset[:self.per_page + 1])
+        next_cursor = None
+        if len(objects) > self.per_page:
+            objects = objects[:self.per_page]
+            next_cursor = self._encode([getattr(objects[-1], name)
+                                                for name, desc in self._keys])
+        return KeysetPage(objects, cursor, next_cursor)
+
+    def _get_filter(self, values):
+        """
+        Rows after the given sort key: for a (-a, b) key that's
+            a < value_a OR (a = value_a AND b > value_b)
+        """
+        conditions = []
+        for i, (name, desc) in enumerate(self._keys):
+            condition = Q(**{'{}__{}'.format(name, 'lt' if desc else 'gt'):
+                                                                    values[i]})
+            for (previous_name, _), value in zip(self._keys[:i], values):
+                condition &= Q(**{previous_name: value})
+            conditions.append(condition)
+        return reduce(operator.or_, conditions)
+
+    def _encode(self, values):
+        values = [value.isoformat() if isinstance(value, datetime.datetime)
+            else str(value) if isinstance(value, Decimal) else value
+            for value in values]
+        payload = json.dumps(values, separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+    def _decode(self, cursor):
+        try:
+            # restore the padding
+            cursor += '=' * (-len(cursor) % 4)
+            payload = base64.urlsafe_b64decode(cursor)
+            values = json.loads(payload.decode())
+            if (not isinstance(values, list) or
+                                            len(values) != len(self._keys)):
+                raise ValueError('Wrong number of values')
+            return [self._get_field(name).to_python(value)
+                            for (name, desc), value in zip(self._keys, values)]
+        except (ValueError, TypeError, ValidationError) as ex:
+            raise InvalidCursor('Invalid cursor: {}'.format(ex))
+
+    def _get_field(self, name):
+        annotation = self.queryset.query.annotations.get(name)
+        if annotation is not None:
+            return annotation.output_field
+        opts = self.queryset.model._meta
+        return opts.pk if name == 'pk' else opts.get_field(name)
+
+class KeysetPage(collections.Sequence):
+    """
+    A page of objects returned by KeysetPaginator.
+
+    Attributes:
+        object_list (list): the objects in the page
+        cursor (str): the cursor of the page (None for the first page)
+        next_cursor (str): the cursor of the next page (None if this is the
+            last page)
+    """
+
+    def __init__(self, object_list, cursor, next_cursor):
+        self.object_list = object_list
+        self.cursor = cursor
+        self.next_cursor = next_cursor
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __len__(self):
+        return len(self.object_list)
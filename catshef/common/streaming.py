@@ -0,0 +1,36 @@
+from django.http import StreamingHttpResponse
+from django.template.loader import render_to_string
+from django.utils.crypto import get_random_string
+from django.utils.safestring import mark_safe
+
+def stream_template(request, template_name, context, slot, chunks):
+    """
+    Render a template as a StreamingHttpResponse, where the (potentially
+    slow) content of `slot` is streamed in chunks.
+
+    The template itself is rendered right away, with a placeholder in the
+    context variable `slot`, so everything that depends on the request (the
+    session, the CSRF token, etc.) is handled before the response is
+    returned. Then everything before the placeholder is sent, followed by
+    the chunks and by everything after the placeholder.
+
+    Args:
+        request (HttpRequest): the request
+        template_name (str): the template to render
+        context (dict): the template context (without `slot`)
+        slot (str): name of the context variable where the chunks go
+        chunks (callable): returns an iterable of strings (already rendered
+            HTML). It's only called once the beginning of the template has
+            been sent.
+    """
+    placeholder = '<!-- {} -->'.format(get_random_string(32))
+    context = dict(context, **{slot: mark_safe(placeholder)})
+    head, tail = render_to_string(template_name, context,
+        request=request).split(placeholder, 1)
+
+    def stream():
+        yield head
+        for chunk in chunks():
+            yield chunk
+        yield tail
+    return StreamingHttpResponse(stream())
@@ -5,4 +5,5 @@ class ProductsConfig(AppConfig):
     name = 'products'
 
     def ready(self):
+        import products.checks
         import products.signals
@@ -0,0 +1,26 @@
+"""
+System checks of the products app.
+"""
+from django.conf import settings
+from django.core.checks import Warning, register
+
+# cache backends that aren't shared by the processes serving the site
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Warn if the default cache isn't shared by the processes: the global
+    versions (see products.utils.pricing) must be seen by all of them.
+    """
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend in LOCAL_CACHE_BACKENDS:
+        return [Warning('The default cache ({}) isn\'t shared by the '
+            'processes serving the site, so they won\'t see each other\'s '
+            'price changes.'.format(backend), hint='Use a shared cache '
+            '(e.g. memcached, or the file based cache on a single host), '
+            'see the CACHES setting.', obj='CACHES', id='products.W001')]
+    return []
@@ -0,0 +1,28 @@
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from products.utils import option_import
+
+class Command(BaseCommand):
+    help = ('Import product options, option groups and their memberships '
+        'from a JSON file (see products.utils.option_import).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='the JSON file to import')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path'], encoding='utf-8') as f:
+                batch = json.load(f)
+        except (OSError, ValueError) as err:
+            raise CommandError('Can\'t read "{}": {}'.format(options['path'],
+                err))
+        try:
+            result = option_import.import_options(batch)
+        except ValidationError as err:
+            raise CommandError('Nothing was imported:\n' + '\n'.join(
+                err.messages))
+        self.stdout.write('Imported {} options, {} groups and {} '
+            'memberships.'.format(*result))
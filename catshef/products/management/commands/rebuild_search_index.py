@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from products.search import get_search_backend
+
+class Command(BaseCommand):
+    help = 'Rebuild the product search index (see products.search).'
+
+    def handle(self, *args, **options):
+        count = get_search_backend().rebuild()
+        self.stdout.write('Indexed {} products.'.format(count))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from products.utils import minhash
+
+class Command(BaseCommand):
+    help = ('Recompute the MinHash signatures of every product (see '
+        'products.utils.minhash).')
+
+    def handle(self, *args, **options):
+        count = minhash.rebuild()
+        self.stdout.write('Recomputed the signatures of {} '
+            'products.'.format(count))
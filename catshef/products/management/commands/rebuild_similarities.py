@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from products.utils import similarity
+
+class Command(BaseCommand):
+    help = ('Recompute the similar products of every product (see '
+        'products.utils.similarity).')
+
+    def handle(self, *args, **options):
+        count = similarity.rebuild()
+        self.stdout.write('Recomputed the similar products of {} '
+            'products.'.format(count))
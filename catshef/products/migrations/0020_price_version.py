@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.8 on 2026-10-18 12:49
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0019_productoptiongroup_products'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='price_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='productoption',
+            name='price_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
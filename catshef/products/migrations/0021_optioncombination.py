@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.8 on 2026-10-18 12:53
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0020_price_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OptionCombination',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, unique=True)),
+                ('total_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('price_version', models.PositiveIntegerField(default=0)),
+                ('options', models.ManyToManyField(related_name='combinations', to='products.ProductOption')),
+            ],
+        ),
+    ]
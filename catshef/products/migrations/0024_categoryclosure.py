@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.8 on 2026-10-18 13:17
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_closure(apps, schema_editor):
+    """
+    Link every category to itself and to all of its ancestors.
+    """
+    Category = apps.get_model('products', 'Category')
+    CategoryClosure = apps.get_model('products', 'CategoryClosure')
+
+    parents = dict(Category.objects.values_list('pk', 'parent_id'))
+    links = []
+    for pk in parents:
+        ancestor_id, depth = pk, 0
+        seen = set()
+        # (stop on cycles, which weren't prevented before)
+        while ancestor_id is not None and ancestor_id not in seen:
+            seen.add(ancestor_id)
+            links.append(CategoryClosure(ancestor_id=ancestor_id,
+                descendant_id=pk, depth=depth))
+            ancestor_id, depth = parents.get(ancestor_id), depth + 1
+    CategoryClosure.objects.bulk_create(links)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0023_productsignature'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryClosure',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveSmallIntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='products.Category')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='products.Category')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='categoryclosure',
+            unique_together=set([('ancestor', 'descendant')]),
+        ),
+        migrations.RunPython(build_closure, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.8 on 2026-10-18 13:19
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_search_table(apps, schema_editor):
+    """
+    Create the FTS5 table used by products.search.SQLiteSearchBackend (on
+    SQLite only). The rowid is the product pk.
+    """
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('CREATE VIRTUAL TABLE products_search USING '
+            'fts5(name, description, categories, ingridients, '
+            'tokenize="unicode61 remove_diacritics 2")')
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE products_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0024_categoryclosure'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(db_index=True, max_length=64)),
+                ('weight', models.PositiveIntegerField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='products.Product')),
+            ],
+        ),
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# the effective price of a product, as computed by
+# ProductQuerySet.with_prices() (which casts it to NUMERIC on SQLite). An
+# expression index is only used if it matches the expression of the query.
+EFFECTIVE_PRICE = ('CASE WHEN ("offer_price" IS NOT NULL AND "offer_price" < '
+    '("price")) THEN "offer_price" ELSE "price" END')
+EXPRESSIONS = {
+    'sqlite': 'CAST({} AS NUMERIC)'.format(EFFECTIVE_PRICE),
+    'postgresql': EFFECTIVE_PRICE,
+}
+
+def create_index(apps, schema_editor):
+    """
+    Index the effective price of the products, for sorting, filtering and
+    range queries on it (on the databases supporting expression indexes).
+    """
+    expression = EXPRESSIONS.get(schema_editor.connection.vendor)
+    if expression is not None:
+        schema_editor.execute('CREATE INDEX products_product_effective_price '
+            'ON products_product (({}))'.format(expression))
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor in EXPRESSIONS:
+        schema_editor.execute('DROP INDEX products_product_effective_price')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0025_productsearch'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from collections import Counter, defaultdict
+
+from django.db import migrations
+
+# ProductSimilarity.TOP_N when the migration was written
+TOP_N = 48
+
+def fill_similarities(apps, schema_editor):
+    """
+    Store the TOP_N most similar available products of every product, like
+    products.utils.similarity.rebuild() (which can't be used here, as it
+    uses the current models).
+    """
+    Product = apps.get_model('products', 'Product')
+    ProductSimilarity = apps.get_model('products', 'ProductSimilarity')
+    Through = Product.categories.through
+
+    available = set(Product.objects.filter(available=True).values_list('pk',
+        flat=True))
+    members = defaultdict(list)
+    categories = defaultdict(list)
+    for pk, category_id in Through.objects.values_list('product_id',
+            'category_id'):
+        members[category_id].append(pk)
+        categories[pk].append(category_id)
+
+    similarities = []
+    for pk, category_ids in categories.items():
+        scores = Counter()
+        for category_id in category_ids:
+            scores.update(members[category_id])
+        scores.pop(pk, None)
+        ranked = sorted(((score, other_pk) for other_pk, score
+            in scores.items() if other_pk in available), reverse=True)
+        similarities.extend(ProductSimilarity(product_id=pk,
+            similar_id=other_pk, score=score)
+            for score, other_pk in ranked[:TOP_N])
+    ProductSimilarity.objects.bulk_create(similarities, batch_size=500)
+
+def clear_similarities(apps, schema_editor):
+    apps.get_model('products', 'ProductSimilarity').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0026_product_effective_price_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_similarities, clear_similarities),
+    ]
@@ -1,39 +1,317 @@
 import decimal
 
-from products.utils.conversion import round_decimal
+from products.utils.conversion import round_decimal, to_decimal
 
-from django.db import models
-from django.db.models import Count
+from django.db import models, transaction
+from django.db.models import Case, Count, F, Q, Value, When
 import django.core.exceptions as exceptions
 
 from django.core.urlresolvers import reverse
 
+from products.utils import default_options
 from products.utils.nutrition import CAL2000    
+from products.utils.pricing import bump_price_version
 
-class AvailableManager(models.Manager):
+class NumericCase(Case):
+    """
+    A Case expression with a numeric result.
+
+    SQLite gives CASE expressions no type affinity, so comparing one with a
+    Decimal (which Django passes to SQLite as text) would compare a number
+    with a string: the expression is cast to NUMERIC on SQLite.
+    """
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        sql, params = self.as_sql(compiler, connection, **extra_context)
+        return 'CAST({} AS NUMERIC)'.format(sql), params
+
+class ProductQuerySet(models.QuerySet):
+
+    # fields used when listing products (see the list_ajax.html template),
+    # plus 'updated', used to sort (and paginate) the listings
+    LISTING_FIELDS = ('name', 'slug', 'description', 'price', 'offer_price',
+        'updated', 'main_image__image', 'nutrition__protein', 
+        'nutrition__carbs', 'nutrition__fat', 'nutrition__calories')
+
+    def with_prices(self):
+        """
+        Annotate the products with their prices, computed by the database, so
+        they can be used for sorting, filtering and range queries (and use
+        the index on the effective price, see migration 0026):
+
+            * effective_price: the price the product is sold at (see
+              Product.current_price)
+            * on_offer: whether the product has an offer (see
+              Product.has_offer)
+            * discount: the discount of the offer, as a percentage, or 0 (see
+              Product.discount_percentage)
+        """
+        has_offer = (Q(offer_price__isnull=False) &
+            Q(offer_price__lt=F('price')))
+        return self.annotate(
+            effective_price=NumericCase(
+                When(has_offer, then=F('offer_price')),
+                default=F('price'),
+                output_field=models.DecimalField(max_digits=10,
+                                                    decimal_places=2)),
+            on_offer=Case(
+                When(has_offer, then=Value(True)),
+                default=Value(False),
+                output_field=models.BooleanField()),
+            # a float, so it's exactly the same in the cursors of the
+            # paginated listings sorted by it
+            discount=Case(
+                When(has_offer, then=Value(100.0) - F('offer_price') *
+                    Value(100.0) / F('price')),
+                default=Value(0.0),
+                output_field=models.FloatField()))
+
+    def for_listing(self):
+        """
+        Get the products ready to be listed: their main image and nutrition
+        are fetched in the same query, only the fields used by the listing
+        templates are loaded and their prices are computed by the database
+        (see with_prices()), so they can be used for sorting and filtering.
+        """
+        return self.select_related('main_image', 'nutrition').only(
+            *ProductQuerySet.LISTING_FIELDS).with_prices()
+
+    def for_detail(self):
+        """
+        Get the products ready to be shown on their detail page (see the
+        detail.html template): their main image and nutrition are fetched
+        in the same query, and their images, categories and ingridients are
+        prefetched, so it takes 4 queries in total.
+        """
+        return self.select_related('main_image', 'nutrition').prefetch_related(
+            'images', 'categories', 'ingridients')
+
+    def in_category(self, category):
+        """
+        Get the products in the category or in any of its descendants.
+        """
+        Through = Product.categories.through
+        return self.filter(pk__in=Through.objects.filter(
+            category__ancestor_links__ancestor=category).values('product_id'))
+
+class AvailableManager(models.Manager.from_queryset(ProductQuerySet)):
     """
     Used to query only for available products.
     """
     def get_queryset(self):
         return super(AvailableManager, self).get_queryset().filter(available=True)
 
+class PriceVersionedModel(models.Model):
+    """
+    Abstract model that increments its 'price_version' every time one of
+    the fields in PRICE_FIELDS changes (and the global price version, see
+    products.utils.pricing). This allows to find out if prices computed
+    earlier (like the ones stored in the cart) are outdated.
+    """
+    PRICE_FIELDS = ('price',)
+
+    price_version = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(PriceVersionedModel, cls).from_db(db, field_names,
+                                                                        values)
+        if all(name in field_names for name in cls.PRICE_FIELDS):
+            # keep the loaded prices, so that changes can be detected
+            instance._loaded_prices = instance._get_prices()
+        return instance
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if self._state.adding:
+            prices_changed = False
+        elif (update_fields is not None and 
+                        not set(self.PRICE_FIELDS).intersection(update_fields)):
+            prices_changed = False
+        else:
+            # if the loaded prices are unknown, assume they changed
+            prices_changed = (getattr(self, '_loaded_prices', None) != 
+                                                        self._get_prices())
+
+        if prices_changed:
+            self.price_version += 1
+            if update_fields is not None:
+                kwargs['update_fields'] = list(update_fields) + [
+                                                            'price_version']
+
+        super(PriceVersionedModel, self).save(*args, **kwargs)
+        if update_fields is None:
+            self._loaded_prices = self._get_prices()
+        elif getattr(self, '_loaded_prices', None) is not None:
+            # the prices left out of update_fields weren't saved, so they're
+            # still compared with the loaded ones on the next save
+            self._loaded_prices = tuple(
+                getattr(self, name) if name in update_fields else loaded
+                for name, loaded in zip(self.PRICE_FIELDS,
+                                                        self._loaded_prices))
+        if prices_changed:
+            self._prices_changed()
+            bump_price_version()
+
+    def _get_prices(self):
+        return tuple(getattr(self, name) for name in self.PRICE_FIELDS)
+
+    def _prices_changed(self):
+        """
+        Called after the model was saved with changed prices (and before the
+        global price version is incremented). Override to update anything
+        derived from the prices.
+        """
+        pass
+
 class Category(models.Model):
+    """
+    A product category. Categories form a tree (see 'parent'), whose paths
+    are stored in CategoryClosure, so the ancestors or the descendants of a
+    category (at any depth) can be queried with a single join.
+    """
     name = models.CharField(max_length=250)
     slug = models.SlugField()
     description = models.TextField()
     parent = models.ForeignKey('Category', null=True, 
         related_name='child_categories', on_delete=models.SET_NULL)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Category, cls).from_db(db, field_names, values)
+        if 'parent_id' in field_names:
+            # keep the loaded parent, so that moves can be detected
+            instance._loaded_parent_id = instance.parent_id
+        return instance
+
+    @classmethod
+    def get_tree(cls):
+        """
+        Get the root categories, sorted by name, with their children (also
+        sorted by name) in 'tree_children', recursively. A single query is
+        made.
+        """
+        categories = list(cls.objects.order_by('name'))
+        for category in categories:
+            category.tree_children = []
+        by_pk = {category.pk: category for category in categories}
+        roots = []
+        for category in categories:
+            parent = by_pk.get(category.parent_id)
+            (parent.tree_children if parent else roots).append(category)
+        return roots
+
     def get_absolute_url(self):
         return reverse('products:category', kwargs={'slug':self.slug})
 
+    def get_ancestors(self, include_self=False):
+        """
+        Get the ancestors of the category, from the root down (for
+        breadcrumbs).
+        """
+        ancestors = Category.objects.filter(descendant_links__descendant=self)
+        if not include_self:
+            ancestors = ancestors.exclude(pk=self.pk)
+        return ancestors.order_by('-descendant_links__depth')
+
+    def get_descendants(self, include_self=True):
+        """
+        Get the descendants of the category, at any depth.
+        """
+        descendants = Category.objects.filter(ancestor_links__ancestor=self)
+        if not include_self:
+            descendants = descendants.exclude(pk=self.pk)
+        return descendants
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        # if the loaded parent is unknown, assume it changed
+        moved = not adding and (getattr(self, '_loaded_parent_id', None) !=
+                                                                self.parent_id)
+        if moved and self.parent_id is not None and (
+                CategoryClosure.objects.filter(ancestor_id=self.pk,
+                    descendant_id=self.parent_id).exists()):
+            raise exceptions.ValidationError('A category can\'t be moved '
+                'under itself or one of its descendants.')
+
+        with transaction.atomic():
+            super(Category, self).save(*args, **kwargs)
+            if adding:
+                self._link_subtree([(self.pk, 0)], [CategoryClosure(
+                    ancestor=self, descendant=self, depth=0)])
+            elif moved:
+                subtree = list(CategoryClosure.objects.filter(
+                    ancestor=self).values_list('descendant_id', 'depth'))
+                subtree_ids = [pk for pk, depth in subtree]
+                # unlink the subtree from the old ancestors
+                CategoryClosure.objects.filter(
+                    descendant_id__in=subtree_ids).exclude(
+                        ancestor_id__in=subtree_ids).delete()
+                self._link_subtree(subtree)
+        self._loaded_parent_id = self.parent_id
+
+    def _link_subtree(self, subtree, links=()):
+        """
+        Link the subtree of the category (as (pk, depth) pairs) to the
+        ancestors of the category, and create them along with `links`.
+        """
+        links = list(links)
+        if self.parent_id is not None:
+            ancestors = CategoryClosure.objects.filter(
+                descendant_id=self.parent_id).values_list('ancestor_id',
+                                                                    'depth')
+            links.extend(CategoryClosure(ancestor_id=ancestor_id,
+                descendant_id=pk, depth=ancestor_depth + depth + 1)
+                for ancestor_id, ancestor_depth in ancestors
+                for pk, depth in subtree)
+        CategoryClosure.objects.bulk_create(links)
+
+    def _unlink_children(self):
+        """
+        Unlink the subtrees of the children from the category and from its
+        ancestors, since the children become root categories when the
+        category is deleted (see products.signals).
+        """
+        subtree_ids = list(CategoryClosure.objects.filter(
+            ancestor=self, depth__gt=0).values_list('descendant_id', 
+                                                                flat=True))
+        ancestor_ids = list(CategoryClosure.objects.filter(
+            descendant=self).values_list('ancestor_id', flat=True))
+        CategoryClosure.objects.filter(descendant_id__in=subtree_ids, 
+            ancestor_id__in=ancestor_ids).delete()
+
     def __str__(self):
         return self.name
 
-class Product(models.Model):
+class CategoryClosure(models.Model):
+    """
+    A path in the category tree: 'ancestor' is 'descendant' itself or one
+    of its ancestors. Maintained by Category.save() and on delete.
+
+    Fields:
+        ancestor (ForeignKey): the ancestor
+        descendant (ForeignKey): the descendant
+        depth (PositiveSmallIntegerField): number of levels between them
+            (0 if they're the same category)
+    """
+    ancestor = models.ForeignKey('Category', related_name='descendant_links',
+        on_delete=models.CASCADE)
+    descendant = models.ForeignKey('Category', 
+        related_name='ancestor_links', on_delete=models.CASCADE)
+    depth = models.PositiveSmallIntegerField()
+
+    class Meta:
+        unique_together = ('ancestor', 'descendant')
+
+class Product(PriceVersionedModel):
     """
     Represents a product that's being sold.
     """
+    PRICE_FIELDS = ('price', 'offer_price')
+
     name = models.CharField(max_length=250)
     slug = models.SlugField(unique=True, db_index=True)
     description = models.TextField()
@@ -53,9 +331,18 @@ class Product(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
 
-    objects = models.Manager()  # default manager
+    objects = ProductQuerySet.as_manager()  # default manager
     active = AvailableManager() 
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Product, cls).from_db(db, field_names, values)
+        if 'available' in field_names:
+            # keep the loaded availability, so that changes can be detected
+            # (see products.signals)
+            instance._loaded_available = instance.available
+        return instance
+
     def get_absolute_url(self):
         return reverse('products:product_detail', kwargs={'slug': self.slug})
 
@@ -94,30 +381,47 @@ class Product(models.Model):
 
         Return an empty list if no images are found.
         """
-        return [image.image.url for image in self.get_images()]
+        # filtered here rather than with exclude(), so prefetched images
+        # are used (see ProductQuerySet.for_detail())
+        return [image.image.url for image in self.images.all()
+                                            if image.pk != self.main_image_id]
 
     def get_default_options(self):
-        options = []
-        groups = self.groups.all()
-        for group in groups:
-            # get all memberships with that group that are "default"
-            memberships = Membership.objects.filter(group=group, default=True)
-            for m in memberships:
-                options.append(m.option)
-        return options
+        """
+        Get the default options of the product, in all of its option groups
+        (cached, see products.utils.default_options).
+        """
+        return default_options.get_default_options([self.pk])[self.pk]
 
     def similar_products(self, manager=None, limit=None):
-        if not manager:
-            manager = Product.active
+        """
+        Get the products sharing categories with this one, the ones sharing
+        more first, annotated with the number of shared categories as
+        'same_categories'.
+
+        By default the available products are read from the precomputed
+        similarities (see ProductSimilarity), so at most
+        ProductSimilarity.TOP_N are returned, and ties are broken by pk (the
+        last created first: not by 'updated', which every save would
+        reorder). If a manager is given, they are computed from the
+        categories instead, and ties are broken by 'updated' (the most
+        recently updated first), then by pk.
+        """
+        if manager is None:
+            similar_products = Product.active.filter(
+                similar_to__product=self).annotate(
+                    same_categories=F('similar_to__score')).order_by(
+                        '-same_categories', '-pk')
+        else:
+            category_ids = self.categories.values_list('id', flat=True)
+            similar_products = manager.filter(
+                categories__in=category_ids).exclude(pk=self.pk).annotate(
+                    same_categories=Count('categories')).order_by(
+                        '-same_categories', '-updated', '-pk')
 
-        category_ids = self.categories.values_list('id', flat=True)
-        similar_posts = manager.filter(categories__in=category_ids).exclude(pk=self.pk)
-        similar_posts = similar_posts.annotate(
-            same_categories=Count('categories')).order_by('-same_categories', '-updated')
-        
         if limit:
-            similar_posts = similar_posts[:limit]
-        return similar_posts
+            similar_products = similar_products[:limit]
+        return similar_products
 
     def __str__(self):
         return self.name
@@ -304,7 +608,7 @@ class Membership(models.Model):
         super(Membership, self).save(*args, **kwargs)
 
 
-class ProductOption(models.Model):
+class ProductOption(PriceVersionedModel):
     DECIMAL_PLACES = 2  # decimal_places argument of models.DecimalField
 
     name = models.CharField(max_length=255)
@@ -325,6 +629,144 @@ class ProductOption(models.Model):
     def __str__(self):
         return self.name
 
+    def _prices_changed(self):
+        """
+        Update the total prices of the option combinations which contain this
+        option.
+        """
+        combinations = list(self.combinations.all())
+        option_ids = {pk for combination in combinations 
+                                for pk in combination.get_option_ids()}
+        options_by_pk = ProductOption.objects.in_bulk(option_ids)
+        for combination in combinations:
+            combination.set_price([options_by_pk[pk] 
+                for pk in combination.get_option_ids() if pk in options_by_pk])
+            combination.save(update_fields=['total_price', 'price_version'])
+
+class OptionCombination(models.Model):
+    """
+    A combination of product options (duplicates included), with its
+    precomputed total price. Cart items reference the combination of their
+    options by id, see products.utils.combinations.
+
+    Fields:
+        key (CharField): the sorted option pks, joined by KEY_SEPARATOR
+        options (ManyToManyField): the (distinct) options in the combination,
+            used to find the combinations to update when an option's price
+            changes
+        total_price (DecimalField): sum of the prices of the options
+        price_version (PositiveIntegerField): sum of the price versions of
+            the options when 'total_price' was computed
+    """
+    KEY_SEPARATOR = ':'
+
+    key = models.CharField(max_length=255, unique=True)
+    options = models.ManyToManyField('ProductOption', 
+        related_name='combinations')
+    total_price = models.DecimalField(max_digits=10, decimal_places=2)
+    price_version = models.PositiveIntegerField(default=0)
+
+    @classmethod
+    def get_key(cls, option_ids):
+        """
+        Get the canonical key of the combination of the given option pks.
+        """
+        return cls.KEY_SEPARATOR.join(str(pk) for pk in sorted(option_ids))
+
+    def get_option_ids(self):
+        """
+        Get the sorted option pks of the combination (duplicates included).
+        """
+        return [int(pk) for pk in self.key.split(self.KEY_SEPARATOR)]
+
+    def set_price(self, options):
+        """
+        Compute 'total_price' and 'price_version' from the given options. It
+        does NOT save the combination.
+        """
+        self.total_price = to_decimal(sum(option.price for option in options))
+        self.price_version = sum(option.price_version for option in options)
+
+    def __str__(self):
+        return self.key
+
+class ProductSimilarity(models.Model):
+    """
+    One of the TOP_N available products most similar to a product, see
+    products.utils.similarity.
+
+    Fields:
+        product (ForeignKey): the product
+        similar (ForeignKey): the similar product
+        score (PositiveSmallIntegerField): number of categories they share
+    """
+    TOP_N = 48  # similar products kept per product
+
+    product = models.ForeignKey('Product', related_name='similarities',
+        on_delete=models.CASCADE)
+    similar = models.ForeignKey('Product', related_name='similar_to',
+        on_delete=models.CASCADE)
+    score = models.PositiveSmallIntegerField()
+
+    class Meta:
+        unique_together = ('product', 'similar')
+        # covers Product.similar_products(), which can read the similar
+        # products of a product, in order, from the index alone
+        index_together = (('product', 'score', 'similar'),)
+
+    def __str__(self):
+        return '{} -> {} ({})'.format(self.product_id, self.similar_id,
+            self.score)
+
+class ProductSignature(models.Model):
+    """
+    MinHash signature of the categories and ingridients of a product, see
+    products.utils.minhash.
+
+    Fields:
+        product (OneToOneField): the product
+        signature (BinaryField): the packed signature
+    """
+    product = models.OneToOneField('Product', primary_key=True,
+        related_name='signature', on_delete=models.CASCADE)
+    signature = models.BinaryField()
+
+class ProductSignatureBucket(models.Model):
+    """
+    A locality-sensitive hashing bucket of a product: products with similar
+    signatures share buckets (see products.utils.minhash).
+
+    Fields:
+        product (ForeignKey): the product
+        band (PositiveSmallIntegerField): the band of the signature
+        bucket (BigIntegerField): hash of the band
+    """
+    product = models.ForeignKey('Product', related_name='signature_buckets',
+        on_delete=models.CASCADE)
+    band = models.PositiveSmallIntegerField()
+    bucket = models.BigIntegerField()
+
+    class Meta:
+        index_together = (('band', 'bucket'),)
+
+class ProductSearchTerm(models.Model):
+    """
+    A word in the indexed text of a product, used by
+    products.search.TermSearchBackend.
+
+    Fields:
+        product (ForeignKey): the product
+        term (CharField): the word (truncated to MAX_LENGTH)
+        weight (PositiveIntegerField): sum of the weights of the fields
+            where the word appears, once per appearance
+    """
+    MAX_LENGTH = 64
+
+    product = models.ForeignKey('Product', related_name='search_terms',
+        on_delete=models.CASCADE)
+    term = models.CharField(max_length=MAX_LENGTH, db_index=True)
+    weight = models.PositiveIntegerField()
+
 class ProductOptionGroup(models.Model):
     RADIO = 1
     CHECKBOX = 2
@@ -0,0 +1,232 @@
+"""
+Product search backends.
+
+Available products are indexed by their name, description, category names
+and ingridient names (see get_documents()), and searched by words: a
+product matches if every word of the query is one of its words, except for
+the last one, which only has to be the beginning of one (so results show up
+while typing). Results are ranked by relevance,
+matches in the name weighing most.
+
+There are two backends:
+
+    * SQLiteSearchBackend: an SQLite FTS5 virtual table (created by the
+      migrations, on SQLite only), ranked with bm25()
+    * TermSearchBackend: an inverted index stored in ProductSearchTerm, which
+      works with any database
+
+The backend is chosen with the PRODUCT_SEARCH_BACKEND setting (dotted path to
+the backend class), which defaults to SQLiteSearchBackend on SQLite and to
+TermSearchBackend otherwise. The index is kept up to date by the signal
+handlers in products.signals, and can be rebuilt with the
+rebuild_search_index management command.
+"""
+import operator
+import re
+from collections import defaultdict
+from functools import reduce
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, IntegerField, Max, Q, Sum, When
+from django.utils.module_loading import import_string
+
+from products.models import Product, ProductSearchTerm
+from products.utils import chunks
+
+# the indexed fields (as returned by get_documents()) and their weights
+FIELDS = ('name', 'description', 'categories', 'ingridients')
+WEIGHTS = (10, 1, 4, 2)
+
+# max number of words of a query
+MAX_QUERY_WORDS = 8
+
+_WORD_RE = re.compile(r'\w+')
+
+def get_search_backend():
+    """
+    Get an instance of the search backend (set in the PRODUCT_SEARCH_BACKEND
+    setting).
+    """
+    backend_path = getattr(settings, 'PRODUCT_SEARCH_BACKEND', None)
+    if backend_path is None:
+        backend_path = ('products.search.SQLiteSearchBackend'
+            if connection.vendor == 'sqlite'
+            else 'products.search.TermSearchBackend')
+    return import_string(backend_path)()
+
+def get_words(text):
+    """
+    Split a text in (lowercase) words.
+    """
+    return _WORD_RE.findall(text.lower())
+
+def get_documents(product_ids):
+    """
+    Get the text to index for the given products (the unavailable ones are
+    left out).
+
+    Returns:
+        dict mapping the product pks to dicts mapping FIELDS to text
+    """
+    documents = {pk: {'name': name, 'description': description,
+                      'categories': [], 'ingridients': []}
+        for pk, name, description in Product.active.filter(
+            pk__in=product_ids).values_list('pk', 'name', 'description')}
+    Through = Product.categories.through
+    for pk, name in Through.objects.filter(
+            product_id__in=documents).values_list('product_id',
+                                                            'category__name'):
+        documents[pk]['categories'].append(name)
+    Through = Product.ingridients.through
+    for pk, name in Through.objects.filter(
+            product_id__in=documents).values_list('product_id',
+                                                        'ingridient__name'):
+        documents[pk]['ingridients'].append(name)
+
+    for document in documents.values():
+        document['categories'] = ' '.join(document['categories'])
+        document['ingridients'] = ' '.join(document['ingridients'])
+    return documents
+
+class BaseSearchBackend(object):
+    """
+    Base class for search backends. Subclasses must implement search(),
+    clear() and _index().
+    """
+
+    def search(self, query, offset=0, limit=20):
+        """
+        Search for products.
+
+        Args:
+            query (str): the words to search for
+            offset (int): number of results to skip
+            limit (int): max number of results
+
+        Returns:
+            list of the pks of the matching products, the most relevant first
+        """
+        raise NotImplementedError
+
+    def update(self, product_ids):
+        """
+        (Re)index the given products, or remove them from the index if they
+        were deleted or aren't available.
+        """
+        with transaction.atomic():
+            for chunk in chunks(list(product_ids)):
+                self._remove(chunk)
+                self._index(get_documents(chunk))
+
+    def rebuild(self):
+        """
+        Rebuild the whole index.
+
+        Returns:
+            the number of indexed products
+        """
+        with transaction.atomic():
+            self.clear()
+            product_ids = list(Product.active.values_list('pk', flat=True))
+            for chunk in chunks(product_ids):
+                self._index(get_documents(chunk))
+        return len(product_ids)
+
+    def clear(self):
+        """
+        Remove every product from the index.
+        """
+        raise NotImplementedError
+
+    def _remove(self, product_ids):
+        raise NotImplementedError
+
+    def _index(self, documents):
+        """
+        Add products (as returned by get_documents()) to the index.
+        """
+        raise NotImplementedError
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    """
+    Searches the products with SQLite's full-text search (FTS5).
+    """
+    TABLE = 'products_search'
+
+    def search(self, query, offset=0, limit=20):
+        words = get_words(query)[:MAX_QUERY_WORDS]
+        if not words:
+            return []
+        # quoted, so the words are never taken as FTS5 syntax
+        match = ' AND '.join(['"{}"'.format(word) for word in words[:-1]] +
+            ['"{}"*'.format(words[-1])])
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT rowid FROM {0} WHERE {0} MATCH %s '
+                'ORDER BY bm25({0}, {1}) LIMIT %s OFFSET %s'.format(
+                    self.TABLE, ', '.join(str(weight) for weight in WEIGHTS)),
+                [match, limit, offset])
+            return [row[0] for row in cursor.fetchall()]
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {}'.format(self.TABLE))
+
+    def _remove(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {} WHERE rowid IN ({})'.format(
+                self.TABLE, ', '.join(['%s'] * len(product_ids))),
+                product_ids)
+
+    def _index(self, documents):
+        with connection.cursor() as cursor:
+            cursor.executemany('INSERT INTO {} (rowid, {}) VALUES '
+                '(%s, {})'.format(self.TABLE, ', '.join(FIELDS),
+                    ', '.join(['%s'] * len(FIELDS))),
+                [[pk] + [document[field] for field in FIELDS]
+                    for pk, document in documents.items()])
+
+class TermSearchBackend(BaseSearchBackend):
+    """
+    Searches the products in an inverted index (ProductSearchTerm), with
+    the words (and the prefix) matched by the index on 'term'.
+    """
+    # sorts after any character that can be in a word
+    MAX_CHAR = '\U0010ffff'
+
+    def search(self, query, offset=0, limit=20):
+        words = get_words(query)[:MAX_QUERY_WORDS]
+        if not words:
+            return []
+        # the prefix is matched with a range, which (unlike LIKE) can always
+        # use the index
+        lookups = [Q(term=word) for word in words[:-1]] + [
+            Q(term__gte=words[-1], term__lt=words[-1] + self.MAX_CHAR)]
+        terms = ProductSearchTerm.objects.filter(reduce(operator.or_,
+                                                                    lookups))
+        # whether each word matched (at least one term of) the product
+        matched = {'word{}'.format(i): Max(Case(When(lookup, then=1),
+            default=0, output_field=IntegerField()))
+            for i, lookup in enumerate(lookups)}
+        return list(terms.values('product_id').annotate(
+            score=Sum('weight'), **matched).filter(
+                **{name: 1 for name in matched}).order_by(
+                    '-score', 'product_id').values_list('product_id',
+                        flat=True)[offset:offset + limit])
+
+    def clear(self):
+        ProductSearchTerm.objects.all().delete()
+
+    def _remove(self, product_ids):
+        ProductSearchTerm.objects.filter(product_id__in=product_ids).delete()
+
+    def _index(self, documents):
+        terms = []
+        for pk, document in documents.items():
+            weights = defaultdict(int)
+            for field, weight in zip(FIELDS, WEIGHTS):
+                for word in get_words(document[field]):
+                    weights[word[:ProductSearchTerm.MAX_LENGTH]] += weight
+            terms.extend(ProductSearchTerm(product_id=pk, term=term,
+                weight=weight) for term, weight in weights.items())
+        ProductSearchTerm.objects.bulk_create(terms)
@@ -1,8 +1,14 @@
-from django.db.models.signals import pre_save
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+    pre_delete, pre_save)
 from django.dispatch import receiver
 import django.core.exceptions as exceptions
 
-from products.models import ProductNutrition
+from products.models import (Category, Ingridient, Membership, Product,
+    ProductImage, ProductNutrition, ProductOption, ProductOptionGroup,
+    ProductSimilarity)
+from products.search import get_search_backend
+from products.utils import (default_options, facets, minhash, page_cache,
+    similarity)
 
 @receiver(pre_save, sender=ProductNutrition)
 def validate_prod_nutr_fields(sender, instance, *args, **kwargs):
@@ -25,4 +31,177 @@ def validate_prod_nutr_fields(sender, instance, *args, **kwargs):
         if instance.calories < 0:
             raise exceptions.ValidationError('"{}" is an invalid ammount '
             'for field \'calories\', ''since it cannot be '
-            'negative.'.format(instance.calories))
\ No newline at end of file
+            'negative.'.format(instance.calories))
+
+def _get_changed_product_ids(instance, action, reverse, pk_set):
+    """
+    Get the pks of the products whose categories/ingridients changed, from
+    the arguments of an m2m_changed signal (None if nothing changed yet).
+    """
+    if reverse and action == 'pre_clear':
+        # the products won't be known anymore after the clear
+        instance._cleared_product_ids = set(
+            instance.products.values_list('pk', flat=True))
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return None
+
+    if not reverse:
+        return {instance.pk}
+    elif action == 'post_clear':
+        return instance._cleared_product_ids
+    return pk_set
+
+@receiver(m2m_changed, sender=Product.categories.through)
+def update_similarities_on_categories_change(sender, instance, action, 
+    reverse, pk_set, **kwargs):
+    """
+    Update the similar products (see products.utils.similarity), the
+    signatures (see products.utils.minhash), the search index (see
+    products.search), the facet indexes (see products.utils.facets) and the
+    detail pages (see products.utils.page_cache) of the products whose
+    categories changed.
+    """
+    product_ids = _get_changed_product_ids(instance, action, reverse, pk_set)
+    if product_ids:
+        similarity.update(product_ids)
+        minhash.update(product_ids)
+        get_search_backend().update(product_ids)
+        facets.update(product_ids)
+        page_cache.touch(product_ids)
+
+@receiver(m2m_changed, sender=Product.ingridients.through)
+def update_signatures_on_ingridients_change(sender, instance, action, 
+    reverse, pk_set, **kwargs):
+    product_ids = _get_changed_product_ids(instance, action, reverse, pk_set)
+    if product_ids:
+        minhash.update(product_ids)
+        get_search_backend().update(product_ids)
+        facets.update(product_ids)
+        page_cache.touch(product_ids)
+
+@receiver(post_save, sender=Product)
+def update_similarities_on_availability_change(sender, instance, created,
+    **kwargs):
+    # a new product has no categories yet
+    if not created and (getattr(instance, '_loaded_available', None) != 
+                                                        instance.available):
+        similarity.update([instance.pk])
+    instance._loaded_available = instance.available
+
+@receiver(post_save, sender=Product)
+def update_search_index_on_product_save(sender, instance, **kwargs):
+    get_search_backend().update([instance.pk])
+
+@receiver(post_save, sender=Product)
+def update_facets_on_product_save(sender, instance, **kwargs):
+    # the price, the offer, the nutrition or the availability may have changed
+    facets.update([instance.pk])
+
+@receiver(post_save, sender=Product)
+def invalidate_detail_page_on_product_save(sender, instance, **kwargs):
+    # its 'updated' time changed
+    page_cache.invalidate([instance.pk])
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def touch_products_on_image_change(sender, instance, **kwargs):
+    page_cache.touch([instance.product_id])
+
+@receiver(post_save, sender=ProductNutrition)
+def update_facets_on_nutrition_save(sender, instance, created, **kwargs):
+    # a new nutrition has no products yet
+    if not created:
+        product_ids = list(instance.product_set.values_list('pk', flat=True))
+        facets.update(product_ids)
+        page_cache.touch(product_ids)
+
+@receiver(pre_delete, sender=ProductNutrition)
+def find_deleted_nutrition_products(sender, instance, **kwargs):
+    # their nutrition is set to NULL without saving them
+    instance._product_ids = list(instance.product_set.values_list('pk',
+                                                                flat=True))
+
+@receiver(post_delete, sender=ProductNutrition)
+def update_facets_on_nutrition_delete(sender, instance, **kwargs):
+    facets.update(instance._product_ids)
+    page_cache.touch(instance._product_ids)
+
+@receiver(post_save, sender=Category)
+def update_facets_on_category_move(sender, instance, created, **kwargs):
+    # the products of the subtree move to other ancestors
+    if not created and (getattr(instance, '_loaded_parent_id', None) != 
+                                                        instance.parent_id):
+        facets.update(Product.objects.in_category(instance).values_list(
+            'pk', flat=True))
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Ingridient)
+def update_search_index_on_feature_save(sender, instance, created, 
+    **kwargs):
+    # the name may have changed
+    if not created:
+        product_ids = list(instance.products.values_list('pk', flat=True))
+        get_search_backend().update(product_ids)
+        page_cache.touch(product_ids)
+
+@receiver(pre_delete, sender=Product)
+def find_similar_to_deleted_product(sender, instance, **kwargs):
+    instance._similar_to_ids = list(ProductSimilarity.objects.filter(
+        similar=instance).values_list('product_id', flat=True))
+
+@receiver(post_delete, sender=Product)
+def update_similarities_on_product_delete(sender, instance, **kwargs):
+    # the deleted product's place is taken by the next most similar product
+    similarity.rebuild(instance._similar_to_ids)
+    get_search_backend().update([instance.pk])
+    facets.update([instance.pk])
+    page_cache.invalidate([instance.pk])
+
+@receiver(pre_delete, sender=Category)
+def unlink_deleted_category_children(sender, instance, **kwargs):
+    # the products of the subtree won't be in the category and its
+    # ancestors anymore
+    instance._subtree_product_ids = list(Product.objects.in_category(
+        instance).values_list('pk', flat=True))
+    # the children become root categories
+    instance._unlink_children()
+
+@receiver(pre_delete, sender=Category)
+@receiver(pre_delete, sender=Ingridient)
+def find_deleted_feature_products(sender, instance, **kwargs):
+    instance._product_ids = list(instance.products.values_list('pk', 
+                                                                flat=True))
+
+@receiver(post_delete, sender=Category)
+def update_similarities_on_category_delete(sender, instance, **kwargs):
+    similarity.update(instance._product_ids)
+    minhash.update(instance._product_ids)
+    get_search_backend().update(instance._product_ids)
+    facets.update(instance._subtree_product_ids)
+    page_cache.touch(instance._product_ids)
+
+@receiver(post_delete, sender=Ingridient)
+def update_signatures_on_ingridient_delete(sender, instance, **kwargs):
+    minhash.update(instance._product_ids)
+    get_search_backend().update(instance._product_ids)
+    facets.update(instance._product_ids)
+    page_cache.touch(instance._product_ids)
+
+@receiver(post_save, sender=Membership)
+@receiver(post_delete, sender=Membership)
+@receiver(post_save, sender=ProductOption)
+@receiver(post_delete, sender=ProductOption)
+@receiver(post_delete, sender=ProductOptionGroup)
+def invalidate_default_options(sender, **kwargs):
+    """
+    Forget the cached default options of the products (see
+    products.utils.default_options) when a membership or an option changes,
+    or a group is deleted (with its products).
+    """
+    default_options.invalidate()
+
+@receiver(m2m_changed, sender=ProductOptionGroup.products.through)
+def invalidate_default_options_on_group_products_change(sender, action,
+    **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        default_options.invalidate()
@@ -0,0 +1,17 @@
+from django.test import SimpleTestCase, override_settings
+
+from products.checks import check_shared_cache
+
+class SharedCacheCheckTestCase(SimpleTestCase):
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_local_cache(self):
+        self.assertEqual([error.id for error in check_shared_cache(None)],
+            ['products.W001'])
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': '/tmp/catshef-test-cache'}})
+    def test_shared_cache(self):
+        self.assertEqual(check_shared_cache(None), [])
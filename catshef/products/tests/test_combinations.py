@@ -0,0 +1,113 @@
+from decimal import Decimal
+
+from products.models import OptionCombination, ProductOption
+from products.utils import combinations
+
+from django.test import TestCase, TransactionTestCase
+
+class CombinationsTestCase(TestCase):
+
+    def setUp(self):
+        self.po1 = ProductOption.objects.create(name='option_1', price=12)
+        self.po2 = ProductOption.objects.create(name='option_2', price=3.14)
+        self.po3 = ProductOption.objects.create(name='option_3', price=0.5)
+
+    def test_no_options(self):
+        self.assertEqual(combinations.get_combination([]),
+            combinations.NO_OPTIONS)
+        self.assertEqual(combinations.get_combination(None),
+            combinations.NO_OPTIONS)
+        self.assertEqual(combinations.get_combination_id([]), 0)
+        self.assertFalse(OptionCombination.objects.exists())
+
+    def test_get_combination(self):
+        combination = combinations.get_combination((self.po2, self.po1,
+                                                                    self.po1))
+        self.assertEqual(combination.option_ids, tuple(sorted((self.po1.pk,
+            self.po1.pk, self.po2.pk))))
+        self.assertEqual(combination.total_price, Decimal('27.14'))
+
+        # the order of the options doesn't matter, but duplicates do
+        self.assertEqual(combinations.get_combination((self.po1, self.po2,
+            self.po1)).id, combination.id)
+        self.assertNotEqual(combinations.get_combination((self.po1,
+            self.po2)).id, combination.id)
+        self.assertEqual(combinations.get_combination_id([self.po1.pk,
+            self.po2.pk, self.po1.pk]), combination.id)
+
+        instance = OptionCombination.objects.get(pk=combination.id)
+        self.assertCountEqual(instance.options.all(), [self.po1, self.po2])
+
+    def test_get_combination_id_without_create(self):
+        self.assertIsNone(combinations.get_combination_id([self.po1.pk],
+            create=False))
+        self.assertFalse(OptionCombination.objects.exists())
+
+    def test_get_combinations(self):
+        c1 = combinations.get_combination((self.po1,))
+        c2 = combinations.get_combination((self.po2, self.po3))
+        with self.assertNumQueries(1):
+            self.assertEqual(combinations.get_combinations([0, c1.id, c2.id,
+                c2.id + 1]), {0: combinations.NO_OPTIONS, c1.id: c1,
+                                                                c2.id: c2})
+
+    def test_option_price_change(self):
+        c1 = combinations.get_combination((self.po1, self.po2))
+        c2 = combinations.get_combination((self.po2, self.po2))
+        c3 = combinations.get_combination((self.po3,))
+
+        po2 = ProductOption.objects.get(pk=self.po2.pk)
+        po2.price = 2
+        po2.save()
+
+        updated = combinations.get_combinations([c1.id, c2.id, c3.id])
+        self.assertEqual(updated[c1.id].total_price, Decimal('14.00'))
+        self.assertEqual(updated[c2.id].total_price, Decimal('4.00'))
+        self.assertNotEqual(updated[c1.id].price_version, c1.price_version)
+        self.assertEqual(updated[c3.id], c3)
+
+class CombinationsCacheTestCase(TransactionTestCase):
+    """
+    Combinations are only cached once committed, which never happens inside
+    a TestCase.
+    """
+
+    def setUp(self):
+        combinations.clear()
+        self.po1 = ProductOption.objects.create(name='option_1', price=12)
+        self.po2 = ProductOption.objects.create(name='option_2', price=3.14)
+
+    def tearDown(self):
+        combinations.clear()
+
+    def test_cached(self):
+        combination = combinations.get_combination((self.po1, self.po2))
+        with self.assertNumQueries(0):
+            self.assertEqual(combinations.get_combination((self.po2,
+                self.po1)), combination)
+            self.assertEqual(combinations.get_combinations([combination.id]),
+                {combination.id: combination})
+
+    def test_cached_prices_dropped_on_price_change(self):
+        combination = combinations.get_combination((self.po1, self.po2))
+        self.po1.price = 10
+        self.po1.save()
+        self.assertEqual(combinations.get_combination((self.po1,
+            self.po2)).total_price, Decimal('13.14'))
+
+    def test_price_changed_by_another_process(self):
+        combination = combinations.get_combination((self.po1, self.po2))
+        # what this process keeps in memory
+        cached = dict(combinations._combinations)
+        price_version = combinations._price_version
+
+        # another process (with nothing in memory) changes a price
+        combinations.clear()
+        self.po1.price = 10
+        self.po1.save()
+
+        # this process finds out through the shared price version
+        combinations._combinations.update(cached)
+        combinations._price_version = price_version
+        self.assertEqual(combinations.get_combinations([combination.id])[
+            combination.id].total_price, Decimal('13.14'))
@@ -0,0 +1,243 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from products.models import Product, Category, Ingridient, ProductNutrition
+from products.utils import facets
+from products.views import PRODUCTS_PER_PAGE
+
+class FacetIndexTestCase(TestCase):
+
+    def setUp(self):
+        self.index = facets.FacetIndex()
+        self.index.add(1, {('price', '0-5'), ('offer', '1'),
+            ('category', '1')})
+        self.index.add(2, {('price', '0-5'), ('offer', '0'),
+            ('category', '2')})
+        self.index.add(3, {('price', '5-10'), ('offer', '1'),
+            ('category', '2')})
+
+    def assertFilter(self, selection, product_ids, counts):
+        bitset, all_counts = self.index.filter(selection)
+        self.assertEqual(list(facets.iter_product_ids(bitset)), product_ids)
+        for facet, facet_counts in counts.items():
+            self.assertEqual(all_counts[facet], facet_counts)
+
+    def test_filter(self):
+        self.assertFilter({}, [1, 2, 3], {'price': {'0-5': 2, '5-10': 1},
+            'offer': {'0': 1, '1': 2}, 'ingridient': {}})
+        # the other values of the facet keep their counts
+        self.assertFilter({'price': {'0-5'}}, [1, 2], {
+            'price': {'0-5': 2, '5-10': 1}, 'offer': {'0': 1, '1': 1},
+            'category': {'1': 1, '2': 1}})
+        # OR within a facet, AND across facets
+        self.assertFilter({'price': {'0-5', '5-10'}, 'offer': {'1'}}, [1, 3],
+            {'price': {'0-5': 1, '5-10': 1}, 'offer': {'0': 1, '1': 2},
+            'category': {'1': 1, '2': 1}})
+        self.assertFilter({'category': {'3'}}, [], {'price': {'0-5': 0,
+            '5-10': 0}, 'category': {'1': 1, '2': 2}})
+
+    def test_update(self):
+        self.index.add(1, {('price', '5-10'), ('offer', '0')})
+        self.assertFilter({'price': {'5-10'}}, [1, 3], {'category': {
+            '2': 1}})
+        self.index.remove(3)
+        self.index.remove(4)
+        self.assertFilter({}, [1, 2], {'price': {'0-5': 1, '5-10': 1},
+            'category': {'2': 1}})
+
+    def test_iter_product_ids(self):
+        bitset, counts = self.index.filter({})
+        self.assertEqual(list(facets.iter_product_ids(bitset, after=1)),
+            [2, 3])
+        self.assertEqual(list(facets.iter_product_ids(bitset, after=3)), [])
+        self.assertEqual(facets.count(bitset), 3)
+
+    def test_get_band(self):
+        self.assertEqual(facets.get_band(0, facets.PRICE_BANDS), '0-5')
+        self.assertEqual(facets.get_band(5, facets.PRICE_BANDS), '5-10')
+        self.assertEqual(facets.get_band(9.99, facets.PRICE_BANDS), '5-10')
+        self.assertEqual(facets.get_band(100, facets.PRICE_BANDS), '50+')
+
+class FacetsTestCase(TestCase):
+
+    def setUp(self):
+        # the index of this process may be of another test's products
+        facets.rebuild()
+        self.parent = Category.objects.create(name='Meat', slug='meat',
+            description='-')
+        self.child = Category.objects.create(name='Poultry', slug='poultry',
+            description='-', parent=self.parent)
+        self.other = Category.objects.create(name='Salads', slug='salads',
+            description='-')
+        self.ingridient = Ingridient.objects.create(name='Rosemary',
+            slug='rosemary', image='rosemary.png')
+
+        self.nutrition = ProductNutrition.objects.create(protein=25,
+            carbs=0, fat=5)
+        self.chicken = Product.objects.create(name='Chicken', slug='chicken',
+            description='-', stock=1, price=8, offer_price=4,
+            nutrition=self.nutrition)
+        self.chicken.categories.add(self.child)
+        self.chicken.ingridients.add(self.ingridient)
+        self.salad = Product.objects.create(name='Salad', slug='salad',
+            description='-', stock=1, price=6)
+        self.salad.categories.add(self.other)
+
+    def assertProducts(self, selection, products):
+        bitset, counts = facets.filter_products(selection)
+        self.assertEqual(list(facets.iter_product_ids(bitset)),
+            [product.pk for product in products])
+
+    def get_counts(self, selection=None):
+        bitset, counts = facets.filter_products(selection or {})
+        return counts
+
+    def test_facet_values(self):
+        self.assertProducts({'price': {'0-5'}}, [self.chicken])
+        self.assertProducts({'price': {'5-10'}}, [self.salad])
+        self.assertProducts({'offer': {'1'}}, [self.chicken])
+        # in the ancestors of its categories too
+        self.assertProducts({'category': {str(self.parent.pk)}},
+            [self.chicken])
+        self.assertProducts({'ingridient': {str(self.ingridient.pk)}},
+            [self.chicken])
+        self.assertProducts({'protein': {'20+'}, 'fat': {'3-10'},
+            'calories': {'100-250'}}, [self.chicken])
+        self.assertEqual(self.get_counts()['carbs'], {'0-10': 1})
+
+    def test_products_changed(self):
+        self.salad.price = 2
+        self.salad.save()
+        self.assertProducts({'price': {'0-5'}}, [self.chicken, self.salad])
+
+        self.salad.ingridients.add(self.ingridient)
+        self.ingridient.products.remove(self.chicken)
+        self.assertProducts({'ingridient': {str(self.ingridient.pk)}},
+            [self.salad])
+
+        self.other.products.add(self.chicken)
+        self.assertEqual(self.get_counts()['category'][str(self.other.pk)],
+            2)
+
+        self.chicken.available = False
+        self.chicken.save()
+        self.assertProducts({}, [self.salad])
+        self.salad.delete()
+        self.assertProducts({}, [])
+
+    def test_nutrition_changed(self):
+        self.nutrition.protein = 2
+        self.nutrition.calories = None
+        self.nutrition.save()
+        self.assertProducts({'protein': {'0-5'}}, [self.chicken])
+        self.nutrition.delete()
+        self.assertEqual(self.get_counts()['protein'], {})
+
+    def test_categories_changed(self):
+        self.child.parent = self.other
+        self.child.save()
+        self.assertProducts({'category': {str(self.parent.pk)}}, [])
+        self.assertProducts({'category': {str(self.other.pk)}},
+            [self.chicken, self.salad])
+
+        self.other.delete()
+        self.assertProducts({'category': {str(self.other.pk)}}, [])
+        self.assertProducts({'category': {str(self.child.pk)}},
+            [self.chicken])
+
+    def test_incremental(self):
+        self.get_counts()
+        # up to date: no queries at all
+        with self.assertNumQueries(0):
+            self.get_counts()
+        self.salad.price = 2
+        self.salad.save()
+        # only the changed product is reloaded
+        with self.assertNumQueries(3):
+            self.get_counts()
+
+    def test_changed_by_another_process(self):
+        self.get_counts()
+        # the index of this process
+        index, version = facets._index, facets._index_version
+
+        # another process (without an index) changes a product
+        facets._index = None
+        self.salad.price = 2
+        self.salad.save()
+
+        # this process applies the change, recorded in the shared cache
+        facets._index, facets._index_version = index, version
+        self.assertProducts({'price': {'0-5'}}, [self.chicken, self.salad])
+
+    def test_missing_changes(self):
+        self.get_counts()
+        self.salad.price = 2
+        self.salad.save()
+        cache.delete(facets.FACET_CHANGES_CACHE_KEY.format(
+            facets.get_facet_version()))
+        with mock.patch.object(facets.FacetIndex, 'build',
+                wraps=facets.FacetIndex.build) as build:
+            self.assertProducts({'price': {'0-5'}}, [self.chicken,
+                                                                self.salad])
+            self.assertTrue(build.called)
+
+class FilterViewTestCase(TestCase):
+
+    def setUp(self):
+        facets.rebuild()
+        self.category = Category.objects.create(name='Meat', slug='meat',
+            description='-')
+        self.products = [Product.objects.create(name='p{}'.format(i),
+            slug='p{}'.format(i), description='-', stock=1, price=1 + i)
+            for i in range(PRODUCTS_PER_PAGE + 3)]
+        self.category.products.set(self.products[:PRODUCTS_PER_PAGE + 2])
+
+    def test_filter(self):
+        response = self.client.get('/filter/', {'price': ['0-5', '5-10'],
+            'category': self.category.pk})
+        self.assertTemplateUsed(response, 'products/filter.html')
+        # the last one in the category costs 10
+        self.assertEqual(response.context['count'], PRODUCTS_PER_PAGE + 1)
+        page = response.context['products']
+        self.assertEqual(list(page), self.products[:PRODUCTS_PER_PAGE])
+        self.assertEqual(page.next_cursor, str(self.products[
+            PRODUCTS_PER_PAGE - 1].pk))
+        self.assertEqual(response.context['filter_url'], 
+            '/filter/?category={}&price=0-5&price=5-10'.format(
+                self.category.pk))
+
+        response = self.client.get('/filter/', {'price': ['0-5', '5-10'],
+            'category': self.category.pk, 'cursor': page.next_cursor},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertTemplateUsed(response, 'products/list_ajax.html')
+        page = response.context['products']
+        self.assertEqual(list(page), [self.products[PRODUCTS_PER_PAGE]])
+        self.assertFalse(page.has_next())
+
+    def test_facets(self):
+        response = self.client.get('/filter/', {'price': '0-5'})
+        choices = {name: values for label, name, values 
+                                            in response.context['facets']}
+        self.assertEqual(choices['category'], [(str(self.category.pk),
+            'Meat', 4, False)])
+        # in the order of the bands, the selected one is still counted
+        self.assertEqual(choices['price'], [('0-5', '0-5', 4, True),
+            ('5-10', '5-10', 5, False), ('10-20', '10-20', 2, False)])
+        self.assertEqual(choices['offer'], [('0', 'No', 4, False)])
+        self.assertNotIn('protein', choices)
+        self.assertContains(response, 'value="0-5" checked')
+
+    def test_invalid_cursor(self):
+        for cursor in ('x', '-8'):
+            response = self.client.get('/filter/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 404)
+
+    def test_queries(self):
+        self.client.get('/filter/', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        # just the products
+        with self.assertNumQueries(1):
+            self.client.get('/filter/',
+                HTTP_X_REQUESTED_WITH='XMLHttpRequest')
@@ -0,0 +1,123 @@
+import random
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.six import StringIO
+
+from products.models import (Product, Category, Ingridient,
+    ProductSignature, ProductSignatureBucket)
+from products.utils import minhash
+
+class SignatureTestCase(TestCase):
+
+    def test_signature(self):
+        signature = minhash.get_signature(['a', 'b', 'c'])
+        self.assertEqual(len(signature), minhash.NUM_PERM)
+        self.assertEqual(signature, minhash.get_signature(['c', 'b', 'a',
+                                                                        'a']))
+        self.assertIsNone(minhash.get_signature([]))
+
+    def test_pack(self):
+        signature = minhash.get_signature(['a', 'b'])
+        packed = minhash.pack(signature)
+        self.assertIsInstance(packed, bytes)
+        self.assertEqual(len(packed), 4 * minhash.NUM_PERM)
+        self.assertEqual(minhash.unpack(packed), signature)
+
+    def test_estimate_similarity(self):
+        signature = minhash.get_signature(['a', 'b', 'c'])
+        self.assertEqual(minhash.estimate_similarity(signature, signature),
+            1)
+        self.assertEqual(minhash.get_buckets(signature),
+            minhash.get_buckets(minhash.get_signature(['a', 'b', 'c'])))
+        self.assertLess(minhash.estimate_similarity(signature,
+            minhash.get_signature(['d', 'e', 'f'])), 0.2)
+
+        rand = random.Random(0)
+        features = ['f{}'.format(i) for i in range(100)]
+        for _ in range(10):
+            features1 = set(rand.sample(features, 40))
+            features2 = set(rand.sample(features, 40))
+            jaccard = (len(features1 & features2) /
+                                            len(features1 | features2))
+            self.assertAlmostEqual(minhash.estimate_similarity(
+                minhash.get_signature(features1),
+                minhash.get_signature(features2)), jaccard, delta=0.2)
+
+class MinHashSimilarProductsTestCase(TestCase):
+
+    def setUp(self):
+        self.categories = [Category.objects.create(name='c{}'.format(i),
+            slug='c{}'.format(i), description='-') for i in range(2)]
+        self.ingridients = [Ingridient.objects.create(name='i{}'.format(i),
+            slug='i{}'.format(i), image='i.png') for i in range(6)]
+        self.products = [Product.objects.create(name='p{}'.format(i),
+            slug='p{}'.format(i), description='-', stock=1, price=1)
+            for i in range(4)]
+        # p0 and p1 have the same features, p2 shares half of them with p0
+        for product in self.products[:2]:
+            product.categories.add(self.categories[0])
+            product.ingridients.set(self.ingridients[:3])
+        self.products[2].categories.add(self.categories[0])
+        self.products[2].ingridients.set(self.ingridients[2:5])
+        # p3 has nothing in common with them
+        self.products[3].categories.add(self.categories[1])
+        self.products[3].ingridients.add(self.ingridients[5])
+
+    def test_similar_products(self):
+        similar = minhash.similar_products(self.products[0])
+        self.assertEqual(similar[0], self.products[1])
+        self.assertEqual(similar[0].similarity, 1)
+        self.assertNotIn(self.products[3], similar)
+        self.assertEqual(minhash.similar_products(self.products[0],
+            limit=1), [self.products[1]])
+
+    def test_unavailable(self):
+        Product.objects.filter(pk=self.products[1].pk).update(available=False)
+        self.assertNotIn(self.products[1],
+            minhash.similar_products(self.products[0]))
+        self.assertIn(self.products[1], minhash.similar_products(
+            self.products[0], manager=Product.objects))
+
+    def test_features_changed(self):
+        self.products[3].ingridients.set(self.ingridients[:3])
+        self.products[3].categories.set([self.categories[0]])
+        self.assertEqual(minhash.similar_products(self.products[3])[0].
+            similarity, 1)
+
+        self.ingridients[5].products.add(self.products[0])
+        similarity = {product: product.similarity for product in
+            minhash.similar_products(self.products[3])}
+        self.assertEqual(similarity[self.products[1]], 1)
+        self.assertLess(similarity[self.products[0]], 1)
+
+        self.products[3].categories.clear()
+        self.products[3].ingridients.clear()
+        self.assertFalse(ProductSignature.objects.filter(
+            product=self.products[3]).exists())
+        self.assertFalse(ProductSignatureBucket.objects.filter(
+            product=self.products[3]).exists())
+        self.assertEqual(minhash.similar_products(self.products[3]), [])
+
+    def test_feature_deleted(self):
+        signature = ProductSignature.objects.get(product=self.products[2])
+        self.ingridients[4].delete()
+        self.assertNotEqual(ProductSignature.objects.get(
+            product=self.products[2]).signature, signature.signature)
+
+    def test_rebuild_command(self):
+        signatures = dict(ProductSignature.objects.values_list('product_id',
+            'signature'))
+        ProductSignature.objects.all().delete()
+        ProductSignatureBucket.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_signatures', stdout=out)
+        self.assertIn('4 products', out.getvalue())
+        self.assertEqual(dict(ProductSignature.objects.values_list(
+            'product_id', 'signature')), signatures)
+        self.assertEqual(ProductSignatureBucket.objects.count(),
+            4 * minhash.BANDS)
+
+    def test_queries(self):
+        with self.assertNumQueries(3):
+            minhash.similar_products(self.products[0])
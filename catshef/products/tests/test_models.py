@@ -1,6 +1,8 @@
 import pdb
+from unittest import skipUnless
 
-from django.test import TestCase
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.urlresolvers import reverse
 import django.core.exceptions as exceptions
@@ -8,7 +10,10 @@ import django.core.exceptions as exceptions
 from decimal import Decimal, ROUND_UP
 
 from products.models import (Product, Category, ProductImage, ProductNutrition, 
-    Ingridient, ProductOption, ProductOptionGroup, Membership)
+    Ingridient, ProductOption, ProductOptionGroup, Membership, 
+    CategoryClosure)
+from products.utils import default_options
+from products.utils.pricing import get_price_version
 
 class ProductsModelTestCase(TestCase):
 
@@ -438,6 +443,155 @@ class ProductsModelTestCase(TestCase):
         self.assertEqual(sim_prod[2], product2, 'Second product is not Protein '
                                                 'Powder')
 
+class ProductPricesTestCase(TestCase):
+
+    def setUp(self):
+        # (price, offer price)
+        for i, (price, offer_price) in enumerate(((10, 4), (3, None), (8, 9),
+                                                    (6, 5), (20, 15))):
+            Product.objects.create(name='p{}'.format(i),
+                slug='p{}'.format(i), description='-', stock=1, price=price,
+                offer_price=offer_price)
+        self.products = Product.objects.with_prices()
+
+    def names(self, products):
+        return list(products.values_list('name', flat=True))
+
+    def test_with_prices(self):
+        for product in self.products:
+            self.assertEqual(product.effective_price, product.current_price)
+            self.assertEqual(bool(product.on_offer), bool(product.has_offer))
+            self.assertAlmostEqual(product.discount,
+                float(product.discount_percentage or 0))
+
+    def test_sort(self):
+        self.assertEqual(self.names(self.products.order_by('effective_price')),
+            ['p1', 'p0', 'p3', 'p2', 'p4'])
+        self.assertEqual(self.names(self.products.filter(on_offer=True)
+            .order_by('-discount')), ['p0', 'p4', 'p3'])
+
+    def test_range(self):
+        self.assertEqual(self.names(self.products.filter(
+            effective_price__lt=5).order_by('pk')), ['p0', 'p1'])
+        self.assertEqual(self.names(self.products.filter(
+            effective_price__gte=Decimal('5.00'), effective_price__lte=8)
+                .order_by('pk')), ['p2', 'p3'])
+        self.assertEqual(self.names(self.products.filter(
+            effective_price=Decimal('15.00'))), ['p4'])
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite query plan')
+    def test_effective_price_index(self):
+        for products in (self.products.filter(effective_price__gte=5),
+                self.products.order_by('effective_price')):
+            sql, params = products.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                plan = ' '.join(row[-1] for row in cursor.fetchall())
+            self.assertIn('products_product_effective_price', plan)
+
+class CategoryTreeTestCase(TestCase):
+
+    def setUp(self):
+        # root -> a -> b -> c
+        #      -> d
+        self.root = self._create('root')
+        self.a = self._create('a', self.root)
+        self.b = self._create('b', self.a)
+        self.c = self._create('c', self.b)
+        self.d = self._create('d', self.root)
+
+    def _create(self, name, parent=None):
+        return Category.objects.create(name=name, slug=name, description='-',
+            parent=parent)
+
+    def assertClosure(self):
+        """
+        The closure table has a row for every category and each of its
+        ancestors (following 'parent').
+        """
+        parents = dict(Category.objects.values_list('pk', 'parent_id'))
+        expected = set()
+        for pk in parents:
+            ancestor_id, depth = pk, 0
+            while ancestor_id is not None:
+                expected.add((ancestor_id, pk, depth))
+                ancestor_id, depth = parents[ancestor_id], depth + 1
+        self.assertEqual(set(CategoryClosure.objects.values_list(
+            'ancestor_id', 'descendant_id', 'depth')), expected)
+
+    def test_tree(self):
+        self.assertClosure()
+        self.assertCountEqual(self.root.get_descendants(), [self.root, self.a,
+            self.b, self.c, self.d])
+        self.assertCountEqual(self.a.get_descendants(include_self=False),
+            [self.b, self.c])
+        self.assertEqual(list(self.c.get_ancestors()), [self.root, self.a,
+            self.b])
+        self.assertEqual(list(self.c.get_ancestors(include_self=True)),
+            [self.root, self.a, self.b, self.c])
+        self.assertEqual(list(self.root.get_ancestors()), [])
+
+    def test_get_tree(self):
+        with self.assertNumQueries(1):
+            roots = Category.get_tree()
+        self.assertEqual(roots, [self.root])
+        self.assertEqual(roots[0].tree_children, [self.a, self.d])
+        self.assertEqual(roots[0].tree_children[0].tree_children, [self.b])
+
+    def test_move(self):
+        b = Category.objects.get(pk=self.b.pk)
+        b.parent = self.d
+        b.save()
+        self.assertClosure()
+        self.assertEqual(list(self.c.get_ancestors()), [self.root, self.d,
+            self.b])
+
+        a = Category.objects.get(pk=self.a.pk)
+        a.parent = None
+        a.save()
+        self.assertClosure()
+
+        d = Category.objects.get(pk=self.d.pk)
+        d.parent = self.a
+        d.save()
+        self.assertClosure()
+        self.assertEqual(list(self.c.get_ancestors()), [self.a, self.d,
+            self.b])
+
+    def test_move_under_descendant(self):
+        for parent in (self.a, self.c):
+            a = Category.objects.get(pk=self.a.pk)
+            a.parent = parent
+            with self.assertRaises(exceptions.ValidationError):
+                a.save()
+        self.assertClosure()
+
+    def test_delete(self):
+        self.a.delete()
+        self.assertClosure()
+        self.assertIsNone(Category.objects.get(pk=self.b.pk).parent)
+        self.assertEqual(list(self.c.get_ancestors()), [self.b])
+
+        Category.objects.filter(pk=self.root.pk).delete()
+        self.assertClosure()
+
+    def test_products_in_category(self):
+        product1 = Product.objects.create(name='p1', slug='p1',
+            description='-', stock=1, price=1)
+        product1.categories.add(self.c, self.b)
+        product2 = Product.objects.create(name='p2', slug='p2',
+            description='-', stock=1, price=1)
+        product2.categories.add(self.d)
+
+        self.assertEqual(list(Product.objects.in_category(self.root)),
+            [product1, product2])
+        self.assertEqual(list(Product.objects.in_category(self.a)),
+            [product1])
+        self.assertEqual(list(Product.objects.in_category(self.d)),
+            [product2])
+        with self.assertNumQueries(1):
+            list(Product.objects.in_category(self.root))
+
 class ProductOptionTestCase(TestCase):
 
     def setUp(self):
@@ -465,6 +619,47 @@ class ProductOptionTestCase(TestCase):
         string_repr = self.po_2.__str__()
         self.assertEqual(string_repr, 'option_2')
 
+    def test_price_version(self):
+        price_version = get_price_version()
+        po = ProductOption.objects.get(pk=self.po_1.pk)
+        po.description = 'Option 1'
+        po.save()
+        self.assertEqual(po.price_version, 0)
+        self.assertEqual(get_price_version(), price_version)
+
+        po.price = 13
+        po.save()
+        self.assertEqual(po.price_version, 1)
+        self.assertEqual(ProductOption.objects.get(pk=po.pk).price_version, 1)
+        self.assertNotEqual(get_price_version(), price_version)
+
+        # saving without the price doesn't change the price version
+        po.price = 14
+        po.save(update_fields=['description'])
+        self.assertEqual(po.price_version, 1)
+
+        # but the price wasn't saved, so saving it later does
+        price_version = get_price_version()
+        po.save()
+        self.assertEqual(po.price_version, 2)
+        self.assertEqual(ProductOption.objects.get(pk=po.pk).price, 14)
+        self.assertNotEqual(get_price_version(), price_version)
+
+class PriceVersionCommitTestCase(TransactionTestCase):
+    """
+    The price version is incremented again once the transaction is
+    committed, which never happens inside a TestCase.
+    """
+
+    def test_bumped_on_commit(self):
+        po = ProductOption.objects.create(name='option_1', price=12)
+        with transaction.atomic():
+            po.price = 13
+            po.save()
+            # the version another process would cache the old price under
+            price_version = get_price_version()
+        self.assertNotEqual(get_price_version(), price_version)
+
 class ProductOptionGroupTestCase(TestCase):
 
     def setUp(self):
@@ -745,4 +940,81 @@ class DefaultProductOptionsTestCase(TestCase):
         options = self.p4.get_default_options()
         self.assertCountEqual(options, [])
 
+    def test_single_query(self):
+        with self.assertNumQueries(1):
+            options = default_options.get_default_options([self.p1.pk,
+                self.p2.pk, self.p3.pk, self.p4.pk])
+        self.assertEqual(options[self.p1.pk], [self.po_1])
+        self.assertCountEqual(options[self.p2.pk], [self.po_1, self.po_3,
+            self.po_3])
+        self.assertEqual(options[self.p3.pk], [])
+        self.assertEqual(options[self.p4.pk], [])
+
+    def test_cached(self):
+        self.p2.get_default_options()
+        with self.assertNumQueries(0):
+            options = self.p2.get_default_options()
+        self.assertCountEqual(options, (self.po_1, self.po_3, self.po_3))
+        # a copy
+        options.clear()
+        self.assertEqual(len(self.p2.get_default_options()), 3)
+
+        # not in the process anymore, but still in the shared cache
+        default_options._cache.clear_local()
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.p2.get_default_options()), 3)
+
+    def test_membership_changed(self):
+        self.p1.get_default_options()
+        membership = Membership.objects.get(group=self.g1, option=self.po_1)
+        membership.default = False
+        membership.save()
+        self.assertEqual(self.p1.get_default_options(), [])
+
+        Membership.objects.create(group=self.g2, option=self.po_4,
+            default=True)
+        self.assertEqual(self.p1.get_default_options(), [self.po_4])
+
+        Membership.objects.filter(group=self.g2, default=True).get().delete()
+        self.assertEqual(self.p1.get_default_options(), [])
+
+    def test_changed_by_another_process(self):
+        self.p1.get_default_options()
+        # what this process keeps in memory
+        local = default_options._cache._local
 
+        # another process (with nothing in memory) changes a membership
+        default_options._cache.clear_local()
+        self.assertEqual(self.p1.get_default_options(), [self.po_1])
+        Membership.objects.create(group=self.g2, option=self.po_4,
+            default=True)
+        self.assertCountEqual(self.p1.get_default_options(), [self.po_1,
+            self.po_4])
+
+        # this process finds out through the shared version
+        default_options._cache._local = local
+        self.assertCountEqual(self.p1.get_default_options(), [self.po_1,
+            self.po_4])
+
+    def test_group_products_changed(self):
+        self.p4.get_default_options()
+        self.g1.products.add(self.p4)
+        self.assertEqual(self.p4.get_default_options(), [self.po_1])
+        self.p4.groups.remove(self.g1)
+        self.assertEqual(self.p4.get_default_options(), [])
+
+        self.p2.get_default_options()
+        self.g3.products.clear()
+        self.assertCountEqual(self.p2.get_default_options(), (self.po_1,
+            self.po_3))
+        self.g4.delete()
+        self.assertEqual(self.p2.get_default_options(), [self.po_1])
+
+    def test_option_changed(self):
+        self.p1.get_default_options()
+        self.po_1.price = 13
+        self.po_1.save()
+        self.assertEqual(self.p1.get_default_options()[0].price, 13)
+
+        self.po_1.delete()
+        self.assertEqual(self.p1.get_default_options(), [])
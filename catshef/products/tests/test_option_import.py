@@ -0,0 +1,159 @@
+import json
+import tempfile
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+from django.utils.six import StringIO
+
+from products.models import (Product, ProductOption, ProductOptionGroup,
+    Membership)
+from products.utils import option_import
+
+class OptionImportTestCase(TestCase):
+
+    def setUp(self):
+        self.p1 = Product.objects.create(name='p1', slug='p1',
+            description='-', stock=10, price=10)
+        self.p2 = Product.objects.create(name='p2', slug='p2',
+            description='-', stock=10, price=10)
+        self.po1 = ProductOption.objects.create(name='po1', price=1)
+        self.g1 = ProductOptionGroup.objects.create(name='g1',
+            type=ProductOptionGroup.RADIO)
+        Membership.objects.create(group=self.g1, option=self.po1,
+            default=True)
+        self.g1.products.add(self.p1)
+
+    def get_batch(self):
+        return {
+            'options': [
+                {'key': 'small', 'name': 'Small', 'price': '0'},
+                {'key': 'large', 'name': 'Large', 'price': '2.50'},
+                {'key': 'cheese', 'name': 'Cheese', 'price': 1.2,
+                    'description': 'Extra cheese'},
+            ],
+            'groups': [
+                {'key': 'size', 'name': 'Size', 'type': 'radio',
+                    'products': ['p1', 'p2']},
+                {'key': 'extras', 'name': 'Extras',
+                    'type': ProductOptionGroup.CHECKBOX, 'products': ['p2']},
+            ],
+            'memberships': [
+                {'group': 'size', 'option': 'small', 'default': True},
+                {'group': 'size', 'option': 'large'},
+                {'group': 'extras', 'option': 'cheese', 'default': True},
+                {'group': 'extras', 'option': self.po1.pk, 'default': True},
+                {'group': self.g1.pk, 'option': 'large'},
+            ],
+        }
+
+    def assertNothingImported(self):
+        self.assertEqual(ProductOption.objects.count(), 1)
+        self.assertEqual(ProductOptionGroup.objects.count(), 1)
+        self.assertEqual(Membership.objects.count(), 1)
+
+    def test_import(self):
+        self.assertEqual(self.p2.get_default_options(), [])
+        result = option_import.import_options(self.get_batch())
+        self.assertEqual(result, (3, 2, 5))
+
+        size = ProductOptionGroup.objects.get(name='Size')
+        self.assertEqual(size.type, ProductOptionGroup.RADIO)
+        self.assertCountEqual(size.products.all(), [self.p1, self.p2])
+        self.assertEqual(sorted(size.options.values_list('name', flat=True)),
+            ['Large', 'Small'])
+        cheese = ProductOption.objects.get(name='Cheese')
+        self.assertEqual(cheese.price, Decimal('1.2'))
+        self.assertEqual(cheese.description, 'Extra cheese')
+        self.assertCountEqual(self.g1.options.all(), [self.po1,
+            ProductOption.objects.get(name='Large')])
+
+        # the cached default options were invalidated
+        self.assertCountEqual([option.name
+            for option in self.p2.get_default_options()],
+            ['Small', 'Cheese', 'po1'])
+
+    def test_queries(self):
+        batch = self.get_batch()
+        batch['options'].extend({'key': 'o{}'.format(i), 'name': 'o',
+            'price': i} for i in range(100))
+        batch['memberships'].extend({'group': 'extras',
+            'option': 'o{}'.format(i)} for i in range(100))
+        # the products, the existing options, groups and memberships, the
+        # options and the groups (the largest pk, the insert and the pks),
+        # the groups' products, the memberships and the savepoint
+        with self.assertNumQueries(14):
+            option_import.import_options(batch)
+        self.assertEqual(Membership.objects.count(), 106)
+
+    def test_one_default(self):
+        batch = self.get_batch()
+        batch['memberships'][1]['default'] = True
+        with self.assertRaisesMessage(ValidationError,
+                'memberships[1]: group \'size\' already has a default'):
+            option_import.import_options(batch)
+        self.assertNothingImported()
+
+        # g1 already has a default option
+        batch = self.get_batch()
+        batch['memberships'][4]['default'] = True
+        with self.assertRaisesMessage(ValidationError,
+                'group {} already has a default'.format(self.g1.pk)):
+            option_import.import_options(batch)
+        self.assertNothingImported()
+
+        # dropdown groups too, but not checkbox groups
+        batch = self.get_batch()
+        batch['groups'][0]['type'] = 'Dropdown'
+        batch['memberships'][1]['default'] = True
+        with self.assertRaises(ValidationError):
+            option_import.import_options(batch)
+        batch['groups'][0]['type'] = 'checkbox'
+        option_import.import_options(batch)
+
+    def test_invalid(self):
+        batch = self.get_batch()
+        batch['options'][0]['price'] = 'cheap'
+        batch['options'][1]['key'] = 'small'
+        del batch['groups'][1]['name']
+        batch['groups'][0]['type'] = 'round'
+        batch['groups'][0]['products'].append('p3')
+        batch['memberships'].append({'group': 'size', 'option': 'medium'})
+        batch['memberships'].append({'group': 9999, 'option': 'small'})
+        batch['memberships'].append({'group': self.g1.pk,
+            'option': self.po1.pk})
+        with self.assertRaises(ValidationError) as cm:
+            option_import.import_options(batch)
+        messages = '\n'.join(cm.exception.messages)
+        for message in ('options[0]: price:', 'options[1]: duplicate key',
+                'groups[1]: name:', 'groups[0]: type:',
+                'groups[0]: there\'s no product \'p3\'',
+                'memberships[5]: unknown option \'medium\'',
+                'memberships[6]: unknown group 9999',
+                'memberships[7]: option {} is already in group {}'.format(
+                    self.po1.pk, self.g1.pk)):
+            self.assertIn(message, messages)
+        self.assertNothingImported()
+
+        with self.assertRaises(ValidationError):
+            option_import.import_options({'options': {}})
+        with self.assertRaises(ValidationError):
+            option_import.import_options([])
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+            json.dump(self.get_batch(), f)
+            f.flush()
+            out = StringIO()
+            call_command('import_options', f.name, stdout=out)
+        self.assertIn('3 options, 2 groups and 5 memberships',
+            out.getvalue())
+        self.assertEqual(Membership.objects.count(), 6)
+
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+            json.dump({'memberships': [{'group': 'size'}]}, f)
+            f.flush()
+            with self.assertRaisesMessage(CommandError,
+                    'unknown group \'size\''):
+                call_command('import_options', f.name)
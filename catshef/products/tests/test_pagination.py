@@ -0,0 +1,81 @@
+import datetime
+
+from common.pagination import KeysetPaginator, InvalidCursor
+from products.models import Product, Category
+
+from django.test import TestCase
+from django.utils import timezone
+
+class KeysetPaginatorTestCase(TestCase):
+
+    def setUp(self):
+        self.cat1 = Category.objects.create(name='c1', slug='c1',
+            description='-')
+        self.cat2 = Category.objects.create(name='c2', slug='c2',
+            description='-')
+        self.product = Product.objects.create(name='p', slug='p',
+            description='-', stock=1, price=1)
+        self.product.categories.add(self.cat1, self.cat2)
+
+        now = timezone.now()
+        for i in range(23):
+            product = Product.objects.create(name='p{}'.format(i),
+                slug='p{}'.format(i), description='-', stock=1, price=1)
+            product.categories.add(self.cat1)
+            if i % 3 == 0:
+                product.categories.add(self.cat2)
+            # plenty of ties in 'updated'
+            Product.objects.filter(pk=product.pk).update(
+                updated=now - datetime.timedelta(minutes=i // 4))
+
+    def _get_all_pages(self, paginator):
+        pages = [paginator.page()]
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].next_cursor))
+        return pages
+
+    def test_pages(self):
+        ordering = ('-updated', '-pk')
+        paginator = KeysetPaginator(Product.objects.all(), ordering, 5)
+        pages = self._get_all_pages(paginator)
+        self.assertEqual([len(page) for page in pages], [5, 5, 5, 5, 4])
+        self.assertIsNone(pages[0].cursor)
+        self.assertEqual(pages[1].cursor, pages[0].next_cursor)
+        self.assertEqual([product for page in pages for product in page],
+            list(Product.objects.order_by(*ordering)))
+
+    def test_ascending(self):
+        paginator = KeysetPaginator(Product.objects.all(), ('updated', 'pk'),
+                                                                            7)
+        products = [product for page in self._get_all_pages(paginator) 
+                                                        for product in page]
+        self.assertEqual(products, list(Product.objects.order_by('updated',
+                                                                    'pk')))
+
+    def test_annotated_ordering(self):
+        """
+        Sorting by an aggregate (filtered with HAVING) works too.
+        """
+        ordering = ('-same_categories', '-pk')
+        paginator = KeysetPaginator(self.product.similar_products(),
+            ordering, 3)
+        products = [product for page in self._get_all_pages(paginator) 
+                                                        for product in page]
+        expected = list(self.product.similar_products().order_by(*ordering))
+        self.assertEqual(len(expected), 23)
+        self.assertEqual(products, expected)
+
+    def test_last_page(self):
+        paginator = KeysetPaginator(Product.objects.all(), ('pk',), 24)
+        page = paginator.page()
+        self.assertEqual(len(page), 24)
+        self.assertFalse(page.has_next())
+        self.assertIsNone(page.next_cursor)
+
+    def test_invalid_cursor(self):
+        paginator = KeysetPaginator(Product.objects.all(), ('-updated', 
+                                                                    'pk'), 5)
+        cursor = paginator.page().next_cursor
+        for invalid in ('invalid', cursor[:-3], 'W10', 'WyJ4IiwieCJd'):
+            with self.assertRaises(InvalidCursor):
+                paginator.page(invalid)
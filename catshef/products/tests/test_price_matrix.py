@@ -0,0 +1,127 @@
+from decimal import Decimal
+
+from django.test import TestCase
+
+from products.models import (Product, ProductOption, ProductOptionGroup,
+    Membership)
+from products.utils import combinations, price_matrix
+
+class PriceMatrixTestCase(TestCase):
+
+    def setUp(self):
+        self.p1 = Product.objects.create(name='p1', slug='p1',
+            description='-', stock=10, price=15, offer_price=9)
+        self.p2 = Product.objects.create(name='p2', slug='p2',
+            description='-', stock=10, price='10.50')
+        self.po1 = ProductOption.objects.create(name='po1', price=12)
+        self.po2 = ProductOption.objects.create(name='po2', price='3.14')
+        self.po3 = ProductOption.objects.create(name='po3', price='0.5')
+        self.g1 = ProductOptionGroup.objects.create(name='g1',
+            type=ProductOptionGroup.RADIO)
+        self.g2 = ProductOptionGroup.objects.create(name='g2',
+            type=ProductOptionGroup.CHECKBOX)
+        Membership.objects.create(group=self.g1, option=self.po1,
+            default=True)
+        Membership.objects.create(group=self.g1, option=self.po2)
+        Membership.objects.create(group=self.g2, option=self.po2)
+        Membership.objects.create(group=self.g2, option=self.po3)
+        self.g1.products.add(self.p1)
+        self.g2.products.add(self.p1, self.p2)
+        price_matrix._cache.clear_local()
+
+    def _refresh(self, *objects):
+        for obj in objects:
+            obj.refresh_from_db()
+
+    def test_matrix(self):
+        matrix = price_matrix.get_price_matrix(self.p1.pk)
+        self.assertEqual(matrix.price, 1500)
+        self.assertEqual(matrix.offer_price, 900)
+        self.assertEqual(matrix.current_price, 900)
+        self.assertEqual(set(matrix.option_index), {self.po1.pk, self.po2.pk,
+            self.po3.pk})
+        self.assertEqual(matrix.option_prices[matrix.option_index[
+            self.po2.pk]], 314)
+        self.assertTrue(matrix.has_options([self.po1.pk, self.po3.pk]))
+
+        matrix = price_matrix.get_price_matrix(self.p2.pk)
+        self.assertIsNone(matrix.offer_price)
+        self.assertEqual(matrix.current_price, 1050)
+        self.assertFalse(matrix.has_options([self.po1.pk]))
+        self.assertIsNone(price_matrix.get_price_matrix(self.p2.pk + 100))
+
+    def test_quote(self):
+        matrix = price_matrix.get_price_matrix(self.p1.pk)
+        quote = matrix.quote([self.po1.pk, self.po3.pk, self.po3.pk], 3)
+        self.assertEqual(quote.unit_price, Decimal('22'))
+        self.assertEqual(quote.options_price, Decimal('13'))
+        self.assertEqual(quote.total_final_price, Decimal('66'))
+        self.assertEqual(quote.total_original_price, Decimal('84'))
+        self.assertEqual(matrix.quote().total_final_price, Decimal('9'))
+        with self.assertRaises(KeyError):
+            price_matrix.get_price_matrix(self.p2.pk).quote([self.po1.pk])
+
+    def test_quote_matches_combination(self):
+        self._refresh(self.p1, self.po1, self.po2, self.po3)
+        options = [self.po2, self.po3, self.po3]
+        combination = combinations.get_combination(options)
+        quote = price_matrix.get_price_matrix(self.p1.pk).quote(
+            [option.pk for option in options])
+        self.assertEqual(quote.options_price, combination.total_price)
+        self.assertEqual(quote.price_version, self.p1.price_version +
+            combination.price_version)
+
+    def test_queries(self):
+        with self.assertNumQueries(2):
+            matrices = price_matrix.get_price_matrices([self.p1.pk,
+                                                                self.p2.pk])
+        self.assertEqual(set(matrices), {self.p1.pk, self.p2.pk})
+        with self.assertNumQueries(0):
+            price_matrix.get_price_matrices([self.p1.pk, self.p2.pk])
+        price_matrix._cache.clear_local()
+        with self.assertNumQueries(0):
+            price_matrix.get_price_matrices([self.p1.pk])
+
+    def test_price_changed(self):
+        price_matrix.get_price_matrix(self.p1.pk)
+        self.p1.offer_price = None
+        self.p1.save()
+        self.po3.price = 1
+        self.po3.save()
+        self._refresh(self.p1, self.po3)
+        matrix = price_matrix.get_price_matrix(self.p1.pk)
+        self.assertEqual(matrix.current_price, 1500)
+        quote = matrix.quote([self.po3.pk])
+        self.assertEqual(quote.total_final_price, Decimal('16'))
+        self.assertEqual(quote.price_version, self.p1.price_version +
+            self.po3.price_version)
+
+    def test_price_changed_by_another_process(self):
+        price_matrix.get_price_matrix(self.p1.pk)
+        # what this process keeps in memory
+        local = price_matrix._cache._local
+
+        # another process (with nothing in memory) changes a price
+        price_matrix._cache.clear_local()
+        self.po1.price = 20
+        self.po1.save()
+
+        # this process finds out through the shared versions
+        price_matrix._cache._local = local
+        self.assertEqual(price_matrix.get_price_matrix(self.p1.pk).quote(
+            [self.po1.pk]).unit_price, Decimal(29))
+
+    def test_groups_changed(self):
+        price_matrix.get_price_matrix(self.p2.pk)
+        self.g1.products.add(self.p2)
+        self.assertTrue(price_matrix.get_price_matrix(self.p2.pk).has_options(
+            [self.po1.pk]))
+
+        po4 = ProductOption.objects.create(name='po4', price=2)
+        Membership.objects.create(group=self.g2, option=po4)
+        self.assertEqual(price_matrix.get_price_matrix(self.p2.pk).quote(
+            [po4.pk]).unit_price, Decimal('12.5'))
+
+        Membership.objects.filter(option=po4).delete()
+        self.assertFalse(price_matrix.get_price_matrix(self.p2.pk).has_options(
+            [po4.pk]))
@@ -0,0 +1,167 @@
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils.six import StringIO
+
+from products.models import Product, Category, Ingridient
+from products.search import get_search_backend
+from products.views import PRODUCTS_PER_PAGE
+
+class SearchBackendTestMixin(object):
+    """
+    Tests run against every backend (set in BACKEND).
+    """
+    BACKEND = None
+
+    def setUp(self):
+        self.settings_override = override_settings(
+            PRODUCT_SEARCH_BACKEND=self.BACKEND)
+        self.settings_override.enable()
+        self.backend = get_search_backend()
+
+        self.category = Category.objects.create(name='Poultry',
+            slug='poultry', description='-')
+        self.ingridient = Ingridient.objects.create(name='Rosemary',
+            slug='rosemary', image='rosemary.png')
+        self.turkey = self._create('Roast turkey', 'Whole turkey, roasted.')
+        self.chicken = self._create('Chicken breast', 'Grilled, no turkey.')
+        self.chicken.categories.add(self.category)
+        self.chicken.ingridients.add(self.ingridient)
+        self.salad = self._create('Caesar salad', 'With croûtons.')
+
+    def tearDown(self):
+        self.settings_override.disable()
+
+    def _create(self, name, description, **kwargs):
+        return Product.objects.create(name=name, slug=name.replace(' ', '-'),
+            description=description, stock=1, price=1, **kwargs)
+
+    def assertResults(self, query, products, ordered=True):
+        assertEqual = self.assertEqual if ordered else self.assertCountEqual
+        assertEqual(self.backend.search(query),
+            [product.pk for product in products])
+
+    def test_search(self):
+        # the match in the name ranks first
+        self.assertResults('turkey', [self.turkey, self.chicken])
+        self.assertResults('TURKEY grilled', [self.chicken])
+        self.assertResults('roast', [self.turkey])
+        self.assertResults('pizza', [])
+        self.assertResults('', [])
+
+    def test_prefix(self):
+        self.assertResults('chick', [self.chicken])
+        self.assertResults('whole tur', [self.turkey])
+        # only the last word is a prefix
+        self.assertResults('tur whole', [])
+
+    def test_categories_and_ingridients(self):
+        self.assertResults('poultry', [self.chicken])
+        self.assertResults('rosemary', [self.chicken])
+
+    def test_syntax(self):
+        for query in ('"turkey', 'turkey AND', 'NOT turkey', 'turkey*', 
+                '(turkey)', 'turkey:', '-turkey', "o'turkey"):
+            self.backend.search(query)
+
+    def test_offset(self):
+        self.assertResults('turkey', [self.turkey, self.chicken])
+        self.assertEqual(self.backend.search('turkey', offset=1),
+            [self.chicken.pk])
+        self.assertEqual(self.backend.search('turkey', limit=1),
+            [self.turkey.pk])
+
+    def test_product_changed(self):
+        self.turkey.name = 'Roast duck'
+        self.turkey.description = 'Whole duck, roasted.'
+        self.turkey.save()
+        self.assertResults('duck', [self.turkey])
+        self.assertResults('turkey', [self.chicken])
+
+        self.salad.available = False
+        self.salad.save()
+        self.assertResults('salad', [])
+        self.salad.available = True
+        self.salad.save()
+        self.assertResults('salad', [self.salad])
+
+        self.chicken.delete()
+        self.assertResults('grilled', [])
+
+    def test_categories_and_ingridients_changed(self):
+        self.category.name = 'Birds'
+        self.category.save()
+        self.assertResults('poultry', [])
+        self.assertResults('birds', [self.chicken])
+
+        self.category.products.add(self.salad)
+        self.assertResults('birds', [self.chicken, self.salad], ordered=False)
+        self.salad.categories.clear()
+        self.assertResults('birds', [self.chicken])
+
+        self.ingridient.name = 'Thyme'
+        self.ingridient.save()
+        self.assertResults('thyme', [self.chicken])
+        self.ingridient.delete()
+        self.assertResults('thyme', [])
+
+        self.category.delete()
+        self.assertResults('birds', [])
+
+    def test_rebuild_command(self):
+        self.backend.clear()
+        self.assertResults('turkey', [])
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Indexed 3 products', out.getvalue())
+        self.assertResults('turkey', [self.turkey, self.chicken])
+
+class SQLiteSearchBackendTestCase(SearchBackendTestMixin, TestCase):
+    BACKEND = 'products.search.SQLiteSearchBackend'
+
+    def test_diacritics(self):
+        self.assertResults('croutons', [self.salad])
+
+class TermSearchBackendTestCase(SearchBackendTestMixin, TestCase):
+    BACKEND = 'products.search.TermSearchBackend'
+
+class SearchViewTestCase(TestCase):
+
+    def setUp(self):
+        self.products = [Product.objects.create(name='Turkey {}'.format(i),
+            slug='turkey-{}'.format(i), description='-', stock=1, price=1)
+            for i in range(PRODUCTS_PER_PAGE + 2)]
+
+    def test_search(self):
+        response = self.client.get('/search/', {'q': 'turkey'})
+        self.assertTemplateUsed(response, 'products/search.html')
+        self.assertEqual(response.context['query'], 'turkey')
+        page = response.context['products']
+        self.assertEqual(len(page), PRODUCTS_PER_PAGE)
+        self.assertEqual(page.next_cursor, str(PRODUCTS_PER_PAGE))
+        self.assertEqual(response.context['search_url'], '/search/?q=turkey')
+
+        response = self.client.get('/search/', {'q': 'turkey', 
+            'cursor': page.next_cursor},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertTemplateUsed(response, 'products/list_ajax.html')
+        page = response.context['products']
+        self.assertEqual(len(page), 2)
+        self.assertFalse(page.has_next())
+
+    def test_no_results(self):
+        response = self.client.get('/search/', {'q': 'pizza'})
+        self.assertContains(response, 'No products found')
+        response = self.client.get('/search/')
+        self.assertNotContains(response, 'No products found')
+
+    def test_invalid_cursor(self):
+        for cursor in ('x', '-8'):
+            response = self.client.get('/search/', {'q': 'turkey',
+                'cursor': cursor})
+            self.assertEqual(response.status_code, 404)
+
+    def test_queries(self):
+        # the search and the products
+        with self.assertNumQueries(2):
+            self.client.get('/search/', {'q': 'turkey'},
+                HTTP_X_REQUESTED_WITH='XMLHttpRequest')
@@ -0,0 +1,118 @@
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.six import StringIO
+
+from products.models import Product, Category, ProductSimilarity
+from products.utils import similarity
+
+class SimilarityTestCase(TestCase):
+
+    def setUp(self):
+        self.categories = [Category.objects.create(name='c{}'.format(i),
+            slug='c{}'.format(i), description='-') for i in range(4)]
+        self.products = [Product.objects.create(name='p{}'.format(i),
+            slug='p{}'.format(i), description='-', stock=1, price=1)
+            for i in range(8)]
+        for i, product in enumerate(self.products):
+            product.categories.set(self.categories[j] for j in range(4)
+                                                            if (i >> j) & 1)
+
+    def assertSimilarities(self):
+        """
+        The stored similar products of every product are the ones computed
+        from the categories.
+        """
+        for product in Product.objects.all():
+            # (computed ones break ties by 'updated', stored ones by pk)
+            expected = product.similar_products(manager=Product.active
+                ).order_by('-same_categories', '-pk')[:ProductSimilarity.TOP_N]
+            self.assertEqual(
+                [(p.pk, p.same_categories) for p in product.similar_products()],
+                [(p.pk, p.same_categories) for p in expected], product)
+
+    def test_similar_products(self):
+        self.assertSimilarities()
+        # p7 has all the categories
+        product = self.products[7]
+        self.assertEqual([(p, p.same_categories) for p in
+            product.similar_products()], [(self.products[6], 2),
+            (self.products[5], 2), (self.products[3], 2),
+            (self.products[4], 1), (self.products[2], 1),
+            (self.products[1], 1)])
+
+    def test_ties(self):
+        # the stored similar products break ties by pk, the computed ones by
+        # 'updated' (then by pk)
+        self.products[3].save()
+        product = self.products[1]
+        self.assertEqual(list(product.similar_products()), [self.products[7],
+            self.products[5], self.products[3]])
+        self.assertEqual(list(product.similar_products(
+            manager=Product.active)), [self.products[3], self.products[7],
+            self.products[5]])
+
+    def test_categories_changed(self):
+        self.products[1].categories.add(self.categories[3])
+        self.assertSimilarities()
+        self.products[3].categories.remove(self.categories[0])
+        self.assertSimilarities()
+        self.products[5].categories.clear()
+        self.assertSimilarities()
+        self.assertFalse(self.products[5].similar_products().exists())
+
+    def test_category_products_changed(self):
+        self.categories[2].products.add(self.products[0], self.products[1])
+        self.assertSimilarities()
+        self.categories[0].products.remove(self.products[7])
+        self.assertSimilarities()
+        self.categories[1].products.clear()
+        self.assertSimilarities()
+
+    def test_availability_changed(self):
+        product = Product.objects.get(pk=self.products[3].pk)
+        product.available = False
+        product.save()
+        self.assertSimilarities()
+        self.assertFalse(ProductSimilarity.objects.filter(
+            similar=product).exists())
+
+        product.available = True
+        product.save()
+        self.assertSimilarities()
+
+    def test_deleted(self):
+        self.products[6].delete()
+        self.assertSimilarities()
+        self.categories[0].delete()
+        self.assertSimilarities()
+
+    def test_top_n(self):
+        with mock.patch.object(ProductSimilarity, 'TOP_N', 2):
+            similarity.rebuild()
+            self.assertSimilarities()
+
+            # removing a similar product brings in the next one
+            self.products[6].categories.remove(self.categories[1])
+            self.assertSimilarities()
+            # and a better one replaces the lowest ranked one
+            self.products[0].categories.set(self.categories)
+            self.assertSimilarities()
+            product = Product.objects.get(pk=self.products[5].pk)
+            product.available = False
+            product.save()
+            self.assertSimilarities()
+            self.categories[2].products.clear()
+            self.assertSimilarities()
+
+    def test_rebuild_command(self):
+        ProductSimilarity.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_similarities', stdout=out)
+        self.assertIn('8 products', out.getvalue())
+        self.assertSimilarities()
+
+    def test_similar_products_queries(self):
+        with self.assertNumQueries(1):
+            list(self.products[7].similar_products())
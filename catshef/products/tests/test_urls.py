@@ -40,3 +40,18 @@ class ProductsURLsTestCase(TestCase):
         self.assertEqual(related.view_name, 'products:product_related')
         self.assertEqual(related.func.__name__, 'product_related')
         self.assertEqual(related.kwargs['slug'], 'chicken-breast')
+
+    def test_search_url(self):
+        search = resolve('/search/')
+        self.assertEqual(search.view_name, 'products:search')
+        self.assertEqual(search.func.__name__, 'search')
+
+    def test_filter_url(self):
+        products_filter = resolve('/filter/')
+        self.assertEqual(products_filter.view_name, 'products:filter')
+        self.assertEqual(products_filter.func.__name__, 'products_filter')
+
+    def test_offers_url(self):
+        offers = resolve('/offers/')
+        self.assertEqual(offers.view_name, 'products:offers')
+        self.assertEqual(offers.func.__name__, 'offers')
@@ -1,10 +1,28 @@
+import re
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.http import Http404
 from django.test import TestCase, RequestFactory
-from products.views import index, product_detail, category, product_related
+from products.views import (index, product_detail, category, product_related,
+    offers, PRODUCTS_PER_PAGE)
 from django.core.urlresolvers import reverse
-from products.models import Product, Category
+from products.models import (Product, Category, ProductImage,
+    ProductNutrition)
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from time import sleep
 
+def get_next_cursor(page):
+    """
+    Get the cursor of the next page from a rendered list_ajax.html (None if
+    it's the last page).
+    """
+    match = re.search(r'class="next-page" data-cursor="([^"]+)"', page)
+    return match.group(1) if match else None
+
 class CatShefBaseTestCase(TestCase):
     """
     Base test case that sets up the data that's shared by all test cases.
@@ -57,10 +75,60 @@ class IndexViewTestCase(CatShefBaseTestCase):
             self.assertEqual(response.status_code, 200)
 
 
+    def test_index_streamed(self):
+        """
+        The first page of products is only fetched once the beginning of the
+        page has been sent.
+        """
+        request = self.factory.get('/')
+        request.session = {}
+        with CaptureQueriesContext(connection) as queries:
+            response = index(request)
+            self.assertTrue(response.streaming)
+            head = next(response.streaming_content)
+            self.assertEqual(len(queries), 0)
+        self.assertIn(b'id="products-main-tab1"', head)
+        page = head + b''.join(response.streaming_content)
+        self.assertIn(self.product1.get_absolute_url().encode(), page)
+
+    def test_index_paginated(self):
+        Product.objects.create(name='Unavailable', slug='unavailable',
+            description='-', stock=1, price=1, available=False)
+        for i in range(PRODUCTS_PER_PAGE):
+            Product.objects.create(name='Product {}'.format(i),
+                slug='product-{}'.format(i), description='-', stock=1, 
+                price=1)
+
+        request = self.factory.get('/')
+        request.session = {}
+        page = b''.join(index(request).streaming_content).decode()
+        self.assertEqual(page.count('class="col-md-3 m-wthree"'), 
+            PRODUCTS_PER_PAGE)
+        self.assertNotIn('/product/unavailable/', page)
+
+        # the next page is loaded via AJAX, with the cursor at the end of 
+        # the page
+        request = self.factory.get('/', {'cursor': get_next_cursor(page)},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        request.session = {}
+        page = index(request).content.decode()
+        self.assertEqual(page.count('class="col-md-3 m-wthree"'), 1)
+        self.assertIn('/product/product-7/', page)
+        self.assertIsNone(get_next_cursor(page))
+
+    def test_index_invalid_cursor(self):
+        request = self.factory.get('/', {'cursor': 'invalid'},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        request.session = {}
+        with self.assertRaises(Http404):
+            index(request)
+
 class ProductDetailTestCase(CatShefBaseTestCase):
 
     def setUp(self):
         self.factory = RequestFactory()
+        # the pages are cached
+        cache.clear()
 
     def test_basic(self):
         """
@@ -91,6 +159,109 @@ class ProductDetailTestCase(CatShefBaseTestCase):
         self.assertEqual(context['product'], Product.objects.get(
                 slug='chicken-breast'))
 
+    def test_not_found(self):
+        response = self.client.get('/product/pizza/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_cached(self):
+        page = self.client.get('/product/chicken-breast/').content
+        with self.assertNumQueries(0):
+            response = self.client.get('/product/chicken-breast/')
+        self.assertEqual(response.content, page)
+        self.assertTemplateNotUsed(response, 'products/detail.html')
+
+    def test_per_user_parts(self):
+        self.client.get('/product/chicken-breast/')
+        user = User.objects.create_user('john', 'john@example.com', 'pass')
+        self.client.force_login(user)
+        response = self.client.get('/product/chicken-breast/')
+        self.assertTemplateNotUsed(response, 'products/detail.html')
+        self.assertContains(response, 'id="logout-header-menu"')
+        self.assertNotContains(response, 'id="login-reg-modal-btn"')
+        self.assertContains(response, 'csrfmiddlewaretoken')
+
+    def test_invalidated(self):
+        self.client.get('/product/chicken-breast/')
+        product = Product.objects.get(pk=self.product1.pk)
+        product.name = 'Turkey Breast'
+        product.save()
+        self.assertContains(self.client.get('/product/chicken-breast/'),
+            'Turkey Breast')
+
+        self.product1.categories.add(self.cat1)
+        self.assertContains(self.client.get('/product/chicken-breast/'),
+            '>meat<')
+        self.cat1.name = 'poultry'
+        self.cat1.save()
+        self.assertContains(self.client.get('/product/chicken-breast/'),
+            '>poultry<')
+
+        ProductImage.objects.create(product=self.product1,
+            image='products/chicken.jpg')
+        self.assertContains(self.client.get('/product/chicken-breast/'),
+            'products/chicken.jpg')
+
+        nutrition = ProductNutrition.objects.create(protein=20, carbs=1,
+            fat=2)
+        product.nutrition = nutrition
+        product.save()
+        nutrition.protein = 31
+        nutrition.save()
+        self.assertContains(self.client.get('/product/chicken-breast/'),
+            '<b>Protein</b> 31g')
+
+    def test_touched_products_not_saved(self):
+        # 'updated' is the order of the listings, so it's left alone
+        self.product1.categories.add(self.cat1)
+        self.client.get('/product/chicken-breast/')
+        updated = Product.objects.get(pk=self.product1.pk).updated
+        self.cat1.name = 'poultry'
+        self.cat1.save()
+        self.assertContains(self.client.get('/product/chicken-breast/'),
+            '>poultry<')
+        self.assertEqual(Product.objects.get(pk=self.product1.pk).updated,
+            updated)
+
+    def test_slug_changed(self):
+        self.client.get('/product/chicken-breast/')
+        product = Product.objects.get(pk=self.product1.pk)
+        product.slug = 'chicken'
+        product.save()
+        response = self.client.get('/product/chicken-breast/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_queries(self):
+        product = Product.objects.get(pk=self.product1.pk)
+        product.main_image = ProductImage.objects.create(product=product,
+            image='products/chicken-1.jpg')
+        product.nutrition = ProductNutrition.objects.create(protein=20,
+            carbs=1, fat=2)
+        product.save()
+        ProductImage.objects.create(product=product,
+            image='products/chicken-2.jpg')
+        product.categories.add(self.cat1)
+
+        # the 'updated' time of the product and the detail loader
+        with self.assertNumQueries(5):
+            response = self.client.get('/product/chicken-breast/')
+        self.assertContains(response, 'products/chicken-2.jpg')
+
+    def test_detail_loader(self):
+        product = Product.objects.get(pk=self.product1.pk)
+        product.main_image = ProductImage.objects.create(product=product,
+            image='products/chicken-1.jpg')
+        product.save()
+        ProductImage.objects.create(product=product,
+            image='products/chicken-2.jpg')
+        with self.assertNumQueries(4):
+            product = Product.objects.for_detail().get(pk=product.pk)
+            self.assertEqual(product.get_images_urls(),
+                [ProductImage(image='products/chicken-2.jpg').image.url])
+            product.main_image_url
+            product.nutrition
+            list(product.categories.all())
+            list(product.ingridients.all())
+
 class CategoryListTestCase(CatShefBaseTestCase):
 
     def setUp(self):
@@ -119,6 +290,33 @@ class CategoryListTestCase(CatShefBaseTestCase):
         self.assertIsNotNone(context['category'])
         self.assertEqual(self.cat1, context['category'])
 
+    def test_subcategories(self):
+        """
+        The products of the subcategories are listed too, and the ancestors
+        are in the breadcrumbs.
+        """
+        child = Category.objects.create(name='poultry', slug='poultry',
+            description='-', parent=self.cat1)
+        grandchild = Category.objects.create(name='turkey', slug='turkey',
+            description='-', parent=child)
+        product = Product.objects.create(name='Turkey', slug='turkey',
+            description='-', stock=1, price=1)
+        product.categories.add(grandchild)
+        self.product1.categories.add(self.cat1)
+
+        response = self.client.get('/category/meat/',
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertContains(response, 'Turkey')
+        self.assertContains(response, 'Chicken Breast')
+        response = self.client.get('/category/poultry/',
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertContains(response, 'Turkey')
+        self.assertNotContains(response, 'Chicken Breast')
+
+        response = self.client.get('/category/turkey/')
+        self.assertEqual(list(response.context['breadcrumbs']),
+            [self.cat1, child])
+
 class RelatedProductsTestCase(CatShefBaseTestCase):
     def setUp(self):
         self.factory = RequestFactory()
@@ -136,3 +334,150 @@ class RelatedProductsTestCase(CatShefBaseTestCase):
             response = product_related(request, 'chicken-breast')
             self.assertEqual(response.status_code, 200)
 
+
+class OffersTestCase(TestCase):
+
+    def setUp(self):
+        # (price, offer price): the discounts are 50%, 20% and 25%
+        for i, (price, offer_price) in enumerate(((10, 5), (10, 8), (4, 3),
+                                                    (10, None), (5, 6))):
+            Product.objects.create(name='Product {}'.format(i),
+                slug='product-{}'.format(i), description='-', stock=1,
+                price=price, offer_price=offer_price)
+
+    def names(self, response):
+        return [product.name for product in response.context['products']]
+
+    def test_offers(self):
+        response = self.client.get(reverse('products:offers'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'products/offers.html')
+        self.assertEqual(self.names(response),
+            ['Product 0', 'Product 2', 'Product 1'])
+        self.assertContains(response, '-50%')
+        self.assertContains(response, '&euro;3.00')
+
+    def test_sort_by_price(self):
+        response = self.client.get(reverse('products:offers'),
+            {'sort': 'price'})
+        self.assertEqual(self.names(response),
+            ['Product 2', 'Product 0', 'Product 1'])
+
+    def test_pages(self):
+        for i in range(2 * PRODUCTS_PER_PAGE):
+            Product.objects.create(name='Offer {}'.format(i),
+                slug='offer-{}'.format(i), description='-', stock=1,
+                price=10, offer_price=9 - i % 3)
+        for sort in ('discount', 'price'):
+            names = []
+            cursor = ''
+            while cursor is not None:
+                response = self.client.get(reverse('products:offers'),
+                    {'sort': sort, 'cursor': cursor},
+                    HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+                names.extend(self.names(response))
+                cursor = get_next_cursor(response.content.decode())
+            self.assertEqual(len(names), 2 * PRODUCTS_PER_PAGE + 3)
+            self.assertEqual(len(set(names)), len(names))
+
+    def test_invalid(self):
+        self.assertEqual(self.client.get(reverse('products:offers'),
+            {'sort': 'name'}).status_code, 404)
+        self.assertEqual(self.client.get(reverse('products:offers'),
+            {'cursor': 'x'}).status_code, 404)
+
+class ListingQueriesTestCase(TestCase):
+    """
+    The number of queries of the listing views must not depend on the number
+    of listed products.
+    """
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.category = Category.objects.create(name='meat', slug='meat',
+            description='The meat category.')
+        self.product = self._create_product(0)
+
+    def _create_product(self, i):
+        nutrition = ProductNutrition.objects.create(protein=20, carbs=1,
+            fat=2)
+        product = Product.objects.create(name='Product {}'.format(i),
+            slug='product-{}'.format(i), description='Description', stock=10,
+            price=10, offer_price=8 if i % 2 else None, nutrition=nutrition)
+        product.main_image = ProductImage.objects.create(product=product,
+            image='products/product-{}.jpg'.format(i))
+        product.save()
+        product.categories.add(self.category)
+        return product
+
+    def _add_products(self, count):
+        start = Product.objects.count()
+        for i in range(start, start + count):
+            self._create_product(i)
+
+    def _count_queries(self, view, path, *args):
+        request = self.factory.get(path, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        request.session = {}
+        with CaptureQueriesContext(connection) as queries:
+            response = view(request, *args)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assertConstantQueries(self, num, view, path, *args):
+        self._add_products(1)
+        self.assertEqual(self._count_queries(view, path, *args), num)
+        self._add_products(6)
+        self.assertEqual(self._count_queries(view, path, *args), num)
+
+    def test_index(self):
+        # the products
+        self.assertConstantQueries(1, index, '/')
+
+    def test_category(self):
+        # the category and the products
+        self.assertConstantQueries(2, category, '/category/meat/', 'meat')
+
+    def test_offers(self):
+        # the products
+        self.assertConstantQueries(1, offers, '/offers/')
+
+    def test_related(self):
+        # the product and the related products
+        self.assertConstantQueries(2, product_related,
+            '/product/related/product-0/', 'product-0')
+
+    def test_deep_page(self):
+        """
+        Pages after the first one take the same queries.
+        """
+        self._add_products(2 * PRODUCTS_PER_PAGE)
+        for view, path, args in ((index, '/', ()),
+                (category, '/category/meat/', ('meat',)),
+                (product_related, '/product/related/product-0/', 
+                                                            ('product-0',))):
+            request = self.factory.get(path, 
+                HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+            request.session = {}
+            cursor = get_next_cursor(view(request, *args).content.decode())
+            self.assertIsNotNone(cursor)
+            request = self.factory.get(path, {'cursor': cursor},
+                HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+            request.session = {}
+            with CaptureQueriesContext(connection) as queries:
+                response = view(request, *args)
+            self.assertEqual(len(queries), 1 if view is index else 2)
+            self.assertEqual(response.content.decode().count(
+                'class="col-md-3 m-wthree"'), PRODUCTS_PER_PAGE)
+
+    def test_for_listing(self):
+        self._add_products(3)
+        products = list(Product.objects.for_listing().order_by('pk'))
+        with self.assertNumQueries(0):
+            for product in products:
+                product.main_image_url
+                product.protein
+                product.calories
+                self.assertEqual(product.effective_price,
+                    product.current_price)
+        self.assertEqual([product.effective_price for product in products],
+            [10, 8, 10, 8])
@@ -7,4 +7,7 @@ urlpatterns = [
         views.product_detail, name='product_detail'),
     url(r'^product/related/(?P<slug>[\w-]+)/$', views.product_related,name='product_related'),
     url(r'^category/(?P<slug>[\w-]+)/$', views.category, name='category'),
+    url(r'^offers/$', views.offers, name='offers'),
+    url(r'^search/$', views.search, name='search'),
+    url(r'^filter/$', views.products_filter, name='filter'),
 ]
\ No newline at end of file
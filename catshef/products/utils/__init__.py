@@ -0,0 +1,11 @@
+
+# max number of values in a single IN (...) lookup (SQLite allows at most
+# 999 query parameters)
+CHUNK_SIZE = 500
+
+def chunks(items, size=CHUNK_SIZE):
+    """
+    Split a list in lists of at most `size` items.
+    """
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
@@ -0,0 +1,178 @@
+"""
+Option combination registry.
+
+Every distinct combination of product options (a multiset: the same option
+may appear more than once) is stored once, as an OptionCombination, with a
+small integer id and its precomputed total price. Code that needs to refer
+to "a product with these options" (like the cart) keeps the combination id,
+instead of the list of options, so building keys and summing option prices
+is done once per combination, instead of on every request.
+
+Combinations are cached in memory (per process), so resolving them usually
+doesn't hit the database:
+
+    * key -> id mappings never change, so they're cached forever
+    * prices are cached until the global price version changes (see
+      products.utils.pricing), since changing an option's price updates the
+      combinations that contain it (see ProductOption._prices_changed()).
+      The price version is kept in the shared cache, so the prices cached by
+      every process are dropped, whichever process changed a price.
+
+Combinations are only cached once the transaction that created/read them is
+committed, so ids that are rolled back are never cached.
+
+NO_OPTIONS (id 0) is used for "no options".
+"""
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db import transaction
+
+from products.models import OptionCombination, ProductOption
+from products.utils.pricing import get_price_version
+
+Combination = namedtuple('Combination',
+    ['id', 'option_ids', 'total_price', 'price_version'])
+
+NO_OPTIONS = Combination(id=0, option_ids=(), total_price=Decimal('0.00'),
+    price_version=0)
+
+# sorted tuple of option pks -> combination id
+_ids = {}
+# combination id -> Combination, valid while the global price version is
+# _price_version
+_combinations = {}
+_price_version = None
+
+def get_combination(options):
+    """
+    Get the Combination of the given options, creating it if needed.
+
+    Args:
+        options (ProductOption iterable): the options (may be empty)
+    """
+    options = list(options or ())
+    if not options:
+        return NO_OPTIONS
+
+    option_ids = tuple(sorted(option.pk for option in options))
+    combination_id = _ids.get(option_ids)
+    if combination_id is not None:
+        combination = get_combinations([combination_id]).get(combination_id)
+        if combination is not None:
+            return combination
+    else:
+        _check_price_version()
+
+    instance = _get_or_create(option_ids, options)
+    return _register(instance)
+
+def get_combination_id(option_ids, create=True):
+    """
+    Get the id of the combination of the given option pks.
+
+    Returns:
+        the combination id (NO_OPTIONS.id if there are no options)
+        None, if the combination doesn't exist and `create` is False
+    """
+    if not option_ids:
+        return NO_OPTIONS.id
+    option_ids = tuple(sorted(option_ids))
+    combination_id = _ids.get(option_ids)
+    if combination_id is not None:
+        return combination_id
+
+    if create:
+        instance = _get_or_create(option_ids)
+    else:
+        instance = OptionCombination.objects.filter(
+            key=OptionCombination.get_key(option_ids)).first()
+        if instance is None:
+            return None
+    return _register(instance).id
+
+def get_combinations(combination_ids):
+    """
+    Get the Combinations with the given ids (in a single query, at most).
+
+    Returns:
+        dict mapping the ids to Combinations (ids that don't exist are left
+        out)
+    """
+    _check_price_version()
+    combinations = {}
+    missing = set()
+    for combination_id in combination_ids:
+        if combination_id == NO_OPTIONS.id:
+            combinations[combination_id] = NO_OPTIONS
+        elif combination_id in _combinations:
+            combinations[combination_id] = _combinations[combination_id]
+        else:
+            missing.add(combination_id)
+
+    if missing:
+        for instance in OptionCombination.objects.filter(pk__in=missing):
+            combinations[instance.pk] = _register(instance)
+    return combinations
+
+def clear():
+    """
+    Clear the in-memory cache.
+    """
+    global _price_version
+    _ids.clear()
+    _combinations.clear()
+    _price_version = None
+
+def _check_price_version():
+    """
+    Drop the cached prices if any price changed since they were cached.
+    """
+    global _price_version
+    price_version = get_price_version()
+    if price_version != _price_version:
+        _combinations.clear()
+        _price_version = price_version
+
+def _get_or_create(option_ids, options=None):
+    key = OptionCombination.get_key(option_ids)
+    instance = OptionCombination.objects.filter(key=key).first()
+    if instance is not None:
+        return instance
+
+    if options is None:
+        options_by_pk = ProductOption.objects.in_bulk(set(option_ids))
+        options = [options_by_pk[pk] for pk in option_ids
+                                                    if pk in options_by_pk]
+
+    instance = OptionCombination(key=key)
+    instance.set_price(options)
+    with transaction.atomic():
+        # the combination may have been created concurrently
+        instance, created = OptionCombination.objects.get_or_create(key=key,
+            defaults={'total_price': instance.total_price,
+                      'price_version': instance.price_version})
+        if created:
+            Through = OptionCombination.options.through
+            Through.objects.bulk_create([Through(optioncombination=instance,
+                productoption_id=pk) 
+                for pk in {option.pk for option in options}])
+    return instance
+
+def _register(instance):
+    """
+    Get the Combination of an OptionCombination instance and cache it once
+    the current transaction is committed.
+    """
+    combination = Combination(id=instance.pk,
+        option_ids=tuple(instance.get_option_ids()),
+        total_price=instance.total_price,
+        price_version=instance.price_version)
+    price_version = _price_version
+
+    def cache():
+        _ids[combination.option_ids] = combination.id
+        if price_version is not None and price_version == _price_version:
+            _combinations[combination.id] = combination
+    transaction.on_commit(cache)
+    return combination
@@ -0,0 +1,101 @@
+"""
+Caching of the default options of the products (see
+Product.get_default_options()).
+
+A product added to the cart without options is added with its default
+options (the default options of all of its option groups), so they're
+looked up on every such add. They're loaded with a single query, and cached
+in the process and in the shared cache (see products.utils.versioned_cache)
+under a global version (kept in the cache, like the price version, see
+products.utils.pricing), which is
+incremented whenever the option groups of the products, their memberships or
+the options themselves change (see the signal handlers in products.signals).
+A cached lookup takes a cache get (the version) and no queries.
+
+NOTE: QuerySet.update(), bulk_create() and QuerySet.delete() on the
+memberships or the options (and adding products to groups with bulk_create()
+on the through model) don't send signals, so call invalidate() after them.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import F
+
+from products.utils import chunks
+from products.utils.versioned_cache import VersionedCache
+
+DEFAULT_OPTIONS_VERSION_CACHE_KEY = 'catshef.products.default_options_version'
+# version, product pk
+DEFAULT_OPTIONS_CACHE_KEY = 'catshef.products.default_options.{}.{}'
+DEFAULT_OPTIONS_TIMEOUT = getattr(settings,
+    'PRODUCT_DEFAULT_OPTIONS_CACHE_TIMEOUT', 24 * 60 * 60)
+
+def get_default_options(product_ids):
+    """
+    Get the default options of the given products.
+
+    Returns:
+        dict mapping the product pks to lists of ProductOption (empty for
+        the products without default options)
+    """
+    product_ids = set(product_ids)
+    cached = _cache.get_many(product_ids, get_default_options_version())
+    # copies, so the callers can't change the cached lists
+    return {pk: list(cached[pk]) for pk in product_ids}
+
+def invalidate():
+    """
+    Forget the cached default options of all the products, after option
+    groups, memberships or options changed.
+    """
+    _bump_default_options_version()
+    if connection.in_atomic_block:
+        # the old default options may be cached again (under the new
+        # version) before the transaction is committed
+        transaction.on_commit(_bump_default_options_version)
+
+def get_default_options_version():
+    """
+    Get the global default options version.
+    """
+    version = cache.get(DEFAULT_OPTIONS_VERSION_CACHE_KEY)
+    if version is None:
+        _init_default_options_version()
+        version = cache.get(DEFAULT_OPTIONS_VERSION_CACHE_KEY)
+    return version
+
+def _bump_default_options_version():
+    try:
+        cache.incr(DEFAULT_OPTIONS_VERSION_CACHE_KEY)
+    except ValueError:
+        # key not in cache yet
+        _init_default_options_version()
+
+def _init_default_options_version():
+    # like the price version, start from the current time (in milliseconds)
+    # in case the key was evicted
+    cache.add(DEFAULT_OPTIONS_VERSION_CACHE_KEY, int(time.time() * 1000),
+        None)
+
+def _load(product_ids):
+    """
+    Load the default options of the given products, joining the memberships
+    with the groups' products and the options (a query per CHUNK_SIZE
+    products).
+    """
+    from products.models import Membership
+
+    options = {pk: [] for pk in product_ids}
+    for chunk in chunks(list(product_ids)):
+        memberships = Membership.objects.filter(default=True).annotate(
+            product_id=F('group__products')).filter(
+                product_id__in=chunk).select_related('option').order_by(
+                    'group_id', 'pk')
+        for membership in memberships:
+            options[membership.product_id].append(membership.option)
+    return options
+
+_cache = VersionedCache(DEFAULT_OPTIONS_CACHE_KEY, _load,
+    DEFAULT_OPTIONS_TIMEOUT)
@@ -0,0 +1,352 @@
+"""
+Faceted product filtering.
+
+Available products can be filtered by facets (see FACETS): their current
+price (see Product.current_price), whether they are on offer, their
+categories (a product of a subcategory is in its ancestors too, see
+CategoryClosure), their ingridients and their nutrition (protein, carbs,
+fat and calories). Prices and nutrition amounts are split in bands (see
+PRICE_BANDS and NUTRITION_BANDS).
+
+The selected values of a facet are alternatives (OR), and the facets are
+combined (AND). The count of a facet value is the number of products that
+would match if it was selected too: the selected values of the other facets
+apply to it, the ones of its own facet don't (so selecting a value doesn't
+zero the counts of the other values of its facet).
+
+Counting with a GROUP BY per facet on every request doesn't scale, so
+instead a FacetIndex keeps the products of every facet value as a bitset (a
+Python int, with the bit of every product pk set): filtering is ORing and
+ANDing bitsets, and a count is the number of bits set in an intersection.
+
+Every process keeps its own index (see get_index()), built on first use and
+then updated incrementally: the signal handlers in products.signals call
+update() with the pks of the changed products, which increments the global
+facet version (kept in the cache, which must be shared by the processes,
+like the price version, see products.utils.pricing) and records the pks
+under the new version. An index with an older version applies the changes
+recorded since, or is rebuilt if some of them are missing (e.g. evicted from
+the cache).
+
+NOTE: QuerySet.update() doesn't send signals, so if products are changed
+with it, call update() (or rebuild()).
+"""
+import operator
+import threading
+import time
+from bisect import bisect_right
+from functools import reduce
+
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from products.utils import chunks
+from products.models import Product
+
+NUTRITION_FACETS = ('protein', 'carbs', 'fat', 'calories')
+FACETS = ('price', 'offer', 'category', 'ingridient') + NUTRITION_FACETS
+
+# the lower bounds of the bands (the last one has no upper bound)
+PRICE_BANDS = (0, 5, 10, 20, 50)
+NUTRITION_BANDS = {
+    'protein': (0, 5, 10, 20),
+    'carbs': (0, 10, 30, 60),
+    'fat': (0, 3, 10, 20),
+    'calories': (0, 100, 250, 400),
+}
+
+FACET_VERSION_CACHE_KEY = 'catshef.products.facet_version'
+FACET_CHANGES_CACHE_KEY = 'catshef.products.facet_changes.{}'
+# changed pks are kept for a day; an index further behind is rebuilt
+FACET_CHANGES_TIMEOUT = 24 * 60 * 60
+MAX_FACET_CHANGES = 100
+
+_index = None
+_index_version = None
+_index_lock = threading.RLock()
+
+def get_band(amount, bands):
+    """
+    Get the band (as 'lower-upper', or 'lower+' for the last one) of an
+    amount.
+    """
+    i = max(bisect_right(bands, amount) - 1, 0)
+    if i == len(bands) - 1:
+        return '{}+'.format(bands[i])
+    return '{}-{}'.format(bands[i], bands[i + 1])
+
+def get_selection(query_dict):
+    """
+    Get the selected facet values from GET parameters (every selected value
+    as a parameter named after its facet, e.g. '?category=2&category=5').
+
+    Returns:
+        dict mapping the facets with selected values to sets of values
+    """
+    selection = {}
+    for facet in FACETS:
+        values = set(value for value in query_dict.getlist(facet) if value)
+        if values:
+            selection[facet] = values
+    return selection
+
+def iter_product_ids(bitset, after=None):
+    """
+    Iterate over the product pks in a bitset, in ascending order (only the
+    ones greater than `after`, if given).
+    """
+    if after is not None:
+        bitset = bitset >> (after + 1) << (after + 1)
+    while bitset:
+        lowest = bitset & -bitset
+        yield lowest.bit_length() - 1
+        bitset ^= lowest
+
+def count(bitset):
+    """
+    Count the products in a bitset.
+    """
+    return bin(bitset).count('1')
+
+class FacetIndex(object):
+    """
+    The products of every facet value, as bitsets.
+    """
+
+    def __init__(self):
+        # bitset of all the (available) products
+        self.products = 0
+        # facet -> value -> bitset
+        self.bitsets = {facet: {} for facet in FACETS}
+        # pk -> the facet values of the product
+        self._values = {}
+
+    @classmethod
+    def build(cls):
+        """
+        Build the index of all the available products.
+        """
+        index = cls()
+        for pk, values in _get_facet_values().items():
+            index.add(pk, values)
+        return index
+
+    def add(self, pk, values):
+        """
+        Add a product.
+
+        Args:
+            pk (int): its pk
+            values (set): its (facet, value) pairs
+        """
+        self.remove(pk)
+        bit = 1 << pk
+        self.products |= bit
+        for facet, value in values:
+            bitsets = self.bitsets[facet]
+            bitsets[value] = bitsets.get(value, 0) | bit
+        self._values[pk] = values
+
+    def remove(self, pk):
+        """
+        Remove a product (if it's in the index).
+        """
+        values = self._values.pop(pk, None)
+        if values is None:
+            return
+        mask = ~(1 << pk)
+        self.products &= mask
+        for facet, value in values:
+            bitsets = self.bitsets[facet]
+            bitsets[value] &= mask
+            if not bitsets[value]:
+                del bitsets[value]
+
+    def update(self, product_ids):
+        """
+        Reload the facet values of the given products (removing the ones
+        which were deleted or aren't available anymore).
+        """
+        product_ids = list(product_ids)
+        for chunk in chunks(product_ids):
+            values = _get_facet_values(chunk)
+            for pk in chunk:
+                if pk in values:
+                    self.add(pk, values[pk])
+                else:
+                    self.remove(pk)
+
+    def filter(self, selection):
+        """
+        Filter the products and count the products of every facet value.
+
+        Args:
+            selection (dict): maps facets to the selected values (as
+                returned by get_selection())
+
+        Returns:
+            a (bitset, counts) tuple: the bitset of the matching products,
+            and a dict mapping every facet to a dict mapping its values to
+            their counts
+        """
+        # the products matching the selected values of every facet
+        matches = {facet: reduce(operator.or_, (self.bitsets[facet].get(
+            value, 0) for value in values), 0)
+            for facet, values in selection.items() if facet in self.bitsets}
+        products = reduce(operator.and_, matches.values(), self.products)
+
+        counts = {}
+        for facet, bitsets in self.bitsets.items():
+            if facet in matches:
+                # ignoring the selection of the facet itself
+                base = reduce(operator.and_, (match for other, match in
+                    matches.items() if other != facet), self.products)
+            else:
+                base = products
+            counts[facet] = {value: count(bitset & base)
+                                            for value, bitset in bitsets.items()}
+        return products, counts
+
+def get_index():
+    """
+    Get the facet index of this process, up to date with the global facet
+    version. Other threads may update it while it's used, so rather use
+    filter_products().
+    """
+    global _index, _index_version
+    with _index_lock:
+        version = get_facet_version()
+        if _index is not None and version != _index_version:
+            product_ids = _get_changes(_index_version, version)
+            if product_ids is None:
+                _index = None
+            else:
+                _index.update(product_ids)
+        if _index is None:
+            _index = FacetIndex.build()
+        _index_version = version
+        return _index
+
+def filter_products(selection):
+    """
+    Filter the products and count the products of every facet value (see
+    FacetIndex.filter()), with the up to date facet index.
+    """
+    # the index can't change while it's used
+    with _index_lock:
+        return get_index().filter(selection)
+
+def update(product_ids):
+    """
+    Update the facet indexes after the facet values of the given products
+    changed (or they were created, deleted, made (un)available).
+    """
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+    _record_changes(product_ids)
+    if connection.in_atomic_block:
+        # other processes may reload the products before the transaction is
+        # committed, so make them reload them after it too
+        transaction.on_commit(lambda: _record_changes(product_ids))
+
+def rebuild():
+    """
+    Make every process rebuild its facet index.
+    """
+    global _index
+    with _index_lock:
+        _index = None
+    # no changes are recorded under the new version, so the indexes can't
+    # catch up
+    _bump_facet_version()
+
+def get_facet_version():
+    """
+    Get the global facet version.
+    """
+    version = cache.get(FACET_VERSION_CACHE_KEY)
+    if version is None:
+        _init_facet_version()
+        version = cache.get(FACET_VERSION_CACHE_KEY)
+    return version
+
+def _bump_facet_version():
+    """
+    Increment the global facet version.
+
+    Returns:
+        the new version, or None if it was (re)initialized
+    """
+    try:
+        return cache.incr(FACET_VERSION_CACHE_KEY)
+    except ValueError:
+        # key not in cache yet
+        _init_facet_version()
+        return None
+
+def _init_facet_version():
+    # like the price version, start from the current time (in milliseconds)
+    # in case the key was evicted
+    cache.add(FACET_VERSION_CACHE_KEY, int(time.time() * 1000), None)
+
+def _record_changes(product_ids):
+    version = _bump_facet_version()
+    if version is not None:
+        cache.set(FACET_CHANGES_CACHE_KEY.format(version), product_ids,
+            FACET_CHANGES_TIMEOUT)
+
+def _get_changes(from_version, to_version):
+    """
+    Get the pks of the products changed after `from_version`, up to
+    `to_version`, or None if they aren't all known.
+    """
+    if not 0 < to_version - from_version <= MAX_FACET_CHANGES:
+        return None
+    keys = [FACET_CHANGES_CACHE_KEY.format(version)
+        for version in range(from_version + 1, to_version + 1)]
+    changes = cache.get_many(keys)
+    # (a version may have been incremented, but its pks not recorded yet)
+    if len(changes) < len(keys):
+        return None
+    return set().union(*changes.values())
+
+def _get_facet_values(product_ids=None):
+    """
+    Get the facet values of the given available products (all of them, if
+    None).
+
+    Returns:
+        dict mapping the product pks to sets of (facet, value) pairs
+    """
+    products = Product.active.all()
+    if product_ids is None:
+        through_filter = {'product__available': True}
+    else:
+        products = products.filter(pk__in=product_ids)
+        through_filter = {'product_id__in': product_ids}
+
+    values = {}
+    for row in products.values_list('pk', 'price', 'offer_price',
+            *('nutrition__' + facet for facet in NUTRITION_FACETS)):
+        pk, price, offer_price = row[:3]
+        on_offer = offer_price is not None and offer_price < price
+        product_values = values[pk] = {
+            ('price', get_band(offer_price if on_offer else price,
+                                                            PRICE_BANDS)),
+            ('offer', '1' if on_offer else '0')}
+        for facet, amount in zip(NUTRITION_FACETS, row[3:]):
+            if amount is not None:
+                product_values.add((facet, get_band(amount,
+                                                    NUTRITION_BANDS[facet])))
+
+    for pk, category_id in Product.categories.through.objects.filter(
+            **through_filter).values_list('product_id',
+                                    'category__ancestor_links__ancestor_id'):
+        if pk in values:
+            values[pk].add(('category', str(category_id)))
+    for pk, ingridient_id in Product.ingridients.through.objects.filter(
+            **through_filter).values_list('product_id', 'ingridient_id'):
+        if pk in values:
+            values[pk].add(('ingridient', str(ingridient_id)))
+    return values
@@ -0,0 +1,202 @@
+"""
+Approximate product similarity with MinHash and locality-sensitive hashing.
+
+The similarity of two products is the Jaccard similarity of their features
+(their categories and their ingridients): the number of shared features
+over the number of features of either. Finding the most similar products
+exactly means comparing every product with every other one, so instead:
+
+    * every product gets a MinHash signature (see get_signature()): NUM_PERM
+      numbers, each one equally likely to be the same in the signatures of
+      two products as their Jaccard similarity. The fraction of equal numbers
+      estimates the similarity (see estimate_similarity()).
+    * signatures are split in BANDS bands of ROWS numbers and every band is
+      hashed to a bucket (see get_buckets()). Products sharing a bucket are
+      the candidates: the more similar two products are, the more likely it
+      is (for a similarity of 0.5, 93%; for 0.2, 15%).
+
+Only the candidates (looked up in the database by bucket) are compared, so
+the cost of a lookup depends on how many products are similar, not on the
+size of the catalog.
+
+Signatures are stored packed (as 4 bytes per number) in ProductSignature,
+and buckets in ProductSignatureBucket. The signal handlers in
+products.signals call update() when the categories or the ingridients of
+products change. rebuild() (see the rebuild_signatures management command)
+recomputes them all.
+"""
+import array
+import operator
+import random
+import sys
+import zlib
+from collections import defaultdict
+from functools import reduce
+
+from django.db import transaction
+from django.db.models import Q
+
+from products.utils import chunks
+from products.models import (Product, ProductSignature,
+    ProductSignatureBucket)
+
+NUM_PERM = 64
+BANDS = 20
+ROWS = 3  # BANDS * ROWS must not exceed NUM_PERM
+
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_random = random.Random(4217)
+# the "permutations": hash -> (a * hash + b) % _PRIME
+_PERMUTATIONS = [(_random.randrange(1, _PRIME), _random.randrange(_PRIME))
+                                                    for _ in range(NUM_PERM)]
+
+# feature -> its NUM_PERM permuted hashes (there are few distinct features)
+_feature_hashes = {}
+
+def get_features(category_ids=(), ingridient_ids=()):
+    """
+    Get the features of a product, from the pks of its categories and
+    ingridients.
+    """
+    return (['c{}'.format(pk) for pk in category_ids] +
+        ['i{}'.format(pk) for pk in ingridient_ids])
+
+def get_signature(features):
+    """
+    Get the MinHash signature of a set of features (strings).
+
+    Returns:
+        array of NUM_PERM unsigned ints, or None if there are no features
+    """
+    hashes = [_get_feature_hashes(feature) for feature in set(features)]
+    if not hashes:
+        return None
+    return array.array('I', map(min, zip(*hashes)))
+
+def estimate_similarity(signature1, signature2):
+    """
+    Estimate the Jaccard similarity of the features of two signatures.
+    """
+    return sum(map(int.__eq__, signature1, signature2)) / NUM_PERM
+
+def get_buckets(signature):
+    """
+    Get the (band, bucket) pairs of a signature.
+    """
+    return [(band, zlib.crc32(pack(signature[band * ROWS:(band + 1) * 
+                                            ROWS]))) for band in range(BANDS)]
+
+def pack(signature):
+    """
+    Pack a signature into bytes (little-endian).
+    """
+    if sys.byteorder == 'big':
+        signature = array.array('I', signature)
+        signature.byteswap()
+    return signature.tobytes()
+
+def unpack(data):
+    """
+    Unpack a signature packed by pack().
+    """
+    signature = array.array('I')
+    signature.frombytes(bytes(data))
+    if sys.byteorder == 'big':
+        signature.byteswap()
+    return signature
+
+def similar_products(product, limit=10, manager=None):
+    """
+    Get the (at most `limit`) products most similar to `product`, most
+    similar first, with their estimated similarity as 'similarity'.
+
+    Args:
+        product (Product): the product
+        limit (int): max number of products
+        manager (Manager): manager of the products to look for
+            (Product.active by default)
+    """
+    if manager is None:
+        manager = Product.active
+    try:
+        signature = unpack(ProductSignature.objects.get(
+            product=product).signature)
+    except ProductSignature.DoesNotExist:
+        return []
+
+    buckets = ProductSignatureBucket.objects.filter(reduce(operator.or_,
+        (Q(band=band, bucket=bucket) 
+            for band, bucket in get_buckets(signature))))
+    candidates = ProductSignature.objects.filter(
+        product_id__in=buckets.values('product_id')).filter(
+            product_id__in=manager.values('pk')).exclude(product=product)
+
+    ranked = sorted(((estimate_similarity(signature,
+        unpack(candidate.signature)), candidate.product_id)
+        for candidate in candidates), reverse=True)[:limit]
+    products = manager.in_bulk([pk for similarity, pk in ranked])
+    for similarity, pk in ranked:
+        products[pk].similarity = similarity
+    return [products[pk] for similarity, pk in ranked]
+
+def rebuild():
+    """
+    Recompute the signatures of all the products.
+
+    Returns:
+        the number of products
+    """
+    with transaction.atomic():
+        ProductSignature.objects.all().delete()
+        ProductSignatureBucket.objects.all().delete()
+        product_ids = list(Product.objects.values_list('pk', flat=True))
+        for chunk in chunks(product_ids):
+            _update(chunk)
+    return len(product_ids)
+
+def update(product_ids):
+    """
+    Recompute the signatures of the given products, after their categories
+    or ingridients changed.
+    """
+    with transaction.atomic():
+        for chunk in chunks(list(product_ids)):
+            ProductSignature.objects.filter(product_id__in=chunk).delete()
+            ProductSignatureBucket.objects.filter(
+                product_id__in=chunk).delete()
+            _update(chunk)
+
+def _update(product_ids):
+    category_ids = defaultdict(list)
+    for pk, category_id in Product.categories.through.objects.filter(
+            product_id__in=product_ids).values_list('product_id',
+                                                                'category_id'):
+        category_ids[pk].append(category_id)
+    ingridient_ids = defaultdict(list)
+    for pk, ingridient_id in Product.ingridients.through.objects.filter(
+            product_id__in=product_ids).values_list('product_id',
+                                                            'ingridient_id'):
+        ingridient_ids[pk].append(ingridient_id)
+
+    signatures = []
+    buckets = []
+    for pk in product_ids:
+        signature = get_signature(get_features(category_ids[pk],
+                                                        ingridient_ids[pk]))
+        if signature is None:
+            continue
+        signatures.append(ProductSignature(product_id=pk,
+            signature=pack(signature)))
+        buckets.extend(ProductSignatureBucket(product_id=pk, band=band,
+            bucket=bucket) for band, bucket in get_buckets(signature))
+    ProductSignature.objects.bulk_create(signatures)
+    ProductSignatureBucket.objects.bulk_create(buckets)
+
+def _get_feature_hashes(feature):
+    hashes = _feature_hashes.get(feature)
+    if hashes is None:
+        value = zlib.crc32(feature.encode())
+        hashes = _feature_hashes[feature] = [(a * value + b) % _PRIME &
+                                        _MAX_HASH for a, b in _PERMUTATIONS]
+    return hashes
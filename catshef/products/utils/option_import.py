@@ -0,0 +1,280 @@
+"""
+Bulk import of product options, option groups and their memberships.
+
+Saving a Membership validates it with full_clean(), which takes a query per
+membership (to check that a RADIO or DROPDOWN group has only one default
+option), and bulk_create() skips that validation altogether. import_options()
+validates a whole batch in memory instead (with a few queries for the
+existing groups, options and products it refers to, however big the batch
+is), and then writes it with bulk_create(), in a single transaction.
+
+A batch is a dict (e.g. loaded from JSON, see the import_options management
+command) with three lists:
+
+    {
+        "options": [{"key": "cheese", "name": "Cheese", "price": "1.50",
+                     "description": "..."}, ...],
+        "groups": [{"key": "extras", "name": "Extras", "type": "checkbox",
+                    "description": "...", "products": ["pizza", ...]}, ...],
+        "memberships": [{"group": "extras", "option": "cheese",
+                         "default": false}, ...]
+    }
+
+Options and groups are created, and get a key (unique within the batch) that
+the memberships refer to them by. Memberships can also refer to existing
+options and groups, by their pk (an int). The products of a group are given
+by their slugs. Everything but the keys, the names, the prices and the
+groups' types is optional.
+
+bulk_create() doesn't send signals, so the caches that depend on the groups
+(see products.utils.default_options) are invalidated once the batch is
+written.
+"""
+import collections
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Max
+
+from products.models import (Product, ProductOption, ProductOptionGroup,
+    Membership)
+from products.utils import chunks, default_options
+
+# the types of the groups, by name
+GROUP_TYPES = {name.lower(): value
+    for value, name in ProductOptionGroup.TYPE_CHOICES}
+
+# groups that can only have one option chosen (and one default option)
+SINGLE_CHOICE_TYPES = (ProductOptionGroup.RADIO, ProductOptionGroup.DROPDOWN)
+
+ImportResult = collections.namedtuple('ImportResult', ['options', 'groups',
+    'memberships'])
+ImportResult.__doc__ = """
+The number of options, groups and memberships created by an import.
+"""
+
+def import_options(batch):
+    """
+    Validate a batch of options, groups and memberships (see the module's
+    docstring), and create them (all of them, or none).
+
+    Returns:
+        ImportResult
+
+    Raises:
+        ValidationError: with the messages of all the errors in the batch
+    """
+    with transaction.atomic():
+        options, groups, memberships = _validate(batch)
+        option_ids = _bulk_create(ProductOption, [option
+            for key, option in options])
+        group_ids = _bulk_create(ProductOptionGroup, [group
+            for key, group, product_ids in groups])
+        option_ids = dict(zip((key for key, option in options), option_ids))
+        group_ids = dict(zip((key for key, group, product_ids in groups),
+            group_ids))
+
+        Through = ProductOptionGroup.products.through
+        for chunk in chunks([Through(productoptiongroup_id=group_ids[key],
+                product_id=product_id) for key, group, product_ids in groups
+                for product_id in product_ids]):
+            Through.objects.bulk_create(chunk)
+        for chunk in chunks([Membership(
+                group_id=group_ids.get(group, group),
+                option_id=option_ids.get(option, option), default=default)
+                for group, option, default in memberships]):
+            Membership.objects.bulk_create(chunk)
+        default_options.invalidate()
+    return ImportResult(len(options), len(groups), len(memberships))
+
+def _bulk_create(model, objects):
+    """
+    Create the objects (in chunks) and get their pks (bulk_create() doesn't
+    set them), in the same order.
+
+    The pks are the ones after the largest pk before the objects were
+    created, so no other objects must be created meanwhile (which is checked).
+    """
+    if not objects:
+        return []
+    last_pk = model.objects.aggregate(last_pk=Max('pk'))['last_pk'] or 0
+    for chunk in chunks(objects):
+        model.objects.bulk_create(chunk)
+    pks = list(model.objects.filter(pk__gt=last_pk).order_by(
+        'pk').values_list('pk', flat=True))
+    if len(pks) != len(objects):
+        raise ValidationError('Other {} were created while importing, try '
+            'again.'.format(model._meta.verbose_name_plural))
+    return pks
+
+def _validate(batch):
+    """
+    Validate a batch.
+
+    Returns:
+        a (options, groups, memberships) tuple: lists of (key, ProductOption)
+        pairs, (key, ProductOptionGroup, set of product pks) tuples and
+        (group key or pk, option key or pk, default) tuples
+
+    Raises:
+        ValidationError
+    """
+    errors = []
+    if not isinstance(batch, dict):
+        raise ValidationError('The batch must be a dict.')
+    items = {}
+    for name in ('options', 'groups', 'memberships'):
+        items[name] = batch.get(name, [])
+        if not isinstance(items[name], list) or not all(isinstance(item,
+                dict) for item in items[name]):
+            errors.append('"{}" must be a list of dicts.'.format(name))
+    if errors:
+        raise ValidationError(errors)
+
+    options = []
+    for i, item in enumerate(items['options']):
+        price = item.get('price')
+        if isinstance(price, float):
+            # (as written in JSON, not with the float's binary digits)
+            price = repr(price)
+        option = ProductOption(name=item.get('name'), price=price,
+            description=item.get('description'))
+        _clean(option, 'options[{}]'.format(i), errors)
+        options.append((item.get('key'), option))
+
+    slugs = {slug for item in items['groups']
+        for slug in _get_list(item, 'products') if isinstance(slug, str)}
+    products = {}
+    for chunk in chunks(list(slugs)):
+        products.update(Product.objects.filter(slug__in=chunk).values_list(
+            'slug', 'pk'))
+    groups = []
+    for i, item in enumerate(items['groups']):
+        where = 'groups[{}]'.format(i)
+        group_type = item.get('type')
+        if isinstance(group_type, str):
+            group_type = GROUP_TYPES.get(group_type.lower(), group_type)
+        group = ProductOptionGroup(name=item.get('name'), type=group_type,
+            description=item.get('description'))
+        _clean(group, where, errors)
+        product_slugs = _get_list(item, 'products')
+        if not isinstance(item.get('products', []), list):
+            errors.append('{}: "products" must be a list of slugs.'.format(
+                where))
+        for slug in product_slugs:
+            if not isinstance(slug, str) or slug not in products:
+                errors.append('{}: there\'s no product {!r}.'.format(where,
+                    slug))
+        groups.append((item.get('key'), group, {products[slug]
+            for slug in product_slugs
+            if isinstance(slug, str) and slug in products}))
+
+    option_keys = _check_keys('options', options, errors)
+    group_keys = _check_keys('groups', [(key, group)
+        for key, group, product_ids in groups], errors)
+    existing_options = _get_existing(ProductOption, items['memberships'],
+        'option')
+    existing_groups = _get_existing(ProductOptionGroup, items['memberships'],
+        'group')
+    group_types = {key: group.type for key, group, product_ids in groups}
+    group_types.update(existing_groups)
+
+    # the existing memberships and defaults of the existing groups
+    chosen = set()
+    defaults = collections.Counter()
+    for chunk in chunks(list(existing_groups)):
+        for group, option, default in Membership.objects.filter(
+                group_id__in=chunk).values_list('group_id', 'option_id',
+                    'default'):
+            chosen.add((group, option))
+            defaults[group] += default
+
+    memberships = []
+    for i, item in enumerate(items['memberships']):
+        where = 'memberships[{}]'.format(i)
+        group, option = item.get('group'), item.get('option')
+        default = item.get('default', False)
+        if not _is_known(group, existing_groups, group_keys):
+            errors.append('{}: unknown group {!r}.'.format(where, group))
+            continue
+        if not _is_known(option, existing_options, option_keys):
+            errors.append('{}: unknown option {!r}.'.format(where, option))
+            continue
+        if not isinstance(default, bool):
+            errors.append('{}: "default" must be a boolean.'.format(where))
+            continue
+        if (group, option) in chosen:
+            errors.append('{}: option {!r} is already in group {!r}.'.format(
+                where, option, group))
+            continue
+        chosen.add((group, option))
+        if default:
+            defaults[group] += 1
+            if (group_types[group] in SINGLE_CHOICE_TYPES and
+                                                        defaults[group] > 1):
+                errors.append('{}: group {!r} already has a default '
+                    'option.'.format(where, group))
+                continue
+        memberships.append((group, option, default))
+
+    if errors:
+        raise ValidationError(errors)
+    return options, groups, memberships
+
+def _clean(instance, where, errors):
+    try:
+        instance.full_clean()
+    except ValidationError as err:
+        errors.extend('{}: {}: {}'.format(where, field, message)
+            for field, messages in sorted(err.message_dict.items())
+            for message in messages)
+
+def _get_list(item, name):
+    values = item.get(name, [])
+    return values if isinstance(values, list) else []
+
+def _check_keys(name, objects, errors):
+    """
+    Check that the keys of the objects are unique strings.
+
+    Returns:
+        the set of the keys
+    """
+    keys = set()
+    for i, (key, obj) in enumerate(objects):
+        if not isinstance(key, str) or not key:
+            errors.append('{}[{}]: "key" must be a non-empty string.'.format(
+                name, i))
+        elif key in keys:
+            errors.append('{}[{}]: duplicate key "{}".'.format(name, i, key))
+        else:
+            keys.add(key)
+    return keys
+
+def _is_pk(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def _is_known(value, existing, keys):
+    """
+    Whether the value is the pk of an existing object or a key of the batch.
+    """
+    return (value in existing if _is_pk(value) else
+        isinstance(value, str) and value in keys)
+
+def _get_existing(model, memberships, name):
+    """
+    Get the existing objects that the memberships refer to by pk.
+
+    Returns:
+        dict mapping their pks to their types (groups) or to None (options)
+    """
+    pks = {item.get(name) for item in memberships if _is_pk(item.get(name))}
+    existing = {}
+    for chunk in chunks(list(pks)):
+        objects = model.objects.filter(pk__in=chunk)
+        if model is ProductOptionGroup:
+            existing.update(objects.values_list('pk', 'type'))
+        else:
+            existing.update(dict.fromkeys(objects.values_list('pk',
+                                                                flat=True)))
+    return existing
@@ -0,0 +1,78 @@
+"""
+Caching of the product detail pages.
+
+The detail page of a product is cached whole, except for its per-user parts
+(see common.holes), keyed on a stamp of the product: its pk, its 'updated'
+time and the time the stamp was made. The stamp is cached too (getting the
+'updated' time takes a query), so a cached page is served without queries.
+
+Saving the product changes the key. Products aren't saved when other things
+shown on their pages change (their categories, ingridients, images or
+nutrition, or the names of the categories and ingridients), so the signal
+handlers in products.signals touch() them then, which forgets their stamps:
+the next stamp is made at a later time, so the key changes too, without
+writing anything to the products ('updated' is also the order of the
+listings, which mustn't change).
+
+NOTE: QuerySet.update() doesn't send signals, so if products are changed
+with it, call touch().
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from products.models import Product
+
+DETAIL_PAGE_CACHE_KEY = 'catshef.products.detail_page.{}.{}.{}'
+# slug -> pk
+DETAIL_SLUG_CACHE_KEY = 'catshef.products.detail_slug.{}'
+# pk -> (slug, 'updated' time, time the stamp was made)
+DETAIL_STAMP_CACHE_KEY = 'catshef.products.detail_stamp.{}'
+DETAIL_PAGE_TIMEOUT = getattr(settings, 'PRODUCT_DETAIL_CACHE_TIMEOUT',
+    24 * 60 * 60)
+
+def get_detail_page_key(slug):
+    """
+    Get the cache key of the detail page of the product with the given
+    slug.
+
+    Raises:
+        Product.DoesNotExist: if there's no such product
+    """
+    pk = cache.get(DETAIL_SLUG_CACHE_KEY.format(slug))
+    stamp = (cache.get(DETAIL_STAMP_CACHE_KEY.format(pk)) 
+        if pk is not None else None)
+    # (the slug may have been given to another product)
+    if stamp is None or stamp[0] != slug:
+        pk, updated = Product.objects.values_list('pk', 'updated').get(
+            slug=slug)
+        stamp = (slug, int(updated.timestamp() * 1000000),
+            int(time.time() * 1000000))
+        cache.set_many({DETAIL_SLUG_CACHE_KEY.format(slug): pk,
+            DETAIL_STAMP_CACHE_KEY.format(pk): stamp}, DETAIL_PAGE_TIMEOUT)
+    return DETAIL_PAGE_CACHE_KEY.format(pk, stamp[1], stamp[2])
+
+def touch(product_ids):
+    """
+    Change the keys of the detail pages of the given products, after
+    something shown on them (but not stored in the products) changed.
+    """
+    invalidate(product_ids)
+
+def invalidate(product_ids):
+    """
+    Forget the cached stamps of the given products, after they were saved,
+    deleted or touched.
+    """
+    product_ids = list(product_ids)
+    _forget_stamps(product_ids)
+    if connection.in_atomic_block:
+        # the old page may be cached again (under a new stamp) before the
+        # transaction is committed
+        transaction.on_commit(lambda: _forget_stamps(product_ids))
+
+def _forget_stamps(product_ids):
+    cache.delete_many([DETAIL_STAMP_CACHE_KEY.format(pk)
+                                                    for pk in product_ids])
@@ -0,0 +1,166 @@
+"""
+Per-product pricing matrices, for pricing any combination of options of a
+product without touching the database.
+
+The PriceMatrix of a product holds its price, its offer price and the
+prices (and price versions) of all the options of its option groups, as
+integer cents, indexed by option pk. Pricing a product with some options
+(see PriceMatrix.quote()) is a few lookups and integer additions, and gives
+exactly the prices (and the price stamp) the cart computes from the product
+and the option combination (see cart.cart.Cart).
+
+Matrices are cached in the process and in the shared cache (see
+products.utils.versioned_cache), under both the global price version (see
+products.utils.pricing) and the option groups version (the one of the
+default options, see products.utils.default_options, which changes whenever
+the groups of the products, their memberships or the options change).
+"""
+from collections import namedtuple
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import F
+
+from products.utils import chunks, default_options
+from products.utils.pricing import get_price_version
+from products.utils.versioned_cache import VersionedCache
+
+# version (price version and option groups version), product pk
+PRICE_MATRIX_CACHE_KEY = 'catshef.products.price_matrix.{}.{}'
+PRICE_MATRIX_TIMEOUT = getattr(settings, 'PRODUCT_PRICE_MATRIX_CACHE_TIMEOUT',
+    24 * 60 * 60)
+
+Quote = namedtuple('Quote', ['unit_price', 'options_price',
+    'total_final_price', 'total_original_price', 'price_version'])
+Quote.__doc__ = """
+The prices of a quantity of a product with some options (Decimals), and the
+price stamp of the product and the options (see Cart._get_price_stamp()).
+"""
+
+class PriceMatrix(namedtuple('PriceMatrix', ['product_id', 'price',
+        'offer_price', 'price_version', 'option_index', 'option_prices',
+        'option_price_versions'])):
+    """
+    The prices of a product and of the options of its groups. Immutable.
+
+    Fields:
+        product_id (int): the pk of the product
+        price (int): the price of the product, in cents
+        offer_price (int): the offer price of the product, in cents, or None
+        price_version (int): the price version of the product
+        option_index (dict): maps the option pks to their index in
+            'option_prices' and 'option_price_versions'
+        option_prices (tuple): the prices of the options, in cents
+        option_price_versions (tuple): the price versions of the options
+    """
+    __slots__ = ()
+
+    @classmethod
+    def build(cls, product_id, price, offer_price, price_version, options):
+        """
+        Build the matrix of a product.
+
+        Args:
+            price, offer_price (Decimal): the prices of the product
+            options: iterable of (option pk, price, price version) tuples
+        """
+        options = sorted(set(options))
+        return cls(product_id, _to_cents(price), _to_cents(offer_price),
+            price_version, {pk: i for i, (pk, option_price, version)
+                                                    in enumerate(options)},
+            tuple(_to_cents(option_price) for pk, option_price, version
+                                                                in options),
+            tuple(version for pk, option_price, version in options))
+
+    @property
+    def has_offer(self):
+        # (like Product.has_offer)
+        return bool(self.offer_price) and self.offer_price < self.price
+
+    @property
+    def current_price(self):
+        """
+        The price the product is sold at, in cents (see
+        Product.current_price).
+        """
+        return self.offer_price if self.has_offer else self.price
+
+    def has_options(self, option_ids):
+        """
+        Whether all the given options are options of the product's groups.
+        """
+        return all(pk in self.option_index for pk in option_ids)
+
+    def quote(self, option_ids=(), quantity=1):
+        """
+        Price a quantity of the product with the given options (duplicates
+        included).
+
+        Returns:
+            Quote
+
+        Raises:
+            KeyError: if an option isn't an option of the product's groups
+        """
+        indexes = [self.option_index[pk] for pk in option_ids]
+        options_price = sum(self.option_prices[i] for i in indexes)
+        return Quote(
+            unit_price=_from_cents(self.current_price + options_price),
+            options_price=_from_cents(options_price),
+            total_final_price=_from_cents((self.current_price + options_price)
+                                                                * quantity),
+            total_original_price=_from_cents((self.price + options_price)
+                                                                * quantity),
+            price_version=self.price_version + sum(
+                self.option_price_versions[i] for i in indexes))
+
+def get_price_matrices(product_ids):
+    """
+    Get the price matrices of the given products.
+
+    Returns:
+        dict mapping the product pks to PriceMatrix (products that don't exist
+        are left out)
+    """
+    version = '{}-{}'.format(get_price_version(),
+        default_options.get_default_options_version())
+    matrices = _cache.get_many(product_ids, version)
+    return {pk: matrix for pk, matrix in matrices.items() if matrix is not None}
+
+def get_price_matrix(product_id):
+    """
+    Get the price matrix of a product (None if it doesn't exist).
+    """
+    return get_price_matrices([product_id]).get(product_id)
+
+def _to_cents(value):
+    # prices have 2 decimal places
+    return None if value is None else int(Decimal(value).scaleb(2))
+
+def _from_cents(cents):
+    return Decimal(cents).scaleb(-2)
+
+def _load(product_ids):
+    """
+    Build the matrices of the given products (None for the ones that don't
+    exist), with two queries per CHUNK_SIZE products.
+    """
+    from products.models import Membership, Product
+
+    matrices = dict.fromkeys(product_ids)
+    for chunk in chunks(list(product_ids)):
+        options = {pk: [] for pk in chunk}
+        for product_id, option_id, price, version in (Membership.objects
+                .annotate(product_id=F('group__products'))
+                .filter(product_id__in=chunk)
+                .values_list('product_id', 'option_id', 'option__price',
+                    'option__price_version')):
+            options[product_id].append((option_id, price, version))
+        for pk, price, offer_price, version in Product.objects.filter(
+                pk__in=chunk).values_list('pk', 'price', 'offer_price',
+                    'price_version'):
+            matrices[pk] = PriceMatrix.build(pk, price, offer_price, version,
+                options[pk])
+    return matrices
+
+_cache = VersionedCache(PRICE_MATRIX_CACHE_KEY, _load, PRICE_MATRIX_TIMEOUT)
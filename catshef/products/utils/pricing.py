@@ -0,0 +1,56 @@
+"""
+Price versioning.
+
+Every Product and ProductOption has a 'price_version', which is incremented
+every time its price changes (see Product.save() and ProductOption.save()).
+On top of that, there's a global price version (kept in the cache), which is
+incremented on any price change, so it's possible to know whether any price
+has changed at all with a single cache lookup. Processes learn about each
+other's price changes through it, so the cache must be shared by all of the
+processes (see the CACHES setting).
+
+NOTE: QuerySet.update() bypasses save(), so if prices are changed with it,
+call bump_price_version() (and update the 'price_version' fields).
+"""
+import time
+
+from django.core.cache import cache
+from django.db import connection, transaction
+
+PRICE_VERSION_CACHE_KEY = 'catshef.products.price_version'
+
+def get_price_version():
+    """
+    Get the global price version.
+    """
+    version = cache.get(PRICE_VERSION_CACHE_KEY)
+    if version is None:
+        _init_price_version()
+        version = cache.get(PRICE_VERSION_CACHE_KEY)
+    return version
+
+def bump_price_version():
+    """
+    Increment the global price version. Should be called every time a price
+    changes.
+    """
+    _bump_price_version()
+    if connection.in_atomic_block:
+        # other processes may read the old prices (and cache them under the
+        # new version) until the transaction is committed
+        transaction.on_commit(_bump_price_version)
+
+def _bump_price_version():
+    try:
+        cache.incr(PRICE_VERSION_CACHE_KEY)
+    except ValueError:
+        # key not in cache yet
+        _init_price_version()
+
+def _init_price_version():
+    """
+    Versions are only compared for equality, so they only need to be
+    different from any previous one. The key might have been evicted, so
+    start from the current time (in milliseconds), instead of from 0.
+    """
+    cache.add(PRICE_VERSION_CACHE_KEY, int(time.time() * 1000), None)
@@ -0,0 +1,184 @@
+"""
+Materialized product similarity.
+
+Two products are similar if they share categories (the more, the more
+similar). Computing that means joining the categories of a product with the
+ones of every other product, so instead of doing it on every product page,
+the ProductSimilarity.TOP_N most similar available products of every
+product are stored as ProductSimilarity rows, ranked by score (the number
+of shared categories) and then by pk (the last created first), like
+Product.similar_products() lists them (unless computed from a manager).
+
+The rows are updated incrementally by the signal handlers in
+products.signals, calling update() when the categories or the availability
+of products change, so only the affected products are recomputed. rebuild()
+(see the rebuild_similarities management command) recomputes them all, and
+the 0027_fill_productsimilarity migration fills the table the same way.
+"""
+import operator
+from collections import Counter, defaultdict
+from functools import reduce
+
+from django.db import transaction
+from django.db.models import Count, Min, Q
+
+from products.utils import CHUNK_SIZE, chunks
+from products.models import Product, ProductSimilarity
+
+def rebuild(product_ids=None):
+    """
+    Recompute the similar products of the given product pks (all the
+    products, if None).
+
+    Returns:
+        the number of products whose similar products were recomputed
+    """
+    with transaction.atomic():
+        if product_ids is None:
+            ProductSimilarity.objects.all().delete()
+            product_ids = Product.objects.values_list('pk', flat=True)
+        product_ids = list(product_ids)
+        for chunk in chunks(product_ids):
+            _replace(_get_scores(chunk))
+    return len(product_ids)
+
+def update(product_ids):
+    """
+    Update the similar products after the categories or the availability of
+    the given products changed.
+
+    Their own similar products are recomputed. For every other product, the
+    rows referencing them are updated in place when possible, otherwise its
+    similar products are recomputed too (e.g. when one of them is removed,
+    the next one has to take its place).
+    """
+    product_ids = set(product_ids)
+    if not product_ids:
+        return
+    with transaction.atomic():
+        scores = {}
+        for chunk in chunks(list(product_ids)):
+            scores.update(_get_scores(chunk))
+        _replace(scores)
+
+        available = set(Product.objects.filter(pk__in=product_ids,
+            available=True).values_list('pk', flat=True))
+        outdated = set()
+        for pk in product_ids:
+            # scores are symmetric, so the scores of a product are also its
+            # scores in the other products' similar products
+            outdated.update(_update_similar_to(pk,
+                scores[pk] if pk in available else {}, product_ids))
+        rebuild(outdated)
+
+def _get_scores(product_ids):
+    """
+    Get the scores of the products sharing categories with the given
+    products.
+
+    Returns:
+        dict mapping every product pk to a dict mapping the pks of the
+        (available and unavailable) products sharing categories with it to
+        (score, available) tuples
+    """
+    Through = Product.categories.through
+    category_ids = Through.objects.filter(
+        product_id__in=product_ids).values('category_id')
+    # counting in Python is a lot faster than letting the database join
+    # every category with itself and GROUP BY the pairs of products
+    members = defaultdict(list)
+    categories = defaultdict(list)
+    availability = {}
+    for pk, category_id, available in Through.objects.filter(
+            category_id__in=category_ids).values_list('product_id',
+                'category_id', 'product__available'):
+        members[category_id].append(pk)
+        categories[pk].append(category_id)
+        availability[pk] = available
+
+    scores = {}
+    for pk in product_ids:
+        counter = Counter()
+        for category_id in categories[pk]:
+            counter.update(members[category_id])
+        counter.pop(pk, None)
+        scores[pk] = {other_pk: (score, availability[other_pk])
+                                        for other_pk, score in counter.items()}
+    return scores
+
+def _replace(scores):
+    """
+    Replace the similar products of the products in `scores` (as returned
+    by _get_scores()) with their TOP_N best scoring available products.
+    """
+    for chunk in chunks(list(scores)):
+        ProductSimilarity.objects.filter(product_id__in=chunk).delete()
+    similarities = []
+    for pk, product_scores in scores.items():
+        ranked = sorted(((score, other_pk) for other_pk, (score, available)
+            in product_scores.items() if available), reverse=True)
+        similarities.extend(ProductSimilarity(product_id=pk,
+            similar_id=other_pk, score=score)
+            for score, other_pk in ranked[:ProductSimilarity.TOP_N])
+    ProductSimilarity.objects.bulk_create(similarities)
+
+def _update_similar_to(pk, product_scores, skip):
+    """
+    Update the similar products of the other products (except the ones in
+    `skip`) after the scores of the product `pk` changed to
+    `product_scores` (empty if it's not available anymore).
+
+    Returns:
+        the pks of the products whose similar products must be recomputed
+    """
+    scores = {other_pk: score for other_pk, (score, available)
+                    in product_scores.items() if other_pk not in skip}
+    listed = dict(ProductSimilarity.objects.filter(similar_id=pk).exclude(
+        product_id__in=skip).values_list('product_id', 'score'))
+
+    outdated = set()
+    increased = {}
+    for other_pk, old_score in listed.items():
+        score = scores.get(other_pk)
+        if score is None or score < old_score:
+            # dropped or ranked lower: another product may take its place
+            outdated.add(other_pk)
+        elif score > old_score:
+            increased.setdefault(score, []).append(other_pk)
+    for score, other_pks in increased.items():
+        for chunk in chunks(other_pks):
+            ProductSimilarity.objects.filter(similar_id=pk,
+                product_id__in=chunk).update(score=score)
+
+    added = {other_pk: score for other_pk, score in scores.items()
+                                                    if other_pk not in listed}
+    similarities = []
+    replaced = []
+    for chunk in chunks(list(added)):
+        counts = {}
+        lowest = {}
+        for other_pk, score, count, lowest_pk in (ProductSimilarity.objects
+                .filter(product_id__in=chunk)
+                .values_list('product_id', 'score')
+                .annotate(Count('pk'), Min('similar_id'))):
+            counts[other_pk] = counts.get(other_pk, 0) + count
+            lowest[other_pk] = min(lowest.get(other_pk, (score, lowest_pk)),
+                (score, lowest_pk))
+        for other_pk in chunk:
+            score = added[other_pk]
+            if counts.get(other_pk, 0) < ProductSimilarity.TOP_N:
+                # all the similar products are listed, so it just joins them
+                similarities.append(ProductSimilarity(product_id=other_pk,
+                    similar_id=pk, score=score))
+            elif (score, pk) > lowest[other_pk]:
+                # it takes the place of the lowest ranked one
+                similarities.append(ProductSimilarity(product_id=other_pk,
+                    similar_id=pk, score=score))
+                replaced.append((other_pk, lowest[other_pk][1]))
+    # two parameters per pair
+    for chunk in chunks(replaced, CHUNK_SIZE // 2):
+        ProductSimilarity.objects.filter(reduce(operator.or_, 
+            (Q(product_id=other_pk, similar_id=similar_pk) 
+                for other_pk, similar_pk in chunk))).delete()
+    ProductSimilarity.objects.bulk_create(similarities)
+    return outdated
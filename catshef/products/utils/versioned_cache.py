@@ -0,0 +1,62 @@
+"""
+Values computed per object (e.g. per product) cached both in the process
+and in the shared cache, under a version.
+
+The version is kept by the caller (usually a global version in the cache,
+see products.utils.pricing) and must change whenever any of the values may
+have changed, so nothing has to be deleted: values of older versions are
+just never looked up again. It must be seen by every process (so kept in a
+cache shared by them, see the CACHES setting), or the values kept in the
+other processes are never dropped. Values must be loaded after getting the
+version, so a value that changes meanwhile is cached under the old one.
+"""
+from django.core.cache import cache
+
+class VersionedCache(object):
+    """
+    Args:
+        key (str): the cache key of a value, formatted with the version and
+            the pk
+        load (callable): takes a set of pks, returns a dict mapping them to
+            their values
+        timeout (int): timeout of the values in the shared cache
+        max_local (int): max number of values kept in the process
+    """
+
+    def __init__(self, key, load, timeout=None, max_local=10000):
+        self.key = key
+        self.load = load
+        self.timeout = timeout
+        self.max_local = max_local
+        # (version, dict mapping pks to values)
+        self._local = (None, {})
+
+    def get_many(self, pks, version):
+        """
+        Get the values of the given pks (the ones not loaded are left out),
+        from the process, the shared cache or load().
+        """
+        pks = set(pks)
+        local_version, local = self._local
+        if local_version != version or len(local) > self.max_local:
+            local = {}
+            self._local = (version, local)
+
+        missing = pks.difference(local)
+        if missing:
+            keys = {self.key.format(version, pk): pk for pk in missing}
+            for key, value in cache.get_many(list(keys)).items():
+                local[keys[key]] = value
+            missing.difference_update(local)
+        if missing:
+            loaded = self.load(missing)
+            cache.set_many({self.key.format(version, pk): value
+                for pk, value in loaded.items()}, self.timeout)
+            local.update(loaded)
+        return {pk: local[pk] for pk in pks if pk in local}
+
+    def clear_local(self):
+        """
+        Forget the values kept in the process (not the shared ones).
+        """
+        self._local = (None, {})
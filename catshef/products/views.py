@@ -1,48 +1,227 @@
+from itertools import islice
+
 from django.shortcuts import render
-from products.models import Product, Category
-from django.http import HttpResponse
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from products.models import Product, Category, Ingridient
+from django.http import HttpResponse, Http404
+from django.template.loader import render_to_string
+from django.core.urlresolvers import reverse
+from django.utils.http import urlencode
 from common.decorators import ajax_required
+from common.holes import cached_render
+from common.pagination import KeysetPaginator, KeysetPage, InvalidCursor
+from common.streaming import stream_template
+from products.search import get_search_backend
+from products.utils import facets, page_cache
+
+# products per page in product listings
+PRODUCTS_PER_PAGE = 8
+
+# sort keys of the product listings (see common.pagination)
+INDEX_ORDERING = ('pk',)
+CATEGORY_ORDERING = ('-updated', '-pk')
+RELATED_ORDERING = ('-same_categories', '-pk')
+# the sort orders of the offers view, by the 'sort' GET parameter (the first
+# one is the default)
+OFFERS_ORDERINGS = (
+    ('discount', 'Biggest discount', ('-discount', '-pk')),
+    ('price', 'Lowest price', ('effective_price', 'pk')),
+)
+
+# the facets of the filter view, in the order they are listed
+FACET_LABELS = (
+    ('category', 'Category'),
+    ('price', 'Price'),
+    ('offer', 'On offer'),
+    ('ingridient', 'Ingridients'),
+    ('protein', 'Protein (g)'),
+    ('carbs', 'Carbs (g)'),
+    ('fat', 'Fat (g)'),
+    ('calories', 'Calories'),
+)
+
+def _get_products_page(request, paginator):
+    """
+    Get the page of products after the cursor in the 'cursor' GET parameter
+    (the first page, if it's missing).
+    """
+    try:
+        return paginator.page(request.GET.get('cursor'))
+    except InvalidCursor as err:
+        raise Http404(str(err))
 
 def index(request):
-    products = Product.objects.all()
-    return render(request, 'products/index.html', {
-        'products': products,
-        })
+    """
+    The homepage lists the available products, a page at a time (next pages
+    are loaded via AJAX, like in the category view).
+
+    The first page is streamed: the rest of the page is sent before the
+    products are even fetched, so the time to first byte doesn't depend on
+    the products.
+    """
+    products = Product.active.for_listing()
+    paginator = KeysetPaginator(products, INDEX_ORDERING, PRODUCTS_PER_PAGE)
+    if request.is_ajax():
+        return render(request, 'products/list_ajax.html', 
+            {'products': _get_products_page(request, paginator)})
+
+    def first_page():
+        yield render_to_string('products/list_ajax.html', {
+            'products': paginator.page()}, request=request)
+    return stream_template(request, 'products/index.html', {},
+        'products_list', first_page)
 
 def product_detail(request, slug):
-    product = Product.objects.get(slug=slug)
-    return render(request, 'products/detail.html', {'product': product})
+    """
+    The product detail page. It's cached (see products.utils.page_cache),
+    and only the per-user parts are rendered on a cache hit.
+    """
+    try:
+        key = page_cache.get_detail_page_key(slug)
+    except Product.DoesNotExist:
+        raise Http404('No such product')
+
+    def get_page():
+        product = Product.objects.for_detail().get(slug=slug)
+        return 'products/detail.html', {'product': product}
+    return cached_render(request, key, get_page,
+        page_cache.DETAIL_PAGE_TIMEOUT)
 
 def category(request, slug):
     category = Category.objects.get(slug=slug)
-    products = Product.objects.filter(categories=category)
-    paginator = Paginator(products, 8)
-    page_num = request.GET.get('page')
-    try:
-        products = paginator.page(page_num)
-    except PageNotAnInteger:
-        products = paginator.page(1)
-    except EmptyPage:
-        if request.is_ajax():
-            return HttpResponse('')
-        products = paginator.page(paginator.num_pages)
     if request.is_ajax():
-        return render(request, 'products/list_ajax.html', {'products':products,
-            'page_num':page_num})
-    return render(request, 'products/category_list.html', {'category':category})
+        # the products of the subcategories too
+        products = Product.objects.in_category(category).for_listing()
+        paginator = KeysetPaginator(products, CATEGORY_ORDERING,
+            PRODUCTS_PER_PAGE)
+        return render(request, 'products/list_ajax.html', 
+            {'products': _get_products_page(request, paginator)})
+    return render(request, 'products/category_list.html', {'category':category,
+        'breadcrumbs': category.get_ancestors()})
 
 @ajax_required
 def product_related(request, slug):
     product = Product.active.get(slug=slug)
-    products = product.similar_products()
-    paginator = Paginator(products, 8)
-    page_num = request.GET.get('page')
+    products = product.similar_products().for_listing()
+    paginator = KeysetPaginator(products, RELATED_ORDERING, PRODUCTS_PER_PAGE)
+    return render(request, 'products/list_ajax.html', 
+        {'products': _get_products_page(request, paginator)})
+
+def offers(request):
+    """
+    List the products on offer, sorted (by the database, see
+    ProductQuerySet.with_prices()) by their discount or by their price.
+    Like the other listings, pages after the first are loaded via AJAX.
+    """
+    orderings = {name: ordering for name, label, ordering in OFFERS_ORDERINGS}
+    sort = request.GET.get('sort') or OFFERS_ORDERINGS[0][0]
+    if sort not in orderings:
+        raise Http404('Invalid sort order')
 
+    products = Product.active.for_listing().filter(on_offer=True)
+    paginator = KeysetPaginator(products, orderings[sort], PRODUCTS_PER_PAGE)
+    page = _get_products_page(request, paginator)
+    if request.is_ajax():
+        return render(request, 'products/list_ajax.html', {'products': page})
+    return render(request, 'products/offers.html', {'products': page,
+        'sort': sort, 'sort_choices': [(name, label) for name, label, ordering
+                                                        in OFFERS_ORDERINGS],
+        'offers_url': '{}?{}'.format(reverse('products:offers'),
+            urlencode({'sort': sort}))})
+
+def search(request):
+    """
+    Search for products (see products.search), most relevant first. Like
+    the other listings, pages after the first are loaded via AJAX; the
+    cursor of a page is the number of results before it.
+    """
+    query = request.GET.get('q', '').strip()
+    try:
+        offset = int(request.GET.get('cursor') or 0)
+    except ValueError:
+        raise Http404('Invalid cursor')
+    if offset < 0:
+        raise Http404('Invalid cursor')
+
+    # one more, to know whether there's a next page
+    product_ids = get_search_backend().search(query, offset,
+        PRODUCTS_PER_PAGE + 1)
+    products = Product.active.for_listing().in_bulk(
+        product_ids[:PRODUCTS_PER_PAGE])
+    next_cursor = (str(offset + PRODUCTS_PER_PAGE) 
+        if len(product_ids) > PRODUCTS_PER_PAGE else None)
+    page = KeysetPage([products[pk] for pk in product_ids if pk in products],
+        str(offset) if offset else None, next_cursor)
+
+    if request.is_ajax():
+        return render(request, 'products/list_ajax.html', {'products': page})
+    return render(request, 'products/search.html', {'query': query,
+        'products': page, 'search_url': '{}?{}'.format(
+            reverse('products:search'), urlencode({'q': query}))})
+
+def products_filter(request):
+    """
+    Filter the products by facets (see products.utils.facets), listing the
+    values of every facet with their counts. Products are listed by pk, like
+    on the homepage; the cursor of a page is the pk of the last product
+    before it.
+    """
+    cursor = request.GET.get('cursor')
     try:
-        products = paginator.page(page_num)
-    except PageNotAnInteger:
-        products = paginator.page(1)
-    except EmptyPage:
-        return HttpResponse('')
-    return render(request, 'products/list_ajax.html', {'products':products})
+        after = int(cursor) if cursor else None
+    except ValueError:
+        raise Http404('Invalid cursor')
+    if after is not None and after < 0:
+        raise Http404('Invalid cursor')
+
+    selection = facets.get_selection(request.GET)
+    matching, counts = facets.filter_products(selection)
+    # one more, to know whether there's a next page
+    product_ids = list(islice(facets.iter_product_ids(matching, after),
+        PRODUCTS_PER_PAGE + 1))
+    products = Product.active.for_listing().in_bulk(
+        product_ids[:PRODUCTS_PER_PAGE])
+    next_cursor = (str(product_ids[PRODUCTS_PER_PAGE - 1])
+        if len(product_ids) > PRODUCTS_PER_PAGE else None)
+    page = KeysetPage([products[pk] for pk in product_ids if pk in products],
+        str(after) if after is not None else None, next_cursor)
+
+    if request.is_ajax():
+        return render(request, 'products/list_ajax.html', {'products': page})
+    query = sorted((facet, value) for facet, values in selection.items()
+                                                        for value in values)
+    return render(request, 'products/filter.html', {'products': page,
+        'count': facets.count(matching),
+        'facets': _get_facet_choices(counts, selection),
+        'filter_url': '{}?{}'.format(reverse('products:filter'),
+            urlencode(query))})
+
+def _get_facet_choices(counts, selection):
+    """
+    Get the facets to list in the filter view, as (label, name, choices)
+    tuples, with the choices as (value, label, count, selected) tuples.
+    """
+    names = {
+        'category': {str(pk): category.name for pk, category in
+            Category.objects.in_bulk(counts['category']).items()},
+        'ingridient': {str(pk): ingridient.name for pk, ingridient in
+            Ingridient.objects.in_bulk(counts['ingridient']).items()},
+        'offer': {'1': 'Yes', '0': 'No'},
+    }
+    bands = dict(facets.NUTRITION_BANDS, price=facets.PRICE_BANDS)
+
+    choices = []
+    for facet, label in FACET_LABELS:
+        facet_names = names.get(facet, {})
+        values = [(value, facet_names.get(value, value), count,
+            value in selection.get(facet, ())) 
+            for value, count in counts[facet].items()]
+        if facet in bands:
+            # in the order of the bands
+            order = [facets.get_band(bound, bands[facet]) 
+                                                    for bound in bands[facet]]
+            values.sort(key=lambda choice: order.index(choice[0]))
+        else:
+            values.sort(key=lambda choice: choice[1])
+        if values:
+            choices.append((label, facet, values))
+    return choices